@@ -1,44 +1,196 @@
 import os
 import json
 import logging
-from typing import Any, Text, Dict, List
+from datetime import datetime, timezone
+from typing import Any, Text, Dict, List, Tuple
 
 from rasa_sdk import Action, Tracker
+from rasa_sdk.events import SlotSet
 from rasa_sdk.executor import CollectingDispatcher
 
-import firebase_admin
-from firebase_admin import credentials, firestore
-
-######################## Initialize Firebase ########################
-
-def initialize_firebase():
-    """Initialize Firebase with either environment variable or local credentials file."""
-    try:
-        if not firebase_admin._apps:
-            # First, try to use environment variable (for Render deployment)
-            firebase_creds_json = os.environ.get('FIREBASE_CREDENTIALS')
-            if firebase_creds_json:
-                # Parse the JSON string from environment variable
-                cred_dict = json.loads(firebase_creds_json)
-                cred = credentials.Certificate(cred_dict)
-                firebase_admin.initialize_app(cred)
-                logging.info("Firebase initialized successfully from environment variable")
-            else:
-                # Fallback to local file for development
-                cred_path = os.environ.get('FIREBASE_CREDENTIALS_PATH', './aura-kart-firebase-adminsdk-448ve-f76ba9a07e.json')
-                cred = credentials.Certificate(cred_path)
-                firebase_admin.initialize_app(cred)
-                logging.info(f"Firebase initialized successfully from local file: {cred_path}")
-        else:
-            logging.info("Firebase already initialized")
-            
-        return firestore.client()
-    except Exception as e:
-        logging.error(f"Firebase initialization error: {e}")
-        return None
-
-# Initialize Firebase and get db client
-db = initialize_firebase()
+from actions import data_access, metrics
+from actions.catalog import ProductCatalog
+from actions.connection import FIREBASE_CONNECT, SANIC_WORKERS, ConnectionManager, forks_workers, start_in_workers
+from actions.data_access import UNAVAILABLE_ERRORS, fetch, load_once, run_blocking, with_deadline
+from actions.lookup_cache import DocumentLoader, KeyedCache
+from actions.metrics import instrumented
+from actions.order_index import OrderIndex
+from actions.pagination import CURSOR_SLOT, MORE_HINT, PAGE_SIZE, decode_cursor, encode_cursor
+from actions.price_index import firestore_price_range
+from actions.recommender import Recommender
+from actions.records import PRODUCT_FIELDS, ProductRecord
+from actions.rendering import render_cards, utter_products
+from actions.response_cache import ResponseCache
+from actions.taxonomy import Taxonomy
+
+######################## Firestore Connection ########################
+
+# Firebase is initialized, the channel warmed and the catalog/taxonomy
+# prefetched on a background thread, so the action server binds its port
+# immediately. Actions wait briefly for the client on their first read, and
+# /ready on ACTION_METRICS_PORT only reports ready once everything is warm.
+connection = ConnectionManager()
+
+######################## Product Catalog ########################
+
+# Shared in-memory copy of the Products collection, loaded once at startup and
+# kept current by a Firestore listener so searches don't re-read every product.
+catalog = ProductCatalog()
+
+# Cached categories, brands and brand -> products postings, rebuilt from change
+# events instead of being queried per message.
+# TAXONOMY_TTL only applies when the change listener can't be used.
+taxonomy = Taxonomy(ttl=float(os.environ.get('TAXONOMY_TTL', '300')),
+                    retry_interval=float(os.environ.get('TAXONOMY_RETRY_INTERVAL', '10')))
+catalog.add_listener(taxonomy.apply_products)
+
+# Item-similarity vectors for every product, updated from the same deltas.
+recommender = Recommender(catalog.products)
+catalog.add_listener(recommender.apply)
+
+# A snapshot file (see `python -m actions.snapshot export`) makes the catalog
+# and taxonomy usable right away; the listener then only applies what changed.
+# With CATALOG_UPDATED_FIELD (a server-set update timestamp on products) the
+# listener is limited to products changed after the snapshot was written.
+#
+# CATALOG_MODE=snapshot is the multi-worker mode (see actions/serve.py): the
+# `actions.updater` process owns the listeners and republishes the snapshot,
+# and every worker just maps each new version.
+CATALOG_MODE = os.environ.get('CATALOG_MODE', 'listener').lower()
+CATALOG_SNAPSHOT = os.environ.get('CATALOG_SNAPSHOT')
+CATALOG_UPDATED_FIELD = os.environ.get('CATALOG_UPDATED_FIELD')
+CATALOG_RELOAD_INTERVAL = float(os.environ.get('CATALOG_RELOAD_INTERVAL', '1'))
+
+def load_snapshot_taxonomy() -> None:
+    taxonomy.load(*catalog.snapshot_taxonomy(), kept_current=CATALOG_MODE == 'snapshot')
+
+if CATALOG_MODE == 'snapshot':
+    # Price ranges are answered by the mapped file, so no price index is built.
+    catalog.share()
+if CATALOG_SNAPSHOT and os.path.exists(CATALOG_SNAPSHOT) and catalog.load_snapshot(CATALOG_SNAPSHOT):
+    load_snapshot_taxonomy()
+    # Sort now what the first queries would, so forked workers share these
+    # pages instead of each copying them.
+    catalog.settle()
+    taxonomy.settle()
+
+def start_catalog(db: Any, wait: bool = True) -> bool:
+    if CATALOG_MODE == 'snapshot':
+        return catalog.follow_snapshot(CATALOG_SNAPSHOT, CATALOG_RELOAD_INTERVAL,
+                                       on_load=load_snapshot_taxonomy, wait=wait)
+    products = db.collection('Products')
+    if CATALOG_UPDATED_FIELD and catalog.snapshot_created_at is not None:
+        since = datetime.fromtimestamp(catalog.snapshot_created_at, tz=timezone.utc)
+        return catalog.start(products.where(CATALOG_UPDATED_FIELD, '>', since), incremental=True)
+    return catalog.start(products)
+
+if CATALOG_MODE == 'snapshot':
+    start_in_workers(lambda: start_catalog(None, wait=False))
+else:
+    connection.add_warmer('taxonomy', taxonomy.start)
+connection.add_warmer('catalog', start_catalog)
+# A readiness probe only reaches one of several workers, so they all connect
+# at startup even with FIREBASE_CONNECT=lazy.
+if FIREBASE_CONNECT != 'lazy' or SANIC_WORKERS > 1:
+    start_in_workers(connection.start)
+
+# The catalog and taxonomy loads below go through `load_once`: one at a time,
+# outside the action deadline and the circuit breaker.
+async def get_catalog() -> ProductCatalog:
+    """Return the live product catalog, subscribing first if startup could not."""
+    if not catalog.ready:
+        db = None if CATALOG_MODE == 'snapshot' else await connection.sync_client()
+        if not await load_once('catalog', start_catalog, db):
+            raise RuntimeError("Product catalog is not available")
+    return catalog
+
+async def get_taxonomy() -> Taxonomy:
+    """Return the taxonomy, reloading it off the event loop once its TTL has expired."""
+    if taxonomy.stale:
+        try:
+            await load_once('taxonomy', taxonomy.refresh, await connection.sync_client())
+        except UNAVAILABLE_ERRORS as e:
+            if not taxonomy.loaded:
+                raise
+            # Not stale again until the retry interval has passed, so the queries below don't reload it on the loop.
+            taxonomy.refresh_failed()
+            logging.warning(f"Serving the cached taxonomy while Firestore is unavailable: {e!r}")
+    return taxonomy
+
+######################## Response Cache ########################
+
+# Featured listings are the same for every user, so their rendered text is
+# shared between conversations for a per-action TTL (seconds).
+RESPONSE_TTLS = {
+    'action_show_categories': float(os.environ.get('CATEGORIES_RESPONSE_TTL', '300')),
+    'action_show_brands': float(os.environ.get('BRANDS_RESPONSE_TTL', '300')),
+    'action_show_products': float(os.environ.get('PRODUCTS_RESPONSE_TTL', '60')),
+    'action_product_recommendations': float(os.environ.get('RECOMMENDATIONS_RESPONSE_TTL', '60')),
+}
+response_cache = ResponseCache(max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', '128')))
+
+######################## Order & User Lookups ########################
+
+# Customers ask about the same order or profile several times per session, so
+# lookups go through a short-lived per-id cache (with "not found" cached too),
+# and concurrent misses within a few ms share one `get_all` round trip.
+# While Firestore times out or the circuit breaker is open, expired entries
+# are served for up to LOOKUP_MAX_STALE seconds.
+LOOKUP_BATCH_WINDOW = float(os.environ.get('LOOKUP_BATCH_WINDOW', '0.005'))
+LOOKUP_NEGATIVE_TTL = float(os.environ.get('LOOKUP_NEGATIVE_TTL', '5'))
+LOOKUP_MAX_STALE = float(os.environ.get('LOOKUP_MAX_STALE', '600'))
+orders = DocumentLoader(connection.read_client, 'Orders', KeyedCache(
+    ttl=float(os.environ.get('ORDER_CACHE_TTL', '15')), negative_ttl=LOOKUP_NEGATIVE_TTL,
+    max_stale=LOOKUP_MAX_STALE), window=LOOKUP_BATCH_WINDOW)
+users = DocumentLoader(connection.read_client, 'Users', KeyedCache(
+    ttl=float(os.environ.get('USER_CACHE_TTL', '60')), negative_ttl=LOOKUP_NEGATIVE_TTL,
+    max_stale=LOOKUP_MAX_STALE), window=LOOKUP_BATCH_WINDOW)
+
+# "My orders" lists a user's latest orders from one indexed query (see
+# firestore.indexes.json), cached per user until a change event for one of
+# their orders arrives. The same events drop single-order lookups above.
+order_index = OrderIndex(
+    connection.read_client,
+    user_field=os.environ.get('ORDERS_USER_FIELD', 'userId'),
+    sort_field=os.environ.get('ORDERS_SORT_FIELD', 'orderDate'),
+    limit=int(os.environ.get('ORDER_LIST_LIMIT', '5')),
+    ttl=float(os.environ.get('ORDER_LIST_CACHE_TTL', '300')),
+    watch_window=int(os.environ.get('ORDER_WATCH_WINDOW', '500')),
+    max_stale=LOOKUP_MAX_STALE)
+order_index.add_listener(orders.cache.invalidate)
+connection.add_warmer('orders', order_index.start)
+
+######################## Metrics ########################
+
+# With ACTION_METRICS=1 every action run is timed and its Firestore reads,
+# rendered bytes and cache hits are exported on ACTION_METRICS_PORT/metrics.
+# /ready is always served there for container health checks. With several
+# workers both cover all of them: /ready waits for every worker to be ready.
+def readiness() -> Tuple[int, Text, Text]:
+    if FIREBASE_CONNECT == 'lazy':
+        connection.start()
+    status = connection.status()
+    workers = metrics.worker_states()
+    if workers is not None:
+        statuses = {str(worker['pid']): worker['status'] for worker in workers}
+        ready = len(statuses) >= SANIC_WORKERS and all(worker['ready'] for worker in statuses.values())
+        status = {'ready': ready, 'workers': statuses}
+    return (200 if status['ready'] else 503), 'application/json', json.dumps(status)
+
+if forks_workers():
+    metrics.share_across_workers(connection.status)
+metrics.add_route('/ready', readiness)
+metrics.register_counters('action_cold_start_seconds', "Seconds spent in each startup phase",
+                          lambda: connection.timings, kind='gauge')
+if metrics.ENABLED:
+    metrics.register_counters('action_response_cache_events_total',
+                              "Response cache hits, misses, refreshes and errors", response_cache.snapshot)
+    metrics.register_counters('action_firestore_calls_total',
+                              "Firestore calls, failures, retries, breaker rejections and missed deadlines",
+                              data_access.snapshot)
+    metrics.register_counters('action_firestore_circuit_state', "1 for the Firestore circuit breaker's state",
+                              data_access.breaker.snapshot, kind='gauge')
+start_in_workers(metrics.start_server)
 
 ######################## Show Categories ########################
 
@@ -46,35 +198,13 @@ class ActionShowCategories(Action):
     def name(self) -> Text:
         return "action_show_categories"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         try:
-            # Get featured categories from Firestore
-            categories_ref = db.collection('Categories').where('IsFeatured', '==', True)
-            categories = categories_ref.get()
-            
-            if not categories:
-                dispatcher.utter_message(text="🏷️ Our category showcase is taking a quick break. Check back soon for exciting updates!")
-                return []
-            
-            # Format response
-            category_list = []
-            for category in categories:
-                cat_data = category.to_dict()
-                if not cat_data.get('ParentId'):
-                    title = cat_data.get('Name', 'Unnamed Category')
-                    
-                    # Find subcategories for this category
-                    subcategories = db.collection('Categories').where('parentId', '==', category.id).get()
-                    subcategory_names = [sub.to_dict().get('Name', 'Unnamed Subcategory') for sub in subcategories]
-                    
-                    if subcategory_names:
-                        category_list.append(f"🌟 {title} (Subcategories: {', '.join(subcategory_names)})")
-                    else:
-                        category_list.append(f"🌟 {title}")
-  
-            message = "🌈 Discover Our Featured Categories:\n" + "\n".join(category_list)
+            message = await response_cache.get_or_load(self.name(), self.render, ttl=RESPONSE_TTLS[self.name()])
             dispatcher.utter_message(text=message)
                 
         except Exception as e:
@@ -83,33 +213,36 @@ class ActionShowCategories(Action):
 
         return []
 
+    async def render(self) -> Text:
+        # Get featured top-level categories and their subcategories from the cached taxonomy
+        categories = (await get_taxonomy()).featured_categories()
+        
+        if not categories:
+            return "🏷️ Our category showcase is taking a quick break. Check back soon for exciting updates!"
+        
+        # Format response
+        category_list = []
+        for title, subcategory_names in categories:
+            if subcategory_names:
+                category_list.append(f"🌟 {title} (Subcategories: {', '.join(subcategory_names)})")
+            else:
+                category_list.append(f"🌟 {title}")
+
+        return "🌈 Discover Our Featured Categories:\n" + "\n".join(category_list)
+
 ######################## Show Brands ########################
 
 class ActionShowBrands(Action):
     def name(self) -> Text:
         return "action_show_brands"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         try:
-            # Get featured brands from Firestore
-            brands_ref = db.collection('Brands').where('IsFeatured', '==', True)
-            brands = brands_ref.get()
-            
-            if not brands:
-                dispatcher.utter_message(text="🏢 Our brand showcase is taking a short break. Exciting brands coming soon!")
-                return []
-    
-            # Format response
-            brand_list = []
-            for brand in brands:
-                brand_data = brand.to_dict()
-                title = brand_data.get('Name', 'Unnamed Brand')
-                productCount = brand_data.get('ProductsCount', 0)
-                brand_list.append(f"🏷️ {title} (Available Products: {productCount})")
-            
-            message = "🌟 Featured Brands We Love:\n" + "\n".join(brand_list)
+            message = await response_cache.get_or_load(self.name(), self.render, ttl=RESPONSE_TTLS[self.name()])
             dispatcher.utter_message(text=message)
                 
         except Exception as e:
@@ -118,40 +251,39 @@ class ActionShowBrands(Action):
             
         return []
 
+    async def render(self) -> Text:
+        # Get featured brands from Firestore
+        db = await connection.read_client()
+        brands_ref = db.collection('Brands').where('IsFeatured', '==', True)
+        brands = await fetch(brands_ref)
+        
+        if not brands:
+            return "🏢 Our brand showcase is taking a short break. Exciting brands coming soon!"
+
+        # Format response
+        brand_list = []
+        for brand in brands:
+            brand_data = brand.to_dict()
+            title = brand_data.get('Name', 'Unnamed Brand')
+            productCount = brand_data.get('ProductsCount', 0)
+            brand_list.append(f"🏷️ {title} (Available Products: {productCount})")
+        
+        return "🌟 Featured Brands We Love:\n" + "\n".join(brand_list)
+
 ######################## Show Products ########################
 
 class ActionShowProducts(Action):
     def name(self) -> Text:
         return "action_show_products"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         try:
-            # Get featured products from Firestore
-            products_ref = db.collection('Products').where('IsFeatured', '==', True).limit(6)
-            products = products_ref.get()
-            
-            if not products:
-                dispatcher.utter_message(text="🛍️ Our product shelves are looking a bit empty today. New arrivals coming soon!")
-                return []
-            
-            # Format response
-            product_list = []
-            for product in products:
-                product_data = product.to_dict()
-                title = product_data.get('Title', 'Unnamed Product')
-                price = product_data.get('Price', 0)
-                sale_price = product_data.get('SalePrice', 0)
-                stock = product_data.get('Stock', 0)
-
-                if sale_price > 0 and sale_price < price:
-                    product_list.append(f"🔥 {title}\n   Regular Price: ₹{price}\n   🏷️ Special Offer: ₹{sale_price}\n   📦 {stock} left in stock")
-                else:
-                    product_list.append(f"✨ {title}\n   Price: ₹{price}\n   📦 {stock} left in stock")
-            
-            message = "🌈 Our Handpicked Featured Products:\n\n" + "\n\n".join(product_list)
-            dispatcher.utter_message(text=message)
+            message, cards = await response_cache.get_or_load(self.name(), self.render, ttl=RESPONSE_TTLS[self.name()])
+            utter_products(dispatcher, tracker, message, cards)
                 
         except Exception as e:
             logging.error(f"Error fetching products: {e}")
@@ -159,77 +291,82 @@ class ActionShowProducts(Action):
             
         return []
 
+    async def render(self) -> Tuple[Text, List[ProductRecord]]:
+        # Get featured products from Firestore
+        db = await connection.read_client()
+        products_ref = db.collection('Products').where('IsFeatured', '==', True).select(PRODUCT_FIELDS).limit(6)
+        products = await fetch(products_ref)
+        
+        if not products:
+            return "🛍️ Our product shelves are looking a bit empty today. New arrivals coming soon!", []
+        
+        # Format response
+        cards = ProductRecord.from_snapshots(products)
+        return "🌈 Our Handpicked Featured Products:\n\n" + render_cards(cards, featured=True), cards
+
 ######################## Search Product By Name ########################
 
 class ActionSearchProduct(Action):
+    page_size = PAGE_SIZE
+
     def name(self) -> Text:
         return "action_search_product"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         try:
             # Get the product name from the entity
             product_name = tracker.get_slot('product')
             
             if not product_name:
                 dispatcher.utter_message(text="🔍 What product are you hunting for today? Let me help you find it!")
-                return []
-            
-            products_ref = db.collection('Products')
-            products = products_ref.get()
-            
-            search_term = product_name.lower()
-            matching_products = []
-            
-            for product in products:
-                product_data = product.to_dict()
-                title = product_data.get('Title', '')
-                if search_term in title.lower():
-                    price = product_data.get('Price', 0)
-                    sale_price = product_data.get('SalePrice', 0)
-                    stock = product_data.get('Stock', 0)
-                    
-                    product_info = {
-                        'title': title,
-                        'price': price,
-                        'sale_price': sale_price,
-                        'stock': stock
-                    }
-                    matching_products.append(product_info)
+                return [SlotSet(CURSOR_SLOT, None)]
             
-            if matching_products:
-                message = f"🔍 Results for '{product_name}':\n\n"
-                for product in matching_products[:5]:
-                    if product['sale_price'] > 0 and product['sale_price'] < product['price']:
-                        message += (f"🌟 {product['title']}\n"
-                                    f"   Regular Price: ₹{product['price']}\n"
-                                    f"   🏷️ Special Offer: ₹{product['sale_price']}\n"
-                                    f"   📦 {product['stock']} available\n\n")
-                    else:
-                        message += (f"✨ {product['title']}\n"
-                                    f"   Price: ₹{product['price']}\n"
-                                    f"   📦 {product['stock']} available\n\n")
-                
-                dispatcher.utter_message(text=message)
-            else:
-                dispatcher.utter_message(text=f"🤷‍♀️ No matches found for '{product_name}'. Want to try a different search?")
+            return await self.show_page(dispatcher, tracker, {'q': product_name, 'o': 0})
                 
         except Exception as e:
             logging.error(f"Error searching for product: {e}")
             dispatcher.utter_message(text="🤖 Our search magic is temporarily on the fritz. Please try again later!") 
             
-        return []
+        return [SlotSet(CURSOR_SLOT, None)]
+
+    async def show_page(self, dispatcher: CollectingDispatcher, tracker: Tracker,
+                        state: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        product_name, offset = state['q'], state['o']
+
+        # One page plus a lookahead result tells whether there is a next page
+        matching_products = (await get_catalog()).search_title(product_name, limit=self.page_size + 1, offset=offset)
+        has_more = len(matching_products) > self.page_size
+        matching_products = matching_products[:self.page_size]
+        
+        if matching_products:
+            heading = "🔍 More results" if offset else "🔍 Results"
+            message = f"{heading} for '{product_name}':\n\n" + render_cards(matching_products)
+            if has_more:
+                message += MORE_HINT
+            utter_products(dispatcher, tracker, message, matching_products)
+        else:
+            dispatcher.utter_message(text=f"🤷‍♀️ No matches found for '{product_name}'. Want to try a different search?")
+
+        cursor = encode_cursor(self.name(), q=product_name, o=offset + self.page_size) if has_more else None
+        return [SlotSet(CURSOR_SLOT, cursor)]
 
 ######################## Search Product By Price Range ########################
 
 class ActionSearchProductByPriceRange(Action):
+    page_size = PAGE_SIZE
+
     def name(self) -> Text:
         return "action_search_product_by_price_range"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         try:
             # Extract price range from slots or entities
             min_price = tracker.get_slot('min_price') or 0
@@ -241,186 +378,230 @@ class ActionSearchProductByPriceRange(Action):
                 max_price = float(max_price)
             except ValueError:
                 dispatcher.utter_message(text="🚫 Oops! Please provide valid price range numbers.")
-                return []
+                return [SlotSet(CURSOR_SLOT, None)]
             
-            # Search for products in price range
-            products_ref = db.collection('Products')
-            products = products_ref.get()
-            
-            matching_products = []
-            for product in products:
-                product_data = product.to_dict()
-                price = product_data.get('Price', 0)
-                
-                if min_price <= price <= max_price:
-                    matching_products.append(product_data)
-            
-            if matching_products:
-                message = f"🔍 Products between ₹{min_price} and ₹{max_price}:\n\n"
-                for product in matching_products[:5]:
-                    title = product.get('Title', 'Unnamed Product')
-                    price = product.get('Price', 0)
-                    sale_price = product.get('SalePrice', 0)
-                    stock = product.get('Stock', 0)
-
-                    if sale_price > 0 and sale_price < price:
-                        message += (f"🌟 {title}\n"
-                                    f"   Regular Price: ₹{price}\n"
-                                    f"   🏷️ Special Offer: ₹{sale_price}\n"
-                                    f"   📦 {stock} available\n\n")
-                    else:
-                        message += (f"✨ {title}\n"
-                                    f"   Price: ₹{price}\n"
-                                    f"   📦 {stock} available\n\n")
-                
-                if len(matching_products) > 5:
-                    message += f"... and {len(matching_products) - 5} more products"
-                
-                dispatcher.utter_message(text=message)
-            else:
-                dispatcher.utter_message(text=f"🤷‍♀️ No products found between ₹{min_price} and ₹{max_price}.")
+            return await self.show_page(dispatcher, tracker, {
+                'lo': min_price, 'hi': None if max_price == float('inf') else max_price, 'o': 0})
                 
         except Exception as e:
             logging.error(f"Error searching products by price: {e}")
             dispatcher.utter_message(text="🤖 Sorry, I'm having trouble searching products by price range.") 
             
-        return []
+        return [SlotSet(CURSOR_SLOT, None)]
+
+    async def show_page(self, dispatcher: CollectingDispatcher, tracker: Tracker,
+                        state: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        min_price, offset = state['lo'], state['o']
+        max_price = float('inf') if state['hi'] is None else state['hi']
+
+        # Search for products in price range, in Firestore if the catalog isn't
+        # loaded (or the first page came from there, so the ordering stays the same)
+        if catalog.ready and 'after' not in state:
+            matching_products, total = catalog.in_price_range(min_price, max_price, limit=self.page_size, offset=offset)
+            next_state = {'o': offset + len(matching_products)}
+        else:
+            db = await connection.sync_client()
+            after = state.get('after')
+            matching_products, total = await run_blocking(
+                firestore_price_range, db.collection('Products'), min_price, max_price,
+                limit=self.page_size, after=tuple(after) if after else None)
+            # A projected query, plus a count aggregation (billed as a single read) on the first page
+            metrics.record_read(len(matching_products) + (after is None), round_trips=1 + (after is None))
+            if total is None:
+                total = state['t']
+            next_state = {'o': offset + len(matching_products), 't': total}
+            if matching_products:
+                next_state['after'] = [matching_products[-1].price, matching_products[-1].id]
+        remaining = total - next_state['o']
+        
+        if matching_products:
+            heading = "🔍 More products" if offset else "🔍 Products"
+            message = f"{heading} between ₹{min_price} and ₹{max_price}:\n\n" + render_cards(matching_products)
+            
+            if remaining > 0:
+                message += f"\n\n... and {remaining} more products. Say \"show more\" to see them."
+            
+            utter_products(dispatcher, tracker, message, matching_products)
+        else:
+            dispatcher.utter_message(text=f"🤷‍♀️ No products found between ₹{min_price} and ₹{max_price}.")
+
+        cursor = None
+        if remaining > 0 and matching_products:
+            cursor = encode_cursor(self.name(), lo=state['lo'], hi=state['hi'], **next_state)
+        return [SlotSet(CURSOR_SLOT, cursor)]
 
 ######################## Show Products By Category ########################
 
 class ActionShowProductsByCategory(Action):
+    page_size = 10
+
     def name(self) -> Text:
         return "action_show_products_by_category"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         try:
             # Get the category name from the entity
             category_name = tracker.get_slot('category')
             
             if not category_name:
                 dispatcher.utter_message(text="🤔 Which category are you interested in? Let me help you explore!")
-                return []
+                return [SlotSet(CURSOR_SLOT, None)]
             
             # First, find the category ID by name
-            categories_ref = db.collection('Categories')
-            categories = categories_ref.get()
-            
-            category_id = None
-            for category in categories:
-                category_data = category.to_dict()
-                if category_name.lower() in category_data.get('Name', '').lower():
-                    category_id = category.id
-                    break
+            category_id = (await get_taxonomy()).find_category(category_name)
             
             if not category_id:
                 dispatcher.utter_message(text=f"🤷‍♀️ We couldn't find a category named '{category_name}'. Would you like to see all our categories?")
-                return []
-            
-            # Now get products in this category
-            products_ref = db.collection('Products').where('CategoryId', '==', category_id).limit(10)
-            products = products_ref.get()
+                return [SlotSet(CURSOR_SLOT, None)]
             
-            if not products:
-                dispatcher.utter_message(text=f"🏷️ We don't have any products in the '{category_name}' category at the moment.")
-                return []
-            
-            # Format response
-            product_list = []
-            for product in products:
-                product_data = product.to_dict()
-                title = product_data.get('Title', 'Unnamed product')
-                price = product_data.get('Price', 0)
-                sale_price = product_data.get('SalePrice', 0)
-                stock = product_data.get('Stock', 0)
-                
-                if sale_price > 0 and sale_price < price:
-                    product_list.append(f"🌟 {title}\n   Regular Price: ₹{price}\n   🏷️ Special Offer: ₹{sale_price}\n   📦 {stock} available")
-                else:
-                    product_list.append(f"✨ {title}\n   Price: ₹{price}\n   📦 {stock} available")
-            
-            message = f"🏷️ Products in the '{category_name}' Category:\n\n" + "\n\n".join(product_list)
-            dispatcher.utter_message(text=message)
+            return await self.show_page(dispatcher, tracker, {'c': category_id, 'n': category_name, 'after': None})
                 
         except Exception as e:
             logging.error(f"Error fetching products by category: {e}")
             dispatcher.utter_message(text="🤖 Sorry, I'm having trouble retrieving products by category right now.") 
             
-        return []
+        return [SlotSet(CURSOR_SLOT, None)]
+
+    async def show_page(self, dispatcher: CollectingDispatcher, tracker: Tracker,
+                        state: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        category_name, after = state['n'], state['after']
+
+        # Get one page of products in this category (plus one to detect a next
+        # page), resuming after the last document id shown
+        db = await connection.read_client()
+        products_ref = (db.collection('Products').where('CategoryId', '==', state['c'])
+            .order_by('__name__'))
+        if after:
+            products_ref = products_ref.start_after({'__name__': after})
+        products = await fetch(products_ref.select(PRODUCT_FIELDS).limit(self.page_size + 1))
+        
+        if not products:
+            if after:
+                dispatcher.utter_message(text=f"🏷️ That's everything in the '{category_name}' category.")
+            else:
+                dispatcher.utter_message(text=f"🏷️ We don't have any products in the '{category_name}' category at the moment.")
+            return [SlotSet(CURSOR_SLOT, None)]
+        
+        # Format response
+        cards = ProductRecord.from_snapshots(products[:self.page_size], default_title='Unnamed product')
+        has_more = len(products) > self.page_size
+        heading = "🏷️ More products" if after else "🏷️ Products"
+        message = f"{heading} in the '{category_name}' Category:\n\n" + render_cards(cards)
+        if has_more:
+            message += MORE_HINT
+        utter_products(dispatcher, tracker, message, cards)
+
+        cursor = encode_cursor(self.name(), c=state['c'], n=category_name, after=cards[-1].id) if has_more else None
+        return [SlotSet(CURSOR_SLOT, cursor)]
 
 ######################## Show Products By Brand ########################
 
 class ActionShowProductsByBrand(Action):
+    page_size = PAGE_SIZE
+
     def name(self) -> Text:
         return "action_show_products_by_brand"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         try:
             # Get the brand name from the entity
             brand_name = tracker.get_slot('brand')
             
             if not brand_name:
                 dispatcher.utter_message(text="🤔 Which brand are you curious about? Let me help you explore!")
-                return []
+                return [SlotSet(CURSOR_SLOT, None)]
             
-            products_ref = db.collection('Products')
-            products = products_ref.get()
-            
-            # Filter products with matching brand
-            matching_products = []
-            for product in products:
-                product_data = product.to_dict()
-                brand_data = product_data.get('Brand', {})
-                
-                if brand_data and brand_name.lower() in brand_data.get('Name', '').lower():
-                    title = product_data.get('Title', 'Unnamed product')
-                    price = product_data.get('Price', 0)
-                    sale_price = product_data.get('SalePrice', 0)
-                    stock = product_data.get('Stock', 0)
-                    
-                    product_info = {
-                        'title': title,
-                        'price': price,
-                        'sale_price': sale_price,
-                        'stock': stock
-                    }
-                    matching_products.append(product_info)
-            
-            if matching_products:
-                message = f"🏷️ Products from '{brand_name}':\n\n"
-                for product in matching_products[:5]:
-                    if product['sale_price'] > 0 and product['sale_price'] < product['price']:
-                        message += (f"🌟 {product['title']}\n"
-                                    f"   Regular Price: ₹{product['price']}\n"
-                                    f"   🏷️ Special Offer: ₹{product['sale_price']}\n"
-                                    f"   📦 {product['stock']} available\n\n")
-                    else:
-                        message += (f"✨ {product['title']}\n"
-                                    f"   Price: ₹{product['price']}\n"
-                                    f"   📦 {product['stock']} available\n\n")
-                
-                dispatcher.utter_message(text=message)
-            else:
-                dispatcher.utter_message(text=f"🤷‍♀️ No products found from the brand '{brand_name}'. Would you like to see all our brands?")
+            return await self.show_page(dispatcher, tracker, {'b': brand_name, 'after': None})
                 
         except Exception as e:
             logging.error(f"Error fetching products by brand: {e}")
             dispatcher.utter_message(text="🤖 Sorry, I'm having trouble retrieving products by brand right now.") 
             
-        return []
+        return [SlotSet(CURSOR_SLOT, None)]
+
+    async def show_page(self, dispatcher: CollectingDispatcher, tracker: Tracker,
+                        state: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        brand_name, after = state['b'], state['after']
+
+        # Look up one page of products with matching brand, after the last id shown
+        products = await get_catalog()
+        product_ids, _ = taxonomy.products_for_brand(brand_name, limit=self.page_size + 1, after=after)
+        has_more = len(product_ids) > self.page_size
+        matching_products = [product for product in map(products.get, product_ids[:self.page_size]) if product is not None]
+        
+        if matching_products:
+            heading = "🏷️ More products" if after else "🏷️ Products"
+            message = f"{heading} from '{brand_name}':\n\n" + render_cards(matching_products)
+            if has_more:
+                message += MORE_HINT
+            utter_products(dispatcher, tracker, message, matching_products)
+        else:
+            dispatcher.utter_message(text=f"🤷‍♀️ No products found from the brand '{brand_name}'. Would you like to see all our brands?")
+
+        cursor = encode_cursor(self.name(), b=brand_name, after=product_ids[self.page_size - 1]) if has_more else None
+        return [SlotSet(CURSOR_SLOT, cursor)]
+
+######################## Show More Results ########################
+
+class ActionShowMore(Action):
+    def name(self) -> Text:
+        return "action_show_more"
+
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        # Resume the last paged search or listing from its cursor
+        state = decode_cursor(tracker.get_slot(CURSOR_SLOT))
+        action = PAGED_ACTIONS.get(state['a']) if state else None
+        
+        if action is None:
+            dispatcher.utter_message(text="🤷‍♀️ There's nothing more to show right now. What would you like to look for?")
+            return [SlotSet(CURSOR_SLOT, None)]
+        
+        try:
+            return await action.show_page(dispatcher, tracker, state)
+        except Exception as e:
+            logging.error(f"Error showing more results for {state['a']}: {e}")
+            dispatcher.utter_message(text="🤖 Sorry, I couldn't load more results right now. Please try again!")
+            
+        # Drop the cursor, so a broken one doesn't fail every later "show more" the same way.
+        return [SlotSet(CURSOR_SLOT, None)]
+
+PAGED_ACTIONS = {
+    action.name(): action
+    for action in (ActionSearchProduct(), ActionSearchProductByPriceRange(),
+                   ActionShowProductsByCategory(), ActionShowProductsByBrand())
+}
 
 ######################## Order Status Tracking ########################
 
+STATUS_MESSAGES = {
+    'OrderStatus.processing': '🔄 Your order is being prepared',
+    'OrderStatus.shipped': '🚚 Your order is on its way',
+    'OrderStatus.pending': '⏳ Your order is pending',
+    'OrderStatus.delivered': '✅ Your order has been successfully delivered',
+    'OrderStatus.cancelled': '❌ Your order has been cancelled'
+}
+
 class ActionTrackOrder(Action):
     def name(self) -> Text:
         return "action_track_order"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         try:
             order_id = tracker.get_slot('order_id')
             
@@ -428,28 +609,18 @@ class ActionTrackOrder(Action):
                 dispatcher.utter_message(text="🔍 Please provide a valid order ID to track your purchase.")
                 return []
             
-            order_ref = db.collection('Orders').document(order_id)
-            order = order_ref.get()
+            order_data = await orders.get(order_id)
             
-            if not order.exists:
+            if order_data is None:
                 dispatcher.utter_message(text=f"🤷‍♀️ No order found with ID {order_id}.")
                 return []
             
-            order_data = order.to_dict()
             status = order_data.get('status', 'N/A')
             estimated_delivery = order_data.get('deliveryDate', 'N/A')
             items = order_data.get('items', [])
             total = order_data.get('totalAmount', 0)
-
-            status_messages = {
-                'OrderStatus.processing': '🔄 Your order is being prepared',
-                'OrderStatus.shipped': '🚚 Your order is on its way',
-                'OrderStatus.pending': '⏳ Your order is pending',
-                'OrderStatus.delivered': '✅ Your order has been successfully delivered',
-                'OrderStatus.cancelled': '❌ Your order has been cancelled'
-            }
             
-            friendly_status = status_messages.get(status, status)
+            friendly_status = STATUS_MESSAGES.get(status, status)
             
             message = f"""
                 🧾 Order Status Details:
@@ -468,15 +639,60 @@ class ActionTrackOrder(Action):
         
         return []
 
+######################## User Orders ########################
+
+class ActionListUserOrders(Action):
+    def name(self) -> Text:
+        return "action_list_user_orders"
+
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        try:
+            user_id = tracker.get_slot('user_id')
+            
+            if not user_id:
+                dispatcher.utter_message(text="🔍 Please provide your user ID so I can find your orders.")
+                return []
+            
+            # Summaries only; the items are read when the user picks an order.
+            recent_orders = await order_index.recent(user_id)
+            
+            if not recent_orders:
+                dispatcher.utter_message(text=f"🤷‍♀️ No orders found for user {user_id}.")
+                return []
+            
+            lines = []
+            buttons = []
+            for order in recent_orders:
+                status = order.get('status', 'N/A')
+                lines.append(f"- 🏷️ {order['id']}: {STATUS_MESSAGES.get(status, status)} "
+                             f"(📅 {order.get(order_index.sort_field, 'N/A')}, 💰 ₹{order.get('totalAmount', 0)})")
+                buttons.append({'title': f"🧾 {order['id']}",
+                                'payload': '/order_status' + json.dumps({'order_id': order['id']})})
+            
+            message = "🧾 Your Recent Orders:\n\n" + "\n".join(lines) + "\n\nPick an order to see its details."
+            dispatcher.utter_message(text=message, buttons=buttons)
+            
+        except Exception as e:
+            logging.error(f"Error listing orders: {e}")
+            dispatcher.utter_message(text="🤖 Sorry, we couldn't retrieve your orders right now.") 
+        
+        return []
+
 ######################## User Profile ########################
 
 class ActionUserProfile(Action):
     def name(self) -> Text:
         return "action_get_user_profile"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         try:
             user_id = tracker.get_slot('user_id')
             
@@ -484,14 +700,12 @@ class ActionUserProfile(Action):
                 dispatcher.utter_message(text="🔍 Please provide a valid user ID.")
                 return []
             
-            user_ref = db.collection('Users').document(user_id)
-            user = user_ref.get()
+            user_data = await users.get(user_id)
             
-            if not user.exists:
+            if user_data is None:
                 dispatcher.utter_message(text=f"🤷‍♀️ No user found with ID {user_id}.")
                 return []
             
-            user_data = user.to_dict()
             message = f"""
                 👤 User Profile:
                 - 🏷️ First Name: {user_data.get('FirstName', 'N/A')}
@@ -516,40 +730,19 @@ class ActionProductRecommendations(Action):
     def name(self) -> Text:
         return "action_product_recommendations"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @instrumented
+    @with_deadline
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         try:
-            featured_products = (db.collection('Products')
-                .where('IsFeatured', '==', True)
-                .where('Stock', '>', 0)
-                .limit(5)
-                .get())
-            
-            recommendations = []
-            for product in featured_products:
-                product_data = product.to_dict()
-                title = product_data.get('Title', 'Unnamed Product')
-                price = product_data.get('Price', 0)
-                sale_price = product_data.get('SalePrice', price)
-                stock = product_data.get('Stock', 0)
-                
-                if sale_price > 0 and sale_price < price:
-                    recommendation = (f"🌟 {title}\n"
-                                      f"   Regular Price: ₹{price}\n"
-                                      f"   🏷️ Special Offer: ₹{sale_price}\n"
-                                      f"   📦 {stock} available")
-                else:
-                    recommendation = (f"✨ {title}\n"
-                                      f"   Price: ₹{price}\n"
-                                      f"   📦 {stock} available")
-                recommendations.append(recommendation)
-            
-            if recommendations:
-                message = "🌈 Recommended Products Just for You:\n\n" + "\n\n".join(recommendations)
-                dispatcher.utter_message(text=message)
+            cards = await self.similar(tracker)
+            if cards:
+                message = "🌈 Recommended Products Just for You:\n\n" + render_cards(cards)
             else:
-                dispatcher.utter_message(text="🤷‍♀️ No recommendations available at the moment.")
+                # Nothing to go on yet: the featured picks, shared by everyone.
+                message, cards = await response_cache.get_or_load(self.name(), self.render, ttl=RESPONSE_TTLS[self.name()])
+            utter_products(dispatcher, tracker, message, cards)
             
         except Exception as e:
             logging.error(f"Error generating recommendations: {e}")
@@ -557,4 +750,31 @@ class ActionProductRecommendations(Action):
         
         return []
 
+    async def similar(self, tracker: Tracker) -> List[ProductRecord]:
+        """In-stock products like what the user searched for in the `product`, `category` and `brand` slots."""
+        product_name = tracker.get_slot('product')
+        category_name = tracker.get_slot('category')
+        brand_name = tracker.get_slot('brand')
+        if not (product_name or category_name or brand_name) or not recommender.ready:
+            return []
+        category_id = (await get_taxonomy()).category_names.find(category_name) if category_name else None
+        # The best title match stands in for the product the user looked at.
+        viewed = catalog.search_title(product_name, limit=1) if product_name else []
+        query = recommender.query(viewed[0] if viewed else None, product_name, category_id, brand_name)
+        return [product for product in map(catalog.get, recommender.recommend(query, k=5)) if product is not None]
+
+    async def render(self) -> Tuple[Text, List[ProductRecord]]:
+        db = await connection.read_client()
+        featured_products = await fetch(db.collection('Products')
+            .where('IsFeatured', '==', True)
+            .where('Stock', '>', 0)
+            .select(PRODUCT_FIELDS)
+            .limit(5))
+        
+        recommendations = ProductRecord.from_snapshots(featured_products)
+        
+        if recommendations:
+            return "🌈 Recommended Products Just for You:\n\n" + render_cards(recommendations), recommendations
+        return "🤷‍♀️ No recommendations available at the moment.", []
+
 ########################.####################.########################
\ No newline at end of file
@@ -0,0 +1,288 @@
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Set, Text, Tuple
+
+from actions.price_index import PriceIndex
+from actions.records import ProductRecord
+from actions.search_index import TitleIndex
+from actions.snapshot import MappedCatalog
+
+######################## Product Catalog ########################
+
+ChangeListener = Callable[[Dict[Text, ProductRecord], List[Text]], None]
+
+
+def _same(a: ProductRecord, b: ProductRecord) -> bool:
+    return all(getattr(a, field) == getattr(b, field) for field in ProductRecord.__slots__)
+
+
+class ProductCatalog:
+    """In-memory snapshot of the Products collection kept live by `on_snapshot`.
+
+    The first listener callback carries every document and fills the snapshot;
+    later callbacks only carry the added, modified and removed documents. Any
+    object with Firestore's `on_snapshot` signature works as the source, so a
+    `FakeCollection` can stand in for Firebase.
+
+    Documents are reduced to `ProductRecord`s as they arrive. Listen targets
+    can't carry a `select` projection, so this is where unused fields are dropped.
+
+    With `load_snapshot`, a memory-mapped snapshot file is the base and
+    `_products` only holds the changes made since (`_removed` masks base
+    products that were deleted). The catalog is ready as soon as the file is
+    mapped; the listener's first callback is then diffed against the base so
+    only products that actually changed are applied.
+
+    With `follow_snapshot`, another process (`actions.updater`) owns the
+    listener and publishes snapshots; this catalog only maps each new version,
+    and answers price ranges straight from the shared file. A version that
+    lists its changes since the mapped one is applied without decoding the
+    rest of either file.
+    """
+
+    def __init__(self, collection: Any = None, load_timeout: float = 30.0):
+        self._collection = collection
+        self._load_timeout = load_timeout
+        self._products: Dict[Text, ProductRecord] = {}
+        self._base: Optional[MappedCatalog] = None
+        self._removed: Set[Text] = set()
+        self._incremental = False
+        self._synced = False
+        self._shared = False
+        self._follower: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._lock = threading.RLock()
+        self._loaded = threading.Event()
+        self._watch = None
+        self._listeners: List[ChangeListener] = []
+        self.title_index = TitleIndex()
+        self.add_listener(self.title_index.apply)
+        self.price_index = PriceIndex()
+        self.add_listener(self.price_index.apply)
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded.is_set()
+
+    def load_snapshot(self, path: Text) -> bool:
+        """Use the snapshot file at `path` as the base; indexes are built from it locally."""
+        try:
+            base = MappedCatalog(path)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not load catalog snapshot {path}: {e}")
+            return False
+        with self._lock:
+            if self._base is not None and self._base.version == base.version:
+                base.close()
+                return True
+            upserts, removed = self._diff_snapshot(base)
+            # The previous mapping is released once no reader holds it any more.
+            self._base = base
+            self._products = {}
+            self._removed = set()
+            self._synced = self._watch is not None
+            for listener in self._listeners:
+                listener(upserts, removed)
+        self._loaded.set()
+        logging.info(f"Loaded catalog snapshot {path} (version {base.version}, {len(base)} products)")
+        return True
+
+    def _diff_snapshot(self, base: MappedCatalog) -> Tuple[Mapping[Text, ProductRecord], List[Text]]:
+        # Listeners only need what differs between the products served so far and the new file.
+        if self._base is None and not self._products:
+            # Everything is new; listeners decode the records as they index them.
+            return base.mapping(), []
+        changes = base.changes()
+        if (changes is not None and self._base is not None and changes[0] == self._base.version
+                and not self._products and not self._removed):
+            # The writer listed what changed since the file mapped now; read only those products.
+            _, changed, removed = changes
+            upserts = {record.id: record for record in map(base.get, changed) if record is not None}
+            return upserts, [product_id for product_id in removed if product_id in self._base]
+        incoming = {record.id: record for record in base.records()}
+        current = {record.id: record for record in self._base.records()} if self._base is not None else {}
+        current.update(self._products)
+        for product_id in self._removed:
+            current.pop(product_id, None)
+        upserts = {
+            product_id: record for product_id, record in incoming.items()
+            if product_id not in current or not _same(record, current[product_id])
+        }
+        return upserts, [product_id for product_id in current if product_id not in incoming]
+
+    def follow_snapshot(self, path: Text, interval: float = 1.0,
+                        on_load: Optional[Callable[[], None]] = None, wait: bool = True) -> bool:
+        """Serve snapshots published at `path`, mapping each new version as it appears.
+
+        With `wait`, blocks until the first one is loaded; `on_load()` runs
+        after every version is applied.
+        """
+        if self._follower is None:
+            self.share()
+            self._follower = threading.Thread(target=self._follow, args=(path, interval, on_load),
+                                              name='catalog-snapshot', daemon=True)
+            self._follower.start()
+        if wait and not self._loaded.wait(self._load_timeout):
+            logging.error(f"No catalog snapshot at {path} yet")
+        return self.ready
+
+    def share(self) -> None:
+        """Answer price ranges from the mapped snapshot, which worker processes
+        share, instead of keeping a local price index."""
+        self._shared = True
+        if self.price_index.apply in self._listeners:
+            self._listeners.remove(self.price_index.apply)
+
+    def settle(self) -> None:
+        """Finish the index work otherwise left to the first queries, e.g. before
+        forking workers, so that they don't each redo it in pages they share."""
+        self.title_index.settle()
+
+    def _follow(self, path: Text, interval: float, on_load: Optional[Callable[[], None]]) -> None:
+        seen = None
+        while True:
+            try:
+                stat = os.stat(path)
+                # The updater replaces the file, so a new version is a new inode.
+                current = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                current = None
+            if current is not None and current != seen:
+                seen = current
+                if self.load_snapshot(path) and on_load is not None:
+                    on_load()
+            if self._stopping.wait(interval):
+                return
+
+    @property
+    def snapshot_version(self) -> Optional[int]:
+        return self._base.version if self._base is not None else None
+
+    @property
+    def snapshot_created_at(self) -> Optional[float]:
+        return self._base.created_at if self._base is not None else None
+
+    def snapshot_taxonomy(self) -> Tuple[Dict[Text, Any], Dict[Text, Any]]:
+        """The (categories, brands) documents stored with the loaded snapshot."""
+        return self._base.taxonomy() if self._base is not None else ({}, {})
+
+    def start(self, collection: Any = None, incremental: bool = False) -> bool:
+        """Subscribe to the collection and wait for the initial snapshot.
+
+        Pass `incremental=True` when `collection` is a query that only matches
+        products changed since the loaded snapshot, so that documents missing
+        from its first callback are not taken as deleted.
+        """
+        self._incremental = incremental
+        if collection is not None:
+            self._collection = collection
+        if self._collection is None:
+            return False
+        if self._watch is None:
+            self._watch = self._collection.on_snapshot(self._on_snapshot)
+        if not self._loaded.wait(self._load_timeout):
+            logging.error("Product catalog snapshot did not arrive in time")
+        return self.ready
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def add_listener(self, listener: ChangeListener) -> None:
+        """Register `listener(upserts, removed_ids)`, called after every applied delta."""
+        self._listeners.append(listener)
+
+    def _on_snapshot(self, docs, changes, read_time) -> None:
+        try:
+            if self._base is None and not self.ready:
+                # Nothing loaded yet, or the first callback failed: take every document.
+                upserts = {doc.id: ProductRecord.from_dict(doc.id, doc.to_dict()) for doc in docs}
+                removed = [product_id for product_id in self._products if product_id not in upserts]
+            else:
+                upserts = {}
+                removed = []
+                for change in changes:
+                    if change.type.name == 'REMOVED':
+                        removed.append(change.document.id)
+                        upserts.pop(change.document.id, None)
+                    else:
+                        upserts[change.document.id] = ProductRecord.from_dict(change.document.id,
+                                                                              change.document.to_dict())
+                if self._base is not None and not self._synced:
+                    upserts, removed = self._diff_base(docs, upserts, removed)
+            self.apply(upserts, removed)
+            self._synced = True
+        except Exception as e:
+            # Stay not ready, so queries keep going to Firestore.
+            logging.error(f"Error applying product catalog changes: {e}")
+            return
+        self._loaded.set()
+
+    def _diff_base(self, docs, upserts: Dict[Text, ProductRecord],
+                   removed: List[Text]) -> Tuple[Dict[Text, ProductRecord], List[Text]]:
+        # The first callback re-delivers every product; keep only what differs from the
+        # snapshot, decoding just the snapshot records it is compared against.
+        base = self._base
+        changed = {}
+        for product_id, record in upserts.items():
+            current = self._products.get(product_id) or base.get(product_id)
+            if current is None or not _same(record, current):
+                changed[product_id] = record
+        if not self._incremental:
+            present = {doc.id for doc in docs}
+            removed = removed + [product_id for product_id in base.ids()
+                                 if product_id not in present and product_id not in self._removed]
+        return changed, removed
+
+    def apply(self, upserts: Dict[Text, ProductRecord], removed: Iterable[Text] = ()) -> None:
+        removed = list(removed)
+        with self._lock:
+            for product_id in removed:
+                self._products.pop(product_id, None)
+                if self._base is not None and product_id in self._base:
+                    self._removed.add(product_id)
+            self._products.update(upserts)
+            self._removed.difference_update(upserts)
+            for listener in self._listeners:
+                listener(upserts, removed)
+
+    def __len__(self) -> int:
+        with self._lock:
+            if self._base is None:
+                return len(self._products)
+            added = sum(1 for product_id in self._products if product_id not in self._base)
+            return len(self._base) - len(self._removed) + added
+
+    def get(self, product_id: Text) -> Optional[ProductRecord]:
+        product = self._products.get(product_id)
+        if product is None and self._base is not None and product_id not in self._removed:
+            product = self._base.get(product_id)
+        return product
+
+    def products(self) -> List[ProductRecord]:
+        with self._lock:
+            products = list(self._products.values())
+            if self._base is not None:
+                products.extend(record for record in self._base.records()
+                                if record.id not in self._products and record.id not in self._removed)
+            return products
+
+    ######################## Queries ########################
+
+    def search_title(self, term: Text, limit: int = 5, offset: int = 0) -> List[ProductRecord]:
+        """Title matches `offset` to `offset + limit` for `term`, ranked by the title index."""
+        hits = self.title_index.search(term, offset + limit)[offset:]
+        return [product for product in (self.get(i) for i, _ in hits) if product is not None]
+
+    def in_price_range(self, min_price: float, max_price: float,
+                       limit: int = 5, offset: int = 0) -> Tuple[List[ProductRecord], int]:
+        """`limit` products in the range, cheapest first after skipping `offset`,
+        and how many match in total."""
+        if self._shared and self._base is not None:
+            product_ids, total = self._base.price_range(min_price, max_price, limit, offset)
+        else:
+            product_ids, total = self.price_index.range(min_price, max_price, limit, offset)
+        return [product for product in map(self.get, product_ids) if product is not None], total
@@ -0,0 +1,208 @@
+import asyncio
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple
+
+import firebase_admin
+from firebase_admin import credentials, firestore, firestore_async
+
+######################## Initialize Firebase ########################
+
+# Reference point for cold-start timings: when the actions package was imported.
+IMPORTED_AT = time.monotonic()
+
+# 'background' connects as soon as the action server starts; 'lazy' waits for
+# the first request (or readiness probe) to ask for a client.
+FIREBASE_CONNECT = os.environ.get('FIREBASE_CONNECT', 'background').lower()
+FIREBASE_CONNECT_RETRY = float(os.environ.get('FIREBASE_CONNECT_RETRY', '5'))
+FIREBASE_CONNECT_TIMEOUT = float(os.environ.get('FIREBASE_CONNECT_TIMEOUT', '10'))
+
+# Worker processes the action server forks (read by rasa_sdk itself).
+SANIC_WORKERS = int(os.environ.get('ACTION_SERVER_SANIC_WORKERS', '1'))
+
+
+def forks_workers() -> bool:
+    """Whether this is the Sanic supervisor that will fork several workers."""
+    return SANIC_WORKERS > 1 and multiprocessing.parent_process() is None
+
+
+def start_in_workers(start: Callable[[], Any]) -> None:
+    """Call `start()` in the process that will serve requests.
+
+    With several Sanic workers this module is imported by the supervisor,
+    which then forks the workers. Threads and gRPC channels don't survive a
+    fork, so background work is started in each forked child instead (a
+    spawned worker re-imports the module and starts it directly).
+    """
+    if forks_workers():
+        os.register_at_fork(after_in_child=start)
+    else:
+        start()
+
+
+if forks_workers():
+    # What the supervisor builds before forking (catalog indexes, recommender
+    # matrices) is shared with the workers copy-on-write. Freezing it keeps the
+    # workers' garbage collections from writing to those pages.
+    os.register_at_fork(before=gc.freeze)
+
+
+def initialize_firebase():
+    """Initialize Firebase with either environment variable or local credentials file."""
+    try:
+        if not firebase_admin._apps:
+            # First, try to use environment variable (for Render deployment)
+            firebase_creds_json = os.environ.get('FIREBASE_CREDENTIALS')
+            if firebase_creds_json:
+                # Parse the JSON string from environment variable
+                cred_dict = json.loads(firebase_creds_json)
+                cred = credentials.Certificate(cred_dict)
+                firebase_admin.initialize_app(cred)
+                logging.info("Firebase initialized successfully from environment variable")
+            else:
+                # Fallback to local file for development
+                cred_path = os.environ.get('FIREBASE_CREDENTIALS_PATH', './aura-kart-firebase-adminsdk-448ve-f76ba9a07e.json')
+                cred = credentials.Certificate(cred_path)
+                firebase_admin.initialize_app(cred)
+                logging.info(f"Firebase initialized successfully from local file: {cred_path}")
+        else:
+            logging.info("Firebase already initialized")
+
+        return firestore.client()
+    except Exception as e:
+        logging.error(f"Firebase initialization error: {e}")
+        return None
+
+def initialize_async_firestore():
+    """Get an AsyncClient for request-time reads, or None to use the sync client on a thread pool."""
+    try:
+        return firestore_async.client()
+    except Exception as e:
+        logging.error(f"Firestore async client initialization error: {e}")
+        return None
+
+######################## Connection Manager ########################
+
+Warmer = Callable[[Any], Any]
+
+
+class ConnectionManager:
+    """Owns the Firestore clients and brings them up off the request path.
+
+    A background thread initializes Firebase (retrying every `retry` seconds
+    until it succeeds), warms the gRPC channel with a one-document read and
+    then runs the registered warmers (catalog and taxonomy prefetch). `ready`
+    only turns true once all of that has finished, and `timings` records how
+    long each phase took. `connect` may be a zero-argument callable returning
+    the sync client, e.g. to substitute a `FakeFirestore`.
+    """
+
+    def __init__(self, connect: Callable[[], Any] = initialize_firebase,
+                 connect_async: Optional[Callable[[], Any]] = initialize_async_firestore,
+                 warm_collection: Optional[Text] = 'Products', retry: float = FIREBASE_CONNECT_RETRY):
+        self._connect = connect
+        self._connect_async = connect_async
+        self._warm_collection = warm_collection
+        self._retry = retry
+        self._warmers: List[Tuple[Text, Warmer]] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._connected: Future = Future()
+        self._ready = threading.Event()
+        self.db = None
+        self.async_db = None
+        self.error: Optional[Text] = None
+        self.timings: Dict[Text, float] = {}
+
+    def use(self, connect: Callable[[], Any], connect_async: Optional[Callable[[], Any]] = None) -> None:
+        """Connect through other client factories, e.g. a `FakeFirestore` for benchmarks.
+
+        Only has an effect before `start()`.
+        """
+        self._connect = connect
+        self._connect_async = connect_async
+
+    def add_warmer(self, name: Text, warmer: Warmer) -> None:
+        """Register `warmer(db)`, run once after connecting and before reporting ready."""
+        self._warmers.append((name, warmer))
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self) -> None:
+        """Start connecting in the background (idempotent)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='firestore-connect', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        started = time.monotonic()
+        db = self._connect()
+        while db is None:
+            self.error = "Firebase initialization failed"
+            time.sleep(self._retry)
+            db = self._connect()
+        self.error = None
+        self.async_db = self._connect_async() if self._connect_async is not None else None
+        self.db = db
+        self.timings['connect'] = time.monotonic() - started
+        self._connected.set_result(db)
+
+        self._phase('channel', self._warm_channel)
+        for name, warmer in self._warmers:
+            self._phase(name, lambda: warmer(db))
+        self.timings['cold_start'] = time.monotonic() - IMPORTED_AT
+        self._ready.set()
+        logging.info("Firestore ready; cold start " + ", ".join(f"{k}={v:.3f}s" for k, v in self.timings.items()))
+
+    def _phase(self, name: Text, fn: Callable[[], Any]) -> None:
+        started = time.monotonic()
+        try:
+            fn()
+        except Exception as e:
+            logging.error(f"Error warming {name}: {e}")
+        self.timings[name] = time.monotonic() - started
+
+    def _warm_channel(self) -> None:
+        # The first RPC pays for DNS, TLS and auth; do it here instead of in a user's turn.
+        if self._warm_collection:
+            self.db.collection(self._warm_collection).limit(1).get()
+
+    def client(self, timeout: Optional[float] = FIREBASE_CONNECT_TIMEOUT) -> Any:
+        """The sync client, blocking up to `timeout` seconds for it to connect."""
+        self.start()
+        try:
+            return self._connected.result(timeout)
+        except FutureTimeoutError:
+            raise RuntimeError("Firestore is not connected") from None
+
+    async def sync_client(self, timeout: Optional[float] = FIREBASE_CONNECT_TIMEOUT) -> Any:
+        """The sync client, for listeners and thread-pool calls, without blocking the event loop."""
+        self.start()
+        if not self._connected.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self._connected)), timeout)
+            except asyncio.TimeoutError:
+                raise RuntimeError("Firestore is not connected") from None
+        return self._connected.result()
+
+    async def read_client(self, timeout: Optional[float] = FIREBASE_CONNECT_TIMEOUT) -> Any:
+        """The client actions read through: the AsyncClient if available, else the sync one."""
+        db = await self.sync_client(timeout)
+        return self.async_db if self.async_db is not None else db
+
+    def status(self) -> Dict[Text, Any]:
+        return {
+            'ready': self.ready,
+            'connected': self._connected.done(),
+            'error': self.error,
+            'timings': {name: round(seconds, 4) for name, seconds in self.timings.items()},
+        }
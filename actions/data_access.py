@@ -0,0 +1,310 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional, Text
+
+from actions import metrics
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:  # Only installed with firebase_admin.
+    google_exceptions = None
+
+######################## Non-blocking Firestore Access ########################
+
+# Upper bound on Firestore calls in flight from this process, and how long a
+# single call may take before the action gives up on it.
+FIRESTORE_MAX_CONCURRENCY = int(os.environ.get('FIRESTORE_MAX_CONCURRENCY', '32'))
+FIRESTORE_TIMEOUT = float(os.environ.get('FIRESTORE_TIMEOUT', '5.0'))
+# How long a turn waits for a whole-collection load (catalog, taxonomy).
+FIRESTORE_LOAD_TIMEOUT = float(os.environ.get('FIRESTORE_LOAD_TIMEOUT', '30'))
+
+_executor = ThreadPoolExecutor(max_workers=FIRESTORE_MAX_CONCURRENCY, thread_name_prefix='firestore')
+_semaphores = {}
+
+
+def _limit() -> asyncio.Semaphore:
+    # One semaphore per event loop; created lazily so it binds to the running loop.
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(FIRESTORE_MAX_CONCURRENCY)
+    return _semaphores[loop]
+
+
+async def _in_executor(fn: Callable[[], Any]) -> Any:
+    # The slot is held until the thread finishes, not until the caller stops
+    # waiting, so calls abandoned on timeout still count against the limit.
+    loop = asyncio.get_running_loop()
+    limit = _limit()
+    await limit.acquire()
+    try:
+        future = _executor.submit(fn)
+    except BaseException:
+        limit.release()
+        raise
+
+    def release(_: Future) -> None:
+        try:
+            loop.call_soon_threadsafe(limit.release)
+        except RuntimeError:  # The loop has closed.
+            pass
+
+    future.add_done_callback(release)
+    return await asyncio.wrap_future(future)
+
+
+async def run_blocking(fn: Callable, *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> Any:
+    """Run a blocking call on the Firestore thread pool without stalling the event loop.
+
+    The call goes through `guarded`. On timeout the caller gets
+    `asyncio.TimeoutError`; the worker thread itself cannot be interrupted and
+    finishes in the background, holding its FIRESTORE_MAX_CONCURRENCY slot
+    until it does.
+    """
+    return await guarded(lambda: _in_executor(functools.partial(fn, *args, **kwargs)), timeout)
+
+
+_loads: Dict[Text, Future] = {}
+_loads_lock = threading.Lock()
+_load_executor = ThreadPoolExecutor(thread_name_prefix='firestore-load')
+
+
+async def load_once(name: Text, fn: Callable, *args: Any, timeout: Optional[float] = None) -> Any:
+    """Run a whole-collection load (`fn(*args)`) on its own thread, at most one per `name`.
+
+    Callers asking while `name` is loading wait for that load instead of
+    starting another. The load is outside the action deadline and the circuit
+    breaker: it may take far longer than one call and its failures say nothing
+    about single-document reads. The caller gives up after `timeout` (default
+    FIRESTORE_LOAD_TIMEOUT) with `asyncio.TimeoutError`, leaving the load
+    running for the next caller to join.
+    """
+    with _loads_lock:
+        future = _loads.get(name)
+        if future is None:
+            future = _loads[name] = _load_executor.submit(fn, *args)
+            future.add_done_callback(lambda done: _forget_load(name, done))
+    return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout or FIRESTORE_LOAD_TIMEOUT)
+
+
+def _forget_load(name: Text, future: Future) -> None:
+    with _loads_lock:
+        if _loads.get(name) is future:
+            del _loads[name]
+
+
+async def fetch(ref: Any, timeout: Optional[float] = None) -> Any:
+    """`ref.get()` for a document reference, query or aggregation.
+
+    Objects from Firestore's `AsyncClient` are awaited directly; objects from
+    the synchronous client (or `FakeFirestore`) run on the thread pool.
+    """
+    if asyncio.iscoroutinefunction(ref.get):
+        async def attempt():
+            # Cancelling the coroutine stops the call, so the slot can go with it.
+            async with _limit():
+                return await ref.get()
+
+        result = await guarded(attempt, timeout)
+    else:
+        result = await run_blocking(ref.get, timeout=timeout)
+    metrics.record_read(metrics.documents_in(result))
+    return result
+
+######################## Deadlines, Retries & Circuit Breaker ########################
+
+# Every action run gets ACTION_DEADLINE seconds (0 for none) for all of its
+# Firestore calls together; ACTION_DEADLINES overrides it per action, e.g.
+# "action_search_product_by_price_range=5,action_show_brands=2". Each call is
+# also capped at FIRESTORE_TIMEOUT.
+ACTION_DEADLINE = float(os.environ.get('ACTION_DEADLINE', '3.0'))
+ACTION_DEADLINES: Dict[Text, float] = {
+    name.strip(): float(seconds)
+    for name, seconds in (item.split('=', 1) for item in os.environ.get('ACTION_DEADLINES', '').split(',') if item)
+}
+# Transient failures are retried up to FIRESTORE_RETRIES times with full-jitter
+# exponential backoff, while the process-wide budget allows: each call adds
+# FIRESTORE_RETRY_RATIO of a retry, banked up to FIRESTORE_RETRY_BURST.
+FIRESTORE_RETRIES = int(os.environ.get('FIRESTORE_RETRIES', '2'))
+FIRESTORE_RETRY_BACKOFF = float(os.environ.get('FIRESTORE_RETRY_BACKOFF', '0.05'))
+FIRESTORE_RETRY_MAX_BACKOFF = float(os.environ.get('FIRESTORE_RETRY_MAX_BACKOFF', '1.0'))
+FIRESTORE_RETRY_RATIO = float(os.environ.get('FIRESTORE_RETRY_RATIO', '0.1'))
+FIRESTORE_RETRY_BURST = float(os.environ.get('FIRESTORE_RETRY_BURST', '10'))
+# After FIRESTORE_BREAKER_FAILURES transient failures in a row (0 to disable)
+# calls fail at once for FIRESTORE_BREAKER_COOLDOWN seconds, then one trial
+# call decides whether Firestore is back.
+FIRESTORE_BREAKER_FAILURES = int(os.environ.get('FIRESTORE_BREAKER_FAILURES', '5'))
+FIRESTORE_BREAKER_COOLDOWN = float(os.environ.get('FIRESTORE_BREAKER_COOLDOWN', '10'))
+
+TRANSIENT_ERRORS: tuple = (asyncio.TimeoutError, ConnectionError)
+if google_exceptions is not None:
+    TRANSIENT_ERRORS += (google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded,
+                         google_exceptions.InternalServerError, google_exceptions.TooManyRequests,
+                         google_exceptions.Aborted)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Firestore while the circuit breaker is open."""
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """The running action has no time left for another Firestore call."""
+
+
+# What callers with a cached copy should answer from instead of failing.
+UNAVAILABLE_ERRORS = TRANSIENT_ERRORS + (CircuitOpenError,)
+
+
+class RetryBudget:
+    """Token bucket that keeps retries to a fraction of calls, so a struggling
+    backend doesn't get `1 + retries` times the load."""
+
+    def __init__(self, ratio: float = 0.1, burst: float = 10.0):
+        self._ratio = ratio
+        self._burst = burst
+        self._balance = burst
+
+    def deposit(self) -> None:
+        self._balance = min(self._burst, self._balance + self._ratio)
+
+    def withdraw(self) -> bool:
+        if self._balance < 1:
+            return False
+        self._balance -= 1
+        return True
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` transient failures in a row -> half-open
+    after `cooldown` seconds, where a single trial call closes or reopens it."""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failures: int = 5, cooldown: float = 10.0):
+        self._failures = failures
+        self._cooldown = cooldown
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self.state = self.CLOSED
+
+    def allow(self) -> bool:
+        if self._failures <= 0 or self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self._cooldown:
+                return False
+            self.state = self.HALF_OPEN
+        if self._trial:
+            return False
+        self._trial = True
+        return True
+
+    def succeeded(self) -> None:
+        self._consecutive = 0
+        self._trial = False
+        if self.state != self.CLOSED:
+            logging.info("Firestore circuit breaker closed")
+            self.state = self.CLOSED
+
+    def snapshot(self) -> Dict[Text, int]:
+        return {state: int(state == self.state) for state in (self.CLOSED, self.OPEN, self.HALF_OPEN)}
+
+    def abandoned(self) -> None:
+        # A cancelled call says nothing about Firestore; let another caller try.
+        self._trial = False
+
+    def failed(self) -> None:
+        self._consecutive += 1
+        self._trial = False
+        if self._failures <= 0:
+            return
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._consecutive >= self._failures):
+            logging.warning(f"Firestore circuit breaker open for {self._cooldown}s "
+                            f"after {self._consecutive} failures in a row")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(FIRESTORE_BREAKER_FAILURES, FIRESTORE_BREAKER_COOLDOWN)
+retry_budget = RetryBudget(FIRESTORE_RETRY_RATIO, FIRESTORE_RETRY_BURST)
+# calls, failures, retries, rejected (breaker open), deadline (no time left).
+stats: Counter = Counter()
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar('action_deadline', default=None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the running action's deadline, or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def with_deadline(run: Callable) -> Callable:
+    """Decorate an action's `async def run` so its Firestore calls share one deadline."""
+
+    @functools.wraps(run)
+    async def wrapper(self, dispatcher, tracker, domain):
+        seconds = ACTION_DEADLINES.get(self.name(), ACTION_DEADLINE)
+        token = _deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+        try:
+            return await run(self, dispatcher, tracker, domain)
+        finally:
+            _deadline.reset(token)
+
+    return wrapper
+
+
+def snapshot() -> Dict[Text, float]:
+    return dict(stats)
+
+
+async def guarded(attempt: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+    """Await `attempt()` under the action's deadline, the retry budget and the breaker.
+
+    Each try gets `timeout` (default FIRESTORE_TIMEOUT) or whatever is left of
+    the deadline if that is less. Transient errors are retried; anything else
+    (not found, permission denied, bad query) is raised as is and counts as a
+    healthy response. Raises `CircuitOpenError` at once while the breaker is
+    open and `DeadlineExceeded` when the deadline has passed.
+    """
+    stats['calls'] += 1
+    retry_budget.deposit()
+    for retry in range(FIRESTORE_RETRIES + 1):
+        left = remaining()
+        if left is not None and left <= 0:
+            stats['deadline'] += 1
+            raise DeadlineExceeded("Action deadline exceeded before the Firestore call")
+        if not breaker.allow():
+            stats['rejected'] += 1
+            raise CircuitOpenError("Firestore circuit breaker is open")
+        limit = timeout or FIRESTORE_TIMEOUT
+        try:
+            result = await asyncio.wait_for(attempt(), limit if left is None else min(limit, left))
+        except TRANSIENT_ERRORS as e:
+            stats['failures'] += 1
+            breaker.failed()
+            error = e
+        except Exception:
+            breaker.succeeded()
+            raise
+        except BaseException:
+            breaker.abandoned()
+            raise
+        else:
+            breaker.succeeded()
+            return result
+        backoff = random.uniform(0, min(FIRESTORE_RETRY_MAX_BACKOFF, FIRESTORE_RETRY_BACKOFF * 2 ** retry))
+        left = remaining()
+        if (retry == FIRESTORE_RETRIES or breaker.state == CircuitBreaker.OPEN
+                or (left is not None and backoff >= left) or not retry_budget.withdraw()):
+            raise error
+        stats['retries'] += 1
+        await asyncio.sleep(backoff)
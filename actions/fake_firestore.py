@@ -0,0 +1,361 @@
+import copy
+import itertools
+import math
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Text
+
+######################## Fake Firestore ########################
+
+# A small in-memory stand-in for the parts of the Firestore client the
+# actions use, so the catalog and actions can run without Firebase.
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'array_contains': lambda a, b: b in (a or []),
+}
+
+
+def _field(data: Dict[Text, Any], path: Text) -> Any:
+    value = data
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _order_value(doc: "FakeDocumentSnapshot", path: Text) -> Any:
+    # `__name__` is Firestore's document-id field path.
+    return doc.id if path == '__name__' else _field(doc._data, path)
+
+
+class ReadCounter:
+    """Round trips and billed document reads, in total and per collection.
+
+    Counted the way Firestore bills them: every document returned, at least
+    one per query, one per 1000 entries counted by an aggregation, and every
+    document a listener delivers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.round_trips = 0
+        self.documents = 0
+        self.by_collection: Dict[Text, int] = {}
+
+    def add(self, collection: Text, documents: int, round_trips: int = 1) -> None:
+        with self._lock:
+            self.round_trips += round_trips
+            self.documents += documents
+            self.by_collection[collection] = self.by_collection.get(collection, 0) + documents
+
+    def reset(self) -> None:
+        with self._lock:
+            self.round_trips = 0
+            self.documents = 0
+            self.by_collection = {}
+
+    def snapshot(self) -> Dict[Text, Any]:
+        with self._lock:
+            return {'round_trips': self.round_trips, 'documents': self.documents,
+                    'by_collection': dict(self.by_collection)}
+
+
+class FakeUnavailable(ConnectionError):
+    """What an injected error raises, like the client's `ServiceUnavailable`."""
+
+
+class FaultInjector:
+    """Induced slowdowns and errors on round trips, to exercise timeouts,
+    retries and the circuit breaker.
+
+    With probability `error_rate` a round trip raises `FakeUnavailable`;
+    otherwise, with probability `slow_rate`, it takes `delay` extra seconds.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.delay = 0.0
+        self.slow_rate = 0.0
+        self.error_rate = 0.0
+
+    def set(self, delay: float = 0.0, slow_rate: float = 0.0, error_rate: float = 0.0) -> None:
+        self.delay, self.slow_rate, self.error_rate = delay, slow_rate, error_rate
+
+    def apply(self) -> None:
+        with self._lock:
+            fail, slow = self._rng.random() < self.error_rate, self._rng.random() < self.slow_rate
+        if fail:
+            raise FakeUnavailable("Injected Firestore failure")
+        if slow and self.delay:
+            time.sleep(self.delay)
+
+
+class FakeChangeType:
+    def __init__(self, name: Text):
+        self.name = name
+
+
+ADDED = FakeChangeType('ADDED')
+MODIFIED = FakeChangeType('MODIFIED')
+REMOVED = FakeChangeType('REMOVED')
+
+
+class FakeDocumentChange:
+    def __init__(self, change_type: FakeChangeType, document: "FakeDocumentSnapshot"):
+        self.type = change_type
+        self.document = document
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, doc_id: Text, data: Optional[Dict[Text, Any]]):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict[Text, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: Text) -> Any:
+        return _field(self._data or {}, field_path)
+
+
+class FakeWatch:
+    def __init__(self, collection: "FakeCollection", callback: Callable, query: "FakeQuery"):
+        self._collection = collection
+        self._callback = callback
+        self._query = query
+
+    def unsubscribe(self) -> None:
+        if self in self._collection._watches:
+            self._collection._watches.remove(self)
+
+
+class FakeDocumentReference:
+    def __init__(self, collection: "FakeCollection", doc_id: Text):
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self) -> FakeDocumentSnapshot:
+        self._collection._round_trip(1)
+        return FakeDocumentSnapshot(self.id, self._collection._docs.get(self.id))
+
+    def set(self, data: Dict[Text, Any]) -> None:
+        self._collection._write(self.id, copy.deepcopy(data))
+
+    def update(self, data: Dict[Text, Any]) -> None:
+        current = copy.deepcopy(self._collection._docs.get(self.id) or {})
+        current.update(copy.deepcopy(data))
+        self._collection._write(self.id, current)
+
+    def delete(self) -> None:
+        self._collection._write(self.id, None)
+
+
+class FakeAggregationResult:
+    def __init__(self, alias: Text, value: Any):
+        self.alias = alias
+        self.value = value
+
+
+class FakeAggregationQuery:
+    def __init__(self, query: "FakeQuery", alias: Optional[Text]):
+        self._query = query
+        self._alias = alias or 'count'
+
+    def get(self) -> List[List[FakeAggregationResult]]:
+        count = len(self._query._unlimited())
+        self._query._collection._round_trip(max(1, math.ceil(count / 1000)))
+        return [[FakeAggregationResult(self._alias, count)]]
+
+
+class FakeQuery:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, collection: "FakeCollection", filters=(), limit_count: Optional[int] = None,
+                 orders=(), projection: Optional[List[Text]] = None,
+                 cursor: Optional[Dict[Text, Any]] = None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._limit = limit_count
+        self._orders = list(orders)
+        self._projection = projection
+        self._cursor = cursor
+
+    def _copy(self, **changes) -> "FakeQuery":
+        options = {'filters': self._filters, 'limit_count': self._limit, 'orders': self._orders,
+                   'projection': self._projection, 'cursor': self._cursor}
+        options.update(changes)
+        return FakeQuery(self._collection, **options)
+
+    def where(self, field_path: Text, op_string: Text, value: Any) -> "FakeQuery":
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path: Text, direction: Text = ASCENDING) -> "FakeQuery":
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def select(self, field_paths: List[Text]) -> "FakeQuery":
+        return self._copy(projection=list(field_paths))
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._copy(limit_count=count)
+
+    def start_after(self, document_fields: Dict[Text, Any]) -> "FakeQuery":
+        """Resume after the document whose `order_by` fields (and `__name__`) have these values."""
+        return self._copy(cursor=dict(document_fields))
+
+    def count(self, alias: Optional[Text] = None) -> FakeAggregationQuery:
+        return FakeAggregationQuery(self, alias)
+
+    def _matches(self, data: Dict[Text, Any]) -> bool:
+        return all(_OPERATORS[op](_field(data, path), value) for path, op, value in self._filters)
+
+    def _unlimited(self) -> List[FakeDocumentSnapshot]:
+        matches = [
+            FakeDocumentSnapshot(doc_id, data)
+            for doc_id, data in self._collection._docs.items()
+            if self._matches(data)
+        ]
+        for path, direction in reversed(self._orders):
+            matches.sort(key=lambda doc: _order_value(doc, path), reverse=direction == self.DESCENDING)
+        if self._cursor is not None:
+            matches = [doc for doc in matches if self._after_cursor(doc)]
+        return matches
+
+    def _after_cursor(self, doc: FakeDocumentSnapshot) -> bool:
+        for path, direction in self._orders:
+            if path not in self._cursor:
+                break
+            value, bound = _order_value(doc, path), self._cursor[path]
+            if value != bound:
+                return value < bound if direction == self.DESCENDING else value > bound
+        return False
+
+    def _project(self, doc: FakeDocumentSnapshot) -> FakeDocumentSnapshot:
+        projected: Dict[Text, Any] = {}
+        for path in self._projection:
+            value = _field(doc._data, path)
+            if value is None:
+                continue
+            *parents, leaf = path.split('.')
+            target = projected
+            for part in parents:
+                target = target.setdefault(part, {})
+            target[leaf] = value
+        return FakeDocumentSnapshot(doc.id, projected)
+
+    def stream(self):
+        docs = self._unlimited()[:self._limit]
+        self._collection._round_trip(max(1, len(docs)))
+        if self._projection is not None:
+            docs = [self._project(doc) for doc in docs]
+        return iter(docs)
+
+    def get(self) -> List[FakeDocumentSnapshot]:
+        return list(self.stream())
+
+    def on_snapshot(self, callback: Callable) -> FakeWatch:
+        """Deliver the matching documents as ADDED now, then deltas on each write.
+
+        A write is delivered if the document matches the filters before or
+        after it; `limit` only bounds the initial documents.
+        """
+        collection = self._collection
+        watch = FakeWatch(collection, callback, self)
+        collection._watches.append(watch)
+        docs = self._unlimited()[:self._limit]
+        collection.reads.add(collection.id, len(docs))
+        callback(docs, [FakeDocumentChange(ADDED, doc) for doc in docs], None)
+        return watch
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, name: Text, docs: Optional[Dict[Text, Dict[Text, Any]]] = None,
+                 latency: float = 0.0, reads: Optional[ReadCounter] = None,
+                 faults: Optional[FaultInjector] = None):
+        super().__init__(self)
+        self.id = name
+        self.latency = latency
+        self.reads = reads if reads is not None else ReadCounter()
+        self.faults = faults
+        self._docs: Dict[Text, Dict[Text, Any]] = dict(docs or {})
+        self._watches: List[FakeWatch] = []
+        self._ids = itertools.count(1)
+
+    def document(self, doc_id: Optional[Text] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self, doc_id or f"{self.id.lower()}-{next(self._ids)}")
+
+    def add(self, data: Dict[Text, Any]) -> FakeDocumentReference:
+        ref = self.document()
+        ref.set(data)
+        return ref
+
+    def _round_trip(self, documents: int) -> None:
+        self.reads.add(self.id, documents)
+        # Blocks like the real synchronous client does while waiting on gRPC.
+        if self.latency:
+            time.sleep(self.latency)
+        if self.faults is not None:
+            self.faults.apply()
+
+    def _write(self, doc_id: Text, data: Optional[Dict[Text, Any]]) -> None:
+        before = self._docs.get(doc_id)
+        if data is None:
+            if before is None:
+                return
+            change = FakeDocumentChange(REMOVED, FakeDocumentSnapshot(doc_id, self._docs.pop(doc_id)))
+        else:
+            self._docs[doc_id] = data
+            change = FakeDocumentChange(MODIFIED if before is not None else ADDED, FakeDocumentSnapshot(doc_id, data))
+        for watch in list(self._watches):
+            query = watch._query
+            if not any(version is not None and query._matches(version) for version in (before, data)):
+                continue
+            self.reads.add(self.id, 1, round_trips=0)
+            watch._callback(query._unlimited()[:query._limit], [change], None)
+
+
+class FakeFirestore:
+    """Drop-in replacement for `firestore.client()` backed by plain dicts.
+
+    `latency` seconds are slept on every `get()` to mimic a network round trip,
+    `reads` counts the round trips and documents read across collections and
+    `faults` slows down or fails round trips on demand. Listeners are not
+    affected by `faults`.
+    """
+
+    def __init__(self, data: Optional[Dict[Text, Dict[Text, Dict[Text, Any]]]] = None,
+                 latency: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.reads = ReadCounter()
+        self.faults = FaultInjector(seed)
+        self._collections: Dict[Text, FakeCollection] = {}
+        for name, docs in (data or {}).items():
+            self._collections[name] = FakeCollection(name, docs, latency, self.reads, self.faults)
+
+    def collection(self, name: Text) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, latency=self.latency, reads=self.reads,
+                                                     faults=self.faults)
+        return self._collections[name]
+
+    def get_all(self, references):
+        """Batched document read: one round trip for all `references`."""
+        references = list(references)
+        if references:
+            references[0]._collection._round_trip(len(references))
+        for ref in references:
+            yield FakeDocumentSnapshot(ref.id, ref._collection._docs.get(ref.id))
@@ -0,0 +1,205 @@
+import asyncio
+import inspect
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Text, Tuple
+
+from actions import metrics
+from actions.data_access import UNAVAILABLE_ERRORS, guarded, run_blocking
+
+######################## Keyed Lookup Cache ########################
+
+Document = Optional[Dict[Text, Any]]
+
+
+class KeyedCache:
+    """Short-lived per-id cache. Ids that don't exist are cached as None for
+    `negative_ttl`, so repeated lookups of a mistyped id stay cheap too.
+
+    Expired entries are kept for another `max_stale` seconds, for `stale()` to
+    answer from while Firestore is unavailable. `invalidate` may be called from
+    Firestore listener threads, so every access holds the lock.
+    """
+
+    def __init__(self, ttl: float = 15.0, negative_ttl: float = 5.0, max_entries: int = 10000,
+                 max_stale: float = 0.0):
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._max_entries = max_entries
+        self._max_stale = max_stale
+        self._entries: "OrderedDict[Text, Tuple[float, Document]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stale_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Text) -> Tuple[bool, Document]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            now = time.monotonic()
+            if now >= expires_at:
+                if now >= expires_at + self._max_stale:
+                    del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def stale(self, key: Text) -> Tuple[bool, Document]:
+        """Like `get`, but also answers from an entry expired less than `max_stale` ago."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() >= entry[0] + self._max_stale:
+                return False, None
+            self.stale_hits += 1
+            return True, entry[1]
+
+    def put(self, key: Text, value: Document) -> None:
+        ttl = self._ttl if value is not None else self._negative_ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Text) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class MicroBatcher:
+    """Coalesce document lookups that arrive within `window` seconds into a
+    single `get_all` round trip. `get_client` is awaited for the Firestore
+    client on each flush, so the batcher can be built before it connects."""
+
+    def __init__(self, get_client: Callable[[], Awaitable[Any]], collection: Text,
+                 window: float = 0.005, max_batch: int = 100):
+        self._get_client = get_client
+        self._collection = collection
+        self._window = window
+        self._max_batch = max_batch
+        self._pending: Dict[Text, List[asyncio.Future]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def get(self, doc_id: Text) -> Document:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(doc_id, []).append(future)
+        if len(self._pending) >= self._max_batch:
+            self._flush_now()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+        value = await future
+        # The round trip is shared by the whole batch; each caller counts it once.
+        metrics.record_read(0 if value is None else 1)
+        return value
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self._window)
+        self._flush_task = None
+        await self._flush(self._take())
+
+    def _flush_now(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        asyncio.ensure_future(self._flush(self._take()))
+
+    def _take(self) -> Dict[Text, List[asyncio.Future]]:
+        pending, self._pending = self._pending, {}
+        return pending
+
+    async def _flush(self, pending: Dict[Text, List[asyncio.Future]]) -> None:
+        if not pending:
+            return
+        try:
+            client = await self._get_client()
+            refs = self._refs(client, pending)
+            if refs:
+                await self._fetch(client, refs, pending)
+        except BaseException as e:
+            for futures in pending.values():
+                _settle(futures, error=e)
+            if not isinstance(e, Exception):
+                raise
+
+    def _refs(self, client: Any, pending: Dict[Text, List[asyncio.Future]]) -> Dict[Text, Any]:
+        # Each id is checked on its own: one that can't name a document (e.g. it
+        # contains '/') resolves to None for its callers only.
+        collection = client.collection(self._collection)
+        refs = {}
+        for doc_id, futures in pending.items():
+            try:
+                refs[doc_id] = collection.document(doc_id)
+            except (TypeError, ValueError) as e:
+                logging.warning(f"Not looking up invalid {self._collection} id {doc_id!r}: {e}")
+                _settle(futures, None)
+        return refs
+
+    async def _fetch(self, client: Any, refs: Dict[Text, Any], pending: Dict[Text, List[asyncio.Future]]) -> None:
+        try:
+            found = await self._get_all(client, list(refs.values()))
+        except Exception as e:
+            # Firestore being unavailable fails every id alike. Any other error may
+            # come from a single id, so the ids are retried one at a time and each
+            # caller gets only its own id's result or error.
+            if isinstance(e, UNAVAILABLE_ERRORS) or len(refs) == 1:
+                for doc_id in refs:
+                    _settle(pending[doc_id], error=e)
+                return
+            logging.warning(f"Batched {self._collection} lookup failed, retrying ids one by one: {e!r}")
+            await asyncio.gather(*(self._fetch(client, {doc_id: ref}, pending) for doc_id, ref in refs.items()))
+            return
+        for doc_id in refs:
+            _settle(pending[doc_id], found.get(doc_id))
+
+    @staticmethod
+    async def _get_all(client: Any, refs: List[Any]) -> Dict[Text, Dict[Text, Any]]:
+        if inspect.isasyncgenfunction(client.get_all):
+            async def collect():
+                return [snapshot async for snapshot in client.get_all(refs)]
+            snapshots = await guarded(collect)
+        else:
+            snapshots = await run_blocking(lambda: list(client.get_all(refs)))
+        return {snapshot.id: snapshot.to_dict() for snapshot in snapshots if snapshot.exists}
+
+
+def _settle(futures: List[asyncio.Future], value: Document = None, error: Optional[BaseException] = None) -> None:
+    for future in futures:
+        if future.done():
+            continue
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+
+class DocumentLoader:
+    """Read-through cache in front of a `MicroBatcher` for one collection."""
+
+    def __init__(self, get_client: Callable[[], Awaitable[Any]], collection: Text,
+                 cache: Optional[KeyedCache] = None, window: float = 0.005):
+        self.cache = cache or KeyedCache()
+        self.batcher = MicroBatcher(get_client, collection, window)
+
+    async def get(self, doc_id: Text) -> Document:
+        """The document as a dict, or None if it does not exist."""
+        hit, value = self.cache.get(doc_id)
+        if hit:
+            metrics.record_cache_hit()
+            return value
+        try:
+            value = await self.batcher.get(doc_id)
+        except UNAVAILABLE_ERRORS as e:
+            hit, value = self.cache.stale(doc_id)
+            if not hit:
+                raise
+            logging.warning(f"Serving cached '{doc_id}' while Firestore is unavailable: {e!r}")
+            metrics.record_cache_hit()
+            return value
+        self.cache.put(doc_id, value)
+        return value
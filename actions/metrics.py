@@ -0,0 +1,352 @@
+import bisect
+import contextvars
+import errno
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Text, Tuple
+
+######################## Action Instrumentation ########################
+
+# Off by default. When neither is set, `instrumented` returns `run` unchanged
+# and the record_* hooks are a single context-variable lookup.
+ENABLED = os.environ.get('ACTION_METRICS', '').lower() in ('1', 'true', 'yes')
+TRACE_FILE = os.environ.get('ACTION_TRACE_FILE')
+METRICS_PORT = int(os.environ.get('ACTION_METRICS_PORT', '5056'))
+
+
+class RequestStats:
+    __slots__ = ('action', 'seconds', 'round_trips', 'documents', 'rendered_bytes', 'cache_hits')
+
+    def __init__(self, action: Text):
+        self.action = action
+        self.seconds = 0.0
+        self.round_trips = 0
+        self.documents = 0
+        self.rendered_bytes = 0
+        self.cache_hits = 0
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('action_request_stats', default=None)
+
+
+def record_read(documents: int, round_trips: int = 1) -> None:
+    """Count Firestore round trips and documents read by the running action."""
+    stats = _current.get()
+    if stats is not None:
+        stats.round_trips += round_trips
+        stats.documents += documents
+
+
+def record_cache_hit() -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.cache_hits += 1
+
+
+def documents_in(result: Any) -> int:
+    """Documents in a `get()` result: a snapshot list, a single snapshot or an aggregation."""
+    if isinstance(result, list):
+        return 0 if result and isinstance(result[0], list) else len(result)
+    return 1 if getattr(result, 'exists', False) else 0
+
+
+######################## Histograms ########################
+
+class Histogram:
+    """Prometheus-style cumulative histogram labelled by action."""
+
+    def __init__(self, name: Text, help_text: Text, buckets: Sequence[float]):
+        self.name = name
+        self.help = help_text
+        self.buckets = list(buckets)
+        self._series: Dict[Text, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, action: Text, value: float) -> None:
+        with self._lock:
+            counts, total = self._series.setdefault(action, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def state(self) -> Dict[Text, Tuple[List[int], float]]:
+        """action -> (per-bucket counts, sum), e.g. to add up several workers' figures."""
+        with self._lock:
+            return {action: (list(counts), total[0]) for action, (counts, total) in self._series.items()}
+
+    def exposition(self, series: Optional[Dict[Text, Tuple[List[int], float]]] = None) -> List[Text]:
+        """Prometheus text for `series` (default: this histogram's own `state()`)."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for action, (counts, total) in sorted((self.state() if series is None else series).items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float('inf')], counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{action="{action}",le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{action="{action}"}} {total}')
+            lines.append(f'{self.name}_count{{action="{action}"}} {cumulative}')
+        return lines
+
+
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 1000, 10000)
+HISTOGRAMS = {
+    'seconds': Histogram('action_latency_seconds', "Wall time of Action.run",
+                         (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'round_trips': Histogram('action_firestore_round_trips', "Firestore round trips per run", COUNT_BUCKETS),
+    'documents': Histogram('action_documents_read', "Firestore documents read per run", COUNT_BUCKETS),
+    'rendered_bytes': Histogram('action_rendered_bytes', "UTF-8 bytes of text sent per run",
+                                (64, 256, 1024, 4096, 16384, 65536)),
+    'cache_hits': Histogram('action_cache_hits', "Cache hits per run", COUNT_BUCKETS),
+}
+
+# Extra series rendered on /metrics: name -> (help, type, fn returning {label: value}).
+_counter_sources: Dict[Text, Tuple[Text, Text, Callable[[], Dict[Text, float]]]] = {}
+
+
+def register_counters(name: Text, help_text: Text, source: Callable[[], Dict[Text, float]],
+                      kind: Text = 'counter') -> None:
+    _counter_sources[name] = (help_text, kind, source)
+
+
+def exposition() -> Text:
+    """Every worker's figures when shared (see `share_across_workers`): histograms
+    and counters added up, gauges labelled by worker pid. Else this process's."""
+    states = worker_states()
+    lines: List[Text] = []
+    for field, histogram in HISTOGRAMS.items():
+        if states is None:
+            lines.extend(histogram.exposition())
+        else:
+            lines.extend(histogram.exposition(_added_series(state['histograms'].get(field, {}) for state in states)))
+    for name, (help_text, kind, source) in sorted(_counter_sources.items()):
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+        if states is None:
+            for label, value in sorted(dict(source()).items()):
+                lines.append(f'{name}{{key="{label}"}} {value}')
+        elif kind == 'gauge':
+            for state in states:
+                for label, value in sorted(state['counters'].get(name, {}).items()):
+                    lines.append(f'{name}{{key="{label}",worker="{state["pid"]}"}} {value}')
+        else:
+            totals: Dict[Text, float] = {}
+            for state in states:
+                for label, value in state['counters'].get(name, {}).items():
+                    totals[label] = totals.get(label, 0) + value
+            for label, value in sorted(totals.items()):
+                lines.append(f'{name}{{key="{label}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def _added_series(series: Iterable[Dict[Text, Tuple[List[int], float]]]) -> Dict[Text, Tuple[List[int], float]]:
+    added: Dict[Text, Tuple[List[int], float]] = {}
+    for worker_series in series:
+        for action, (counts, total) in worker_series.items():
+            if action in added:
+                added_counts, added_total = added[action]
+                added[action] = ([a + b for a, b in zip(added_counts, counts)], added_total + total)
+            else:
+                added[action] = (list(counts), total)
+    return added
+
+
+######################## Multiple Workers ########################
+
+# Each action-server worker counts its own runs, and only one of them binds
+# METRICS_PORT. With `share_across_workers` every worker writes its figures and
+# readiness to one file per pid in METRICS_DIR, about once a second, and the one
+# answering /metrics or /ready reads all of them.
+METRICS_DIR = os.environ.get('ACTION_METRICS_DIR')
+SHARE_INTERVAL = float(os.environ.get('ACTION_METRICS_SHARE_INTERVAL', '1'))
+
+_shared_dir: Optional[Text] = None
+_worker_status: Callable[[], Dict[Text, Any]] = dict
+_share_lock = threading.Lock()
+
+
+def share_across_workers(status: Callable[[], Dict[Text, Any]] = dict, directory: Optional[Text] = None) -> Text:
+    """Call in the supervisor before it forks the workers; `status()` is each
+    worker's readiness, as returned by `worker_states`. Returns the directory."""
+    global _shared_dir, _worker_status
+    directory = directory or METRICS_DIR or os.path.join(tempfile.gettempdir(), f"action-metrics-{os.getpid()}")
+    os.makedirs(directory, exist_ok=True)
+    # Left over from an earlier run in the same directory.
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            os.remove(os.path.join(directory, name))
+    _shared_dir, _worker_status = directory, status
+    return directory
+
+
+def _state() -> Dict[Text, Any]:
+    return {
+        'pid': os.getpid(),
+        'histograms': {field: histogram.state() for field, histogram in HISTOGRAMS.items()},
+        'counters': {name: dict(source()) for name, (_, _, source) in _counter_sources.items()},
+        'status': _worker_status(),
+    }
+
+
+def _write_state() -> None:
+    path = os.path.join(_shared_dir, f"{os.getpid()}.json")
+    with _share_lock:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(_state(), f)
+        os.replace(path + '.tmp', path)
+
+
+def _share_forever() -> None:
+    while True:
+        try:
+            _write_state()
+        except Exception as e:
+            logging.error(f"Error sharing action metrics: {e}")
+        time.sleep(SHARE_INTERVAL)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def worker_states() -> Optional[List[Dict[Text, Any]]]:
+    """The last figures and status of every live worker (this one's current),
+    or None unless `share_across_workers` was called."""
+    if _shared_dir is None:
+        return None
+    _write_state()
+    states = []
+    for name in sorted(os.listdir(_shared_dir)):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(_shared_dir, name)
+        if not _alive(int(name[:-len('.json')])):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path, encoding='utf-8') as f:
+                states.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return states
+
+
+######################## Tracing ########################
+
+_trace_lock = threading.Lock()
+_trace_file = None
+
+
+def _write_trace(stats: RequestStats, sender_id: Optional[Text]) -> None:
+    global _trace_file
+    record = {'ts': time.time(), 'sender_id': sender_id}
+    record.update({slot: getattr(stats, slot) for slot in RequestStats.__slots__})
+    with _trace_lock:
+        if _trace_file is None:
+            _trace_file = open(TRACE_FILE, 'a', buffering=1, encoding='utf-8')
+        _trace_file.write(json.dumps(record) + "\n")
+
+
+def _finish(stats: RequestStats, sender_id: Optional[Text]) -> None:
+    if ENABLED:
+        for field, histogram in HISTOGRAMS.items():
+            histogram.observe(stats.action, getattr(stats, field))
+    if TRACE_FILE:
+        try:
+            _write_trace(stats, sender_id)
+        except OSError as e:
+            logging.error(f"Error writing action trace: {e}")
+
+
+def instrumented(run: Callable) -> Callable:
+    """Decorate an action's `async def run` to record its wall time, reads,
+    rendered bytes and cache hits."""
+    if not ENABLED and not TRACE_FILE:
+        return run
+
+    @functools.wraps(run)
+    async def wrapper(self, dispatcher, tracker, domain):
+        stats = RequestStats(self.name())
+        token = _current.set(stats)
+        sent = len(dispatcher.messages)
+        start = time.perf_counter()
+        try:
+            return await run(self, dispatcher, tracker, domain)
+        finally:
+            stats.seconds = time.perf_counter() - start
+            stats.rendered_bytes = sum(len((m.get('text') or '').encode('utf-8')) for m in dispatcher.messages[sent:])
+            _current.reset(token)
+            _finish(stats, getattr(tracker, 'sender_id', None))
+
+    return wrapper
+
+
+######################## HTTP Endpoint ########################
+
+PROMETHEUS_TEXT = 'text/plain; version=0.0.4; charset=utf-8'
+
+# path -> fn() returning (status, content type, body)
+_routes: Dict[Text, Callable[[], Tuple[int, Text, Text]]] = {
+    '/metrics': lambda: (200, PROMETHEUS_TEXT, exposition()),
+}
+
+
+def add_route(path: Text, handler: Callable[[], Tuple[int, Text, Text]]) -> None:
+    """Serve `handler()` on GET `path`, e.g. a readiness probe."""
+    _routes[path] = handler
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        route = _routes.get(self.path.split('?')[0])
+        status, content_type, body = route() if route else (404, 'text/plain', "not found\n")
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_sharing = False
+
+
+def start_server(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Serve the registered routes on `port` from a daemon thread (once per process).
+
+    With `share_across_workers` this also starts writing this worker's figures.
+    """
+    global _server, _sharing
+    if _shared_dir is not None and not _sharing:
+        _sharing = True
+        threading.Thread(target=_share_forever, name='metrics-share', daemon=True).start()
+    if _server is None:
+        try:
+            _server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+        except OSError as e:
+            if e.errno == errno.EADDRINUSE and (_shared_dir is not None or multiprocessing.parent_process() is not None):
+                # Another action-server worker got there first; it reports this one's figures too.
+                logging.info(f"Metrics endpoint on port {port} is served by another worker")
+            else:
+                logging.error(f"Could not start metrics endpoint on port {port}: {e}")
+            return None
+        threading.Thread(target=_server.serve_forever, name='metrics-http', daemon=True).start()
+        logging.info(f"Action metrics and readiness available on http://0.0.0.0:{port}")
+    return _server
@@ -0,0 +1,105 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Text, Tuple
+
+from actions import metrics
+from actions.data_access import UNAVAILABLE_ERRORS, fetch
+from actions.lookup_cache import KeyedCache
+
+######################## Per-User Order Index ########################
+
+OrderSummary = Dict[Text, Any]
+OrderListener = Callable[[Text], Any]
+
+# Everything a listing shows; `items` is only read when one order is opened.
+SUMMARY_FIELDS = ['status', 'deliveryDate', 'totalAmount']
+
+
+class OrderIndex:
+    """A user's most recent orders, read with one indexed query and cached per user.
+
+    The query is `user_field == user_id`, ordered by `sort_field` descending,
+    limited to `limit` and projected to the summary fields. It needs the
+    composite index in firestore.indexes.json. `start()` listens to the
+    `watch_window` most recent orders and drops the cached summaries of any
+    user whose order is added, changed or removed there. Changes to older
+    orders show up once the `ttl` runs out. While Firestore is unavailable an
+    expired list is served for up to `max_stale` more seconds.
+    """
+
+    def __init__(self, get_client: Callable[[], Awaitable[Any]], collection: Text = 'Orders',
+                 user_field: Text = 'userId', sort_field: Text = 'orderDate', limit: int = 5,
+                 ttl: float = 300.0, watch_window: int = 500, max_entries: int = 10000, max_stale: float = 0.0):
+        self.cache = KeyedCache(ttl=ttl, negative_ttl=ttl, max_entries=max_entries, max_stale=max_stale)
+        self._get_client = get_client
+        self._collection = collection
+        self._user_field = user_field
+        self._sort_field = sort_field
+        self._limit = limit
+        self._watch_window = watch_window
+        self._watch = None
+        self._listeners: List[OrderListener] = []
+        # Bumped by every change event, so a read that raced with one isn't cached.
+        self._changes = 0
+
+    @property
+    def sort_field(self) -> Text:
+        return self._sort_field
+
+    def add_listener(self, listener: OrderListener) -> None:
+        """Call `listener(order_id)` for every order the watch sees change."""
+        self._listeners.append(listener)
+
+    def query(self, db: Any, user_id: Text) -> Any:
+        return (db.collection(self._collection)
+                .where(self._user_field, '==', user_id)
+                .order_by(self._sort_field, direction='DESCENDING')
+                .select(SUMMARY_FIELDS + [self._sort_field])
+                .limit(self._limit))
+
+    async def recent(self, user_id: Text) -> Tuple[OrderSummary, ...]:
+        """The user's latest orders (newest first) as dicts with their `id`."""
+        hit, summaries = self.cache.get(user_id)
+        if hit:
+            metrics.record_cache_hit()
+            return summaries
+        changes = self._changes
+        try:
+            snapshots = await fetch(self.query(await self._get_client(), user_id))
+        except UNAVAILABLE_ERRORS as e:
+            hit, summaries = self.cache.stale(user_id)
+            if not hit:
+                raise
+            logging.warning(f"Serving cached orders of '{user_id}' while Firestore is unavailable: {e!r}")
+            metrics.record_cache_hit()
+            return summaries
+        summaries = tuple(dict(snapshot.to_dict() or {}, id=snapshot.id) for snapshot in snapshots)
+        if changes == self._changes:
+            self.cache.put(user_id, summaries)
+        return summaries
+
+    def start(self, db: Any) -> None:
+        """Subscribe to the most recent orders (idempotent; no-op with a zero `watch_window`)."""
+        if self._watch is not None or self._watch_window <= 0:
+            return
+        recent = (db.collection(self._collection)
+                  .order_by(self._sort_field, direction='DESCENDING')
+                  .limit(self._watch_window))
+        self._watch = recent.on_snapshot(self._on_snapshot)
+
+    def stop(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def _on_snapshot(self, docs, changes, read_time) -> None:
+        for change in changes:
+            self._changes += 1
+            data = change.document.to_dict() or {}
+            user_id = data.get(self._user_field)
+            if user_id is not None:
+                self.cache.invalidate(user_id)
+            for listener in self._listeners:
+                try:
+                    listener(change.document.id)
+                except Exception as e:
+                    logging.error(f"Order listener failed for {change.document.id}: {e}")
@@ -0,0 +1,33 @@
+import base64
+import binascii
+import json
+import os
+from typing import Any, Dict, Optional, Text
+
+######################## Result Paging ########################
+
+# Results per page for search and listing actions. Each page is fetched on its
+# own, with `search_cursor` recording where the next one starts.
+PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '5'))
+
+CURSOR_SLOT = 'search_cursor'
+MORE_HINT = "\n\n👉 Say \"show more\" to see more."
+
+
+def encode_cursor(action: Text, **state: Any) -> Text:
+    """Opaque, URL-safe cursor for `action` to resume from `state`."""
+    state['a'] = action
+    raw = json.dumps(state, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[Text]) -> Optional[Dict[Text, Any]]:
+    """The state stored by `encode_cursor`, or None for a missing or mangled cursor."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        state = json.loads(raw.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    return state if isinstance(state, dict) and 'a' in state else None
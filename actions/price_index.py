@@ -0,0 +1,126 @@
+import bisect
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
+
+from actions.records import PRODUCT_FIELDS, ProductRecord
+
+######################## Product Price Index ########################
+
+
+def indexed_price(product: ProductRecord) -> Optional[float]:
+    """The price a range query matches on, or None to leave the product out.
+
+    This is the stored `Price`, the one field the Firestore fallback can
+    filter on, so both paths return the same products. Like Firestore's range
+    filter, a null or non-numeric price matches no range.
+    """
+    price = product.price
+    if isinstance(price, bool) or not isinstance(price, (int, float)) or price != price:
+        return None
+    return float(price)
+
+
+class PriceIndex:
+    """Products sorted by price, then id, in parallel arrays.
+
+    A range query is two bisections; the match count is the distance between
+    them, so it costs O(log n) however many products fall in the range.
+    """
+
+    # Above this share of the index changing at once, re-sort instead of
+    # inserting one by one (the initial snapshot arrives as one big delta).
+    REBUILD_RATIO = 0.125
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._prices = array('d')
+        self._ids: List[Text] = []
+        self._by_id: Dict[Text, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _position(self, product_id: Text, price: float) -> int:
+        i = bisect.bisect_left(self._prices, price)
+        while self._ids[i] != product_id:
+            i += 1
+        return i
+
+    def _remove(self, product_id: Text) -> None:
+        price = self._by_id.pop(product_id, None)
+        if price is not None:
+            i = self._position(product_id, price)
+            del self._prices[i]
+            del self._ids[i]
+
+    def _insert(self, product_id: Text, price: float) -> None:
+        # Equal prices are kept in id order, as Firestore orders them.
+        i = bisect.bisect_left(self._prices, price)
+        while i < len(self._ids) and self._prices[i] == price and self._ids[i] < product_id:
+            i += 1
+        self._prices.insert(i, price)
+        self._ids.insert(i, product_id)
+        self._by_id[product_id] = price
+
+    def _rebuild(self) -> None:
+        ordered = sorted(self._by_id.items(), key=lambda item: (item[1], item[0]))
+        self._ids = [product_id for product_id, _ in ordered]
+        self._prices = array('d', (price for _, price in ordered))
+
+    def apply(self, upserts: Dict[Text, ProductRecord], removed: Iterable[Text] = ()) -> None:
+        """Catalog listener: re-position added/modified products, drop removed ones."""
+        removed = list(removed)
+        with self._lock:
+            if len(upserts) + len(removed) > len(self._ids) * self.REBUILD_RATIO + 64:
+                for product_id in removed:
+                    self._by_id.pop(product_id, None)
+                for product_id, product in upserts.items():
+                    price = indexed_price(product)
+                    if price is None:
+                        self._by_id.pop(product_id, None)
+                    else:
+                        self._by_id[product_id] = price
+                self._rebuild()
+                return
+            for product_id in removed:
+                self._remove(product_id)
+            for product_id, product in upserts.items():
+                self._remove(product_id)
+                price = indexed_price(product)
+                if price is not None:
+                    self._insert(product_id, price)
+
+    def range(self, min_price: float, max_price: float, limit: int = 5,
+              offset: int = 0) -> Tuple[List[Text], int]:
+        """Ids of the `limit` cheapest products in [min_price, max_price] after
+        skipping `offset` of them, and the total count."""
+        with self._lock:
+            lo = bisect.bisect_left(self._prices, min_price)
+            hi = bisect.bisect_right(self._prices, max_price)
+            if hi <= lo:
+                return [], 0
+            start = lo + offset
+            return self._ids[start:min(hi, start + limit)], hi - lo
+
+
+def firestore_price_range(collection: Any, min_price: float, max_price: float, limit: int = 5,
+                          after: Optional[Tuple[float, Text]] = None) -> Tuple[List[ProductRecord], Optional[int]]:
+    """Push a price range down to Firestore when no local index is available.
+
+    Like `PriceIndex`, this matches the stored `Price` field (`SalePrice` is
+    only shown). Results are ordered by price, then document id, so
+    `after=(price, id)` of the last product shown resumes with `start_after`.
+    The total comes from a count aggregation, which is billed per 1000 index
+    entries instead of one read per matching document; it is only counted for
+    the first page (None otherwise).
+    """
+    query = collection.where('Price', '>=', min_price)
+    if max_price != float('inf'):
+        query = query.where('Price', '<=', max_price)
+    query = query.order_by('Price').order_by('__name__')
+    total = query.count().get()[0][0].value if after is None else None
+    if after is not None:
+        query = query.start_after({'Price': after[0], '__name__': after[1]})
+    products = ProductRecord.from_snapshots(query.select(PRODUCT_FIELDS).limit(limit).get())
+    return products, total
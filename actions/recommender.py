@@ -0,0 +1,248 @@
+import functools
+import math
+import threading
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from actions.records import ProductRecord
+from actions.search_index import char_ngrams, tokenize
+
+######################## Item-Similarity Recommender ########################
+
+# Feature space: hashed title character n-grams (TF-IDF), then one-hot blocks
+# for category, brand and a log-scale price bucket. Hashing keeps the width
+# fixed, so products can be added without re-numbering columns.
+TITLE_DIM = 1 << 18
+CATEGORY_DIM = 1 << 12
+BRAND_DIM = 1 << 12
+PRICE_BUCKETS = 64
+PRICE_STEP = 1.25  # bucket b holds prices from 1.25**b to 1.25**(b + 1)
+
+CATEGORY_OFFSET = TITLE_DIM
+BRAND_OFFSET = CATEGORY_OFFSET + CATEGORY_DIM
+PRICE_OFFSET = BRAND_OFFSET + BRAND_DIM
+DIMENSIONS = PRICE_OFFSET + PRICE_BUCKETS
+
+# Share of each block in a product's (unit length) vector.
+TITLE_WEIGHT = 1.0
+CATEGORY_WEIGHT = 0.6
+BRAND_WEIGHT = 0.4
+PRICE_WEIGHT = 0.3
+# Neighbouring price buckets get this share of the bucket's weight, so close
+# prices on either side of a bucket edge still match.
+PRICE_SPREAD = 0.5
+
+
+def _hash(text: Text) -> int:
+    # Stable across processes, unlike hash(), so every worker builds the same matrix.
+    return zlib.crc32(text.encode('utf-8'))
+
+
+# Bounded, because query words come from users as well as from titles.
+TOKEN_CACHE_SIZE = 1 << 16
+
+
+@functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _token_columns(token: Text) -> Tuple[int, ...]:
+    # Titles share a small vocabulary, so each word is only split into n-grams once.
+    return tuple(_hash(gram) % TITLE_DIM for gram in char_ngrams(token))
+
+
+class _Block:
+    """Transposed feature matrix (features x products) for a fixed list of products.
+
+    Stored feature-major, so scoring a sparse query only touches the products
+    that share one of its features.
+    """
+
+    __slots__ = ('matrix', 'ids', 'eligible')
+
+    def __init__(self, matrix: sparse.csr_matrix, ids: List[Text], eligible: np.ndarray):
+        self.matrix = matrix
+        self.ids = ids
+        self.eligible = eligible
+
+    @classmethod
+    def empty(cls) -> "_Block":
+        return cls(sparse.csr_matrix((DIMENSIONS, 0), dtype=np.float32), [], np.zeros(0, dtype=bool))
+
+
+class Recommender:
+    """Top-k cosine similarity between products, kept current from catalog deltas.
+
+    Changed products go to a small delta block and their rows in the base
+    block are masked out; once the delta outgrows `COMPACT_RATIO` of the base,
+    everything is rebuilt from `source()`, which also refreshes the IDF
+    weights. Out-of-stock products are never recommended.
+    """
+
+    COMPACT_RATIO = 0.02
+    MIN_COMPACT = 512
+
+    def __init__(self, source: Callable[[], Iterable[ProductRecord]]):
+        self._source = source
+        self._lock = threading.RLock()
+        self._idf = np.ones(TITLE_DIM, dtype=np.float32)
+        self._slots: Dict[Text, int] = {}
+        self._delta: Dict[Text, ProductRecord] = {}
+        # Replaced as a whole on every change, so queries never see a half-applied delta.
+        self._view: Tuple[_Block, _Block] = (_Block.empty(), _Block.empty())
+        self._built = False
+
+    @property
+    def ready(self) -> bool:
+        return self._built
+
+    def __len__(self) -> int:
+        base, delta = self._view
+        return int(base.eligible.sum()) + int(delta.eligible.sum())
+
+    ######################## Vectors ########################
+
+    def _features(self, records: Sequence[ProductRecord]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """COO parts (row, column, term count) of the title block, and the price bucket per row (-1 for none)."""
+        columns: List[int] = []
+        lengths = np.zeros(len(records), dtype=np.int64)
+        buckets = np.full(len(records), -1, dtype=np.int64)
+        for row, record in enumerate(records):
+            start = len(columns)
+            for token in tokenize(record.title or ''):
+                columns.extend(_token_columns(token))
+            lengths[row] = len(columns) - start
+            price = record.effective_price
+            if price > 0:
+                buckets[row] = min(PRICE_BUCKETS - 1, max(0, int(math.log(price, PRICE_STEP))))
+        # Repeated n-grams within a title collapse into one entry with their count.
+        keys = (np.repeat(np.arange(len(records), dtype=np.int64), lengths) * TITLE_DIM
+                + np.asarray(columns, dtype=np.int64))
+        keys, counts = np.unique(keys, return_counts=True)
+        return keys // TITLE_DIM, keys % TITLE_DIM, counts.astype(np.float32), buckets
+
+    def _vectors(self, records: Sequence[ProductRecord], refit: bool = False) -> sparse.csr_matrix:
+        """Unit-length feature vectors as a (len(records) x features) matrix."""
+        n = len(records)
+        rows, columns, counts, buckets = self._features(records)
+        if refit:
+            df = np.bincount(columns, minlength=TITLE_DIM)
+            self._idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+        data = (1.0 + np.log(counts)) * self._idf[columns]
+        norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=n))
+        parts_rows, parts_columns, parts_data = [rows], [columns], [data / norms[rows] * TITLE_WEIGHT]
+
+        def one_hot(values: List[Optional[Text]], offset: int, width: int, weight: float) -> None:
+            index = np.array([i for i, value in enumerate(values) if value], dtype=np.int64)
+            parts_rows.append(index)
+            parts_columns.append(np.array([offset + _hash(values[i]) % width for i in index], dtype=np.int64))
+            parts_data.append(np.full(len(index), weight))
+
+        one_hot([r.category_id for r in records], CATEGORY_OFFSET, CATEGORY_DIM, CATEGORY_WEIGHT)
+        one_hot([(r.brand or '').lower() for r in records], BRAND_OFFSET, BRAND_DIM, BRAND_WEIGHT)
+
+        priced = np.flatnonzero(buckets >= 0)
+        spread = np.array([PRICE_SPREAD, 1.0, PRICE_SPREAD])
+        for step, share in zip((-1, 0, 1), spread * PRICE_WEIGHT / np.sqrt((spread ** 2).sum())):
+            neighbour = buckets[priced] + step
+            inside = (neighbour >= 0) & (neighbour < PRICE_BUCKETS)
+            parts_rows.append(priced[inside])
+            parts_columns.append(PRICE_OFFSET + neighbour[inside])
+            parts_data.append(np.full(int(inside.sum()), share))
+
+        rows = np.concatenate(parts_rows)
+        data = np.concatenate(parts_data)
+        totals = np.sqrt(np.bincount(rows, weights=data * data, minlength=n))
+        data = (data / totals[rows]).astype(np.float32)
+        return sparse.csr_matrix((data, (rows, np.concatenate(parts_columns))), shape=(n, DIMENSIONS))
+
+    def _block(self, records: Sequence[ProductRecord], refit: bool = False) -> _Block:
+        eligible = np.array([(record.stock or 0) > 0 for record in records], dtype=bool)
+        matrix = self._vectors(records, refit).T.tocsr()
+        return _Block(matrix, [record.id for record in records], eligible)
+
+    ######################## Updates ########################
+
+    def rebuild(self, records: Optional[Iterable[ProductRecord]] = None) -> None:
+        """Build the base block (and IDF weights) from every product."""
+        records = list(self._source() if records is None else records)
+        with self._lock:
+            base = self._block(records, refit=True)
+            self._slots = {product_id: slot for slot, product_id in enumerate(base.ids)}
+            self._delta = {}
+            self._view = (base, _Block.empty())
+            self._built = True
+
+    def apply(self, upserts: Dict[Text, ProductRecord], removed: Iterable[Text] = ()) -> None:
+        """Catalog listener: mask changed base rows and re-vectorize them into the delta block."""
+        removed = list(removed)
+        with self._lock:
+            if not self._built or len(self._delta) + len(upserts) > max(
+                    self.MIN_COMPACT, len(self._slots) * self.COMPACT_RATIO):
+                self.rebuild()
+                return
+            base, _ = self._view
+            eligible = base.eligible
+            masked = [self._slots[i] for i in (*upserts, *removed) if i in self._slots]
+            if masked:
+                eligible = eligible.copy()
+                eligible[masked] = False
+            for product_id in removed:
+                self._delta.pop(product_id, None)
+            self._delta.update(upserts)
+            self._view = (_Block(base.matrix, base.ids, eligible), self._block(list(self._delta.values())))
+
+    ######################## Queries ########################
+
+    def query(self, product: Optional[ProductRecord] = None, text: Optional[Text] = None,
+              category_id: Optional[Text] = None, brand: Optional[Text] = None) -> ProductRecord:
+        """What to find products similar to: a viewed `product`, searched text, category and brand.
+
+        Explicit arguments take precedence over the product's own fields.
+        """
+        if product is None:
+            return ProductRecord(None, text or '', 0, 0, 0, category_id, brand or '')
+        return ProductRecord(product.id, text or product.title, product.price, product.sale_price,
+                             product.stock, category_id or product.category_id, brand or product.brand)
+
+    def recommend(self, query: ProductRecord, k: int = 5, exclude: Iterable[Text] = ()) -> List[Text]:
+        return self.recommend_batch([query], k, exclude)[0]
+
+    def recommend_batch(self, queries: Sequence[ProductRecord], k: int = 5,
+                        exclude: Iterable[Text] = ()) -> List[List[Text]]:
+        """Ids of the `k` in-stock products most similar to each query, best first.
+
+        A query's own product is never among its results.
+        """
+        base, delta = self._view
+        exclude = set(exclude)
+        wanted = k + len(exclude) + 1
+        vectors = self._vectors(queries)
+        results = []
+        for q, query in enumerate(queries):
+            features = vectors.indices[vectors.indptr[q]:vectors.indptr[q + 1]]
+            weights = vectors.data[vectors.indptr[q]:vectors.indptr[q + 1]]
+            pairs = self._top(base, features, weights, wanted) + self._top(delta, features, weights, wanted)
+            pairs.sort(key=lambda item: (-item[0], item[1]))
+            skip = exclude | {query.id}
+            results.append([product_id for _, product_id in pairs if product_id not in skip][:k])
+        return results
+
+    @staticmethod
+    def _top(block: _Block, features: np.ndarray, weights: np.ndarray, wanted: int) -> List[Tuple[float, Text]]:
+        """The `wanted` best (score, id) pairs in `block` for one query vector."""
+        n = len(block.ids)
+        if n == 0 or len(features) == 0:
+            return []
+        # Only the postings of the query's features are read; one bincount sums them per product.
+        indptr, indices, data = block.matrix.indptr, block.matrix.indices, block.matrix.data
+        postings = [indices[indptr[f]:indptr[f + 1]] for f in features]
+        scores = np.bincount(np.concatenate(postings),
+                             np.concatenate([data[indptr[f]:indptr[f + 1]] * w for f, w in zip(features, weights)]),
+                             minlength=n)
+        scores *= block.eligible
+        if n > wanted:
+            top = np.argpartition(-scores, wanted)[:wanted]
+        else:
+            top = np.arange(n)
+        return [(score, block.ids[slot]) for slot, score in zip(top.tolist(), scores[top].tolist()) if score > 0]
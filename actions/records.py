@@ -0,0 +1,60 @@
+import sys
+from typing import Any, Dict, List, Optional, Text
+
+######################## Product Records ########################
+
+# The only product fields any action reads. Queries project to these with
+# `select(...)` so descriptions, images etc. are never downloaded.
+PRODUCT_FIELDS = ['Title', 'Price', 'SalePrice', 'Stock', 'CategoryId', 'Brand.Name', 'IsFeatured']
+
+
+def _intern(value: Optional[Text]) -> Optional[Text]:
+    # Brand names and category ids repeat across thousands of products.
+    return sys.intern(value) if value else value
+
+
+class ProductRecord:
+    """Compact, fixed-layout copy of a product document."""
+
+    __slots__ = ('id', 'title', 'price', 'sale_price', 'stock', 'category_id', 'brand', 'is_featured')
+
+    def __init__(self, product_id: Text, title: Text, price: Any = 0, sale_price: Any = 0, stock: Any = 0,
+                 category_id: Optional[Text] = None, brand: Text = '', is_featured: bool = False):
+        self.id = product_id
+        self.title = title
+        self.price = price
+        self.sale_price = sale_price
+        self.stock = stock
+        self.category_id = _intern(category_id)
+        self.brand = _intern(brand)
+        self.is_featured = is_featured
+
+    @classmethod
+    def from_dict(cls, product_id: Text, product: Dict[Text, Any],
+                  default_title: Text = 'Unnamed Product') -> "ProductRecord":
+        return cls(
+            product_id,
+            product.get('Title', default_title),
+            product.get('Price', 0),
+            product.get('SalePrice', 0),
+            product.get('Stock', 0),
+            product.get('CategoryId'),
+            (product.get('Brand') or {}).get('Name', ''),
+            bool(product.get('IsFeatured', False)),
+        )
+
+    @classmethod
+    def from_snapshots(cls, snapshots: Any, default_title: Text = 'Unnamed Product') -> List["ProductRecord"]:
+        return [cls.from_dict(doc.id, doc.to_dict(), default_title) for doc in snapshots]
+
+    @property
+    def on_sale(self) -> bool:
+        return self.sale_price > 0 and self.sale_price < self.price
+
+    @property
+    def effective_price(self) -> float:
+        """The price a customer pays: `sale_price` when it is a real discount, else `price`."""
+        return float(self.sale_price if self.on_sale else self.price)
+
+    def __repr__(self) -> Text:
+        return f"ProductRecord({self.id!r}, {self.title!r}, price={self.price!r}, stock={self.stock!r})"
@@ -0,0 +1,61 @@
+import functools
+import json
+import os
+from typing import Any, Dict, Iterable, List, Text
+
+from actions.records import ProductRecord
+
+######################## Product Card Rendering ########################
+
+# Input channels that get a structured card payload next to the text, e.g. "socketio,facebook".
+CARD_CHANNELS = {c.strip() for c in os.environ.get('PRODUCT_CARD_CHANNELS', '').split(',') if c.strip()}
+CARD_CACHE_SIZE = int(os.environ.get('PRODUCT_CARD_CACHE_SIZE', '16384'))
+
+
+@functools.lru_cache(maxsize=CARD_CACHE_SIZE, typed=True)
+def _format_card(title: Text, price: Any, sale_price: Any, stock: Any, featured: bool) -> Text:
+    # Keyed on the displayed fields, so a product is only re-formatted when one of them changes.
+    # Typed, because 100 and 100.0 are equal keys but display differently.
+    stock_line = f"{stock} left in stock" if featured else f"{stock} available"
+    if sale_price > 0 and sale_price < price:
+        icon = "🔥" if featured else "🌟"
+        return f"{icon} {title}\n   Regular Price: ₹{price}\n   🏷️ Special Offer: ₹{sale_price}\n   📦 {stock_line}"
+    return f"✨ {title}\n   Price: ₹{price}\n   📦 {stock_line}"
+
+
+def render_card(card: ProductRecord, featured: bool = False) -> Text:
+    """Text card for one product; `featured` uses the showcase wording."""
+    return _format_card(card.title, card.price, card.sale_price, card.stock, featured)
+
+
+def render_cards(cards: Iterable[ProductRecord], featured: bool = False) -> Text:
+    return "\n\n".join(render_card(card, featured) for card in cards)
+
+
+def cards_payload(cards: Iterable[ProductRecord]) -> Dict[Text, Any]:
+    """Rasa custom payload for channels that can display product cards."""
+    items = []
+    for card in cards:
+        items.append({
+            'id': card.id,
+            'title': card.title,
+            'price': card.price,
+            'sale_price': card.sale_price if card.on_sale else None,
+            'stock': card.stock,
+        })
+    return {
+        'type': 'product_cards',
+        'products': items,
+        'quick_replies': [
+            {'title': item['title'], 'payload': '/product_search' + json.dumps({'product': item['title']})}
+            for item in items
+        ],
+    }
+
+
+def utter_products(dispatcher: Any, tracker: Any, text: Text, cards: List[ProductRecord] = ()) -> None:
+    """Send `text`, plus the card payload when the user's channel can display it."""
+    if cards and tracker.get_latest_input_channel() in CARD_CHANNELS:
+        dispatcher.utter_message(text=text, json_message=cards_payload(cards))
+    else:
+        dispatcher.utter_message(text=text)
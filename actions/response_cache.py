@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Text
+
+from actions import metrics
+
+######################## Response Cache ########################
+
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'stale_until')
+
+    def __init__(self, value: Any, ttl: float, max_stale: float):
+        now = time.monotonic()
+        self.value = value
+        self.expires_at = now + ttl
+        self.stale_until = now + ttl + max_stale
+
+
+class ResponseCache:
+    """TTL + LRU cache for rendered responses shared by every conversation.
+
+    - Only one load per key runs at a time, as a task of its own; callers
+      arriving during it wait for that load (single-flight). Cancelling one of
+      them does not cancel the load the others are waiting for.
+    - Once a value has expired it is still returned at once for up to
+      `max_stale` seconds, while a load revalidates it in the background, so
+      a failing load keeps the expired value in use.
+    - `stats` counts hits, misses, refreshes, coalesced waits, stale serves and
+      errors per key.
+    """
+
+    def __init__(self, max_entries: int = 128, default_ttl: float = 60.0, max_stale: float = 600.0):
+        self._max_entries = max_entries
+        self._default_ttl = default_ttl
+        self._max_stale = max_stale
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.stats: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def snapshot(self) -> Dict[Text, int]:
+        return dict(self.stats)
+
+    def _store(self, key: Hashable, value: Any, ttl: Optional[float]) -> None:
+        self._entries[key] = _Entry(value, self._default_ttl if ttl is None else ttl, self._max_stale)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                          ttl: Optional[float] = None) -> Any:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now < entry.expires_at:
+            self._entries.move_to_end(key)
+            self.stats[f"{key}.hit"] += 1
+            metrics.record_cache_hit()
+            return entry.value
+
+        usable_stale = entry is not None and now < entry.stale_until
+        load = self._inflight.get(key)
+        if load is None:
+            self.stats[f"{key}.refresh" if entry is not None else f"{key}.miss"] += 1
+            load = asyncio.ensure_future(self._load(key, loader, ttl))
+            # Retrieved here too, so asyncio doesn't warn when every caller got a stale value or gave up.
+            load.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self._inflight[key] = load
+        elif not usable_stale:
+            self.stats[f"{key}.coalesced"] += 1
+            metrics.record_cache_hit()
+        if usable_stale:
+            self.stats[f"{key}.stale"] += 1
+            metrics.record_cache_hit()
+            return entry.value
+        # A caller that is cancelled stops waiting; the load carries on for the others.
+        return await asyncio.shield(load)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl: Optional[float]) -> Any:
+        try:
+            value = await loader()
+        except Exception as e:
+            self.stats[f"{key}.error"] += 1
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry.stale_until:
+                logging.warning(f"Serving stale '{key}' response after refresh error: {e}")
+                return entry.value
+            raise
+        else:
+            self._store(key, value, ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
@@ -0,0 +1,279 @@
+import bisect
+import heapq
+import re
+import threading
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Text, Tuple
+
+from actions.records import ProductRecord
+
+######################## Product Title Index ########################
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Relevance weights for the ways a query word can match a title word.
+EXACT_WEIGHT = 3.0
+PREFIX_WEIGHT = 2.0
+SUBSTRING_WEIGHT = 1.5
+PHRASE_BONUS = 2.0
+
+
+def tokenize(text: Text) -> List[Text]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def char_ngrams(token: Text, n: int = 3, padded: bool = True) -> Set[Text]:
+    if padded:
+        token = f" {token} "
+    if len(token) <= n:
+        return {token}
+    return {token[i:i + n] for i in range(len(token) - n + 1)}
+
+
+class TitleIndex:
+    """Inverted index over product titles: word postings plus a character
+    n-gram index over the word vocabulary.
+
+    Query words are first expanded against the vocabulary (exact, prefix,
+    substring and n-gram fuzzy matches), which is small compared to the
+    catalog, and only the postings of the matched words are scored.
+
+    Each word's postings are kept sorted by title length (the tie-breaker
+    between equal scores), so a query walks them in rank order and stops once
+    it has enough results instead of scoring every match.
+    """
+
+    def __init__(self, ngram: int = 3, min_similarity: float = 0.5):
+        self._n = ngram
+        self._min_similarity = min_similarity
+        self._lock = threading.RLock()
+        self._doc_ids: Dict[Text, int] = {}
+        self._product_ids: List[Optional[Text]] = []
+        self._titles: List[Text] = []
+        self._title_lengths: List[int] = []
+        self._free: List[int] = []
+        # word -> sorted `title_length << 32 | doc` keys; words appended to out
+        # of order (e.g. while the catalog loads) are sorted on the next query.
+        self._postings: Dict[Text, array] = {}
+        self._unsorted: Set[Text] = set()
+        self._grams: Dict[Text, Set[Text]] = {}
+        self._vocab: List[Text] = []
+        self._vocab_dirty = False
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    ######################## Updates ########################
+
+    def add(self, product_id: Text, title: Text) -> None:
+        with self._lock:
+            self.remove(product_id)
+            if self._free:
+                doc = self._free.pop()
+                self._product_ids[doc] = product_id
+                self._titles[doc] = title.lower()
+                self._title_lengths[doc] = len(title)
+            else:
+                doc = len(self._product_ids)
+                self._product_ids.append(product_id)
+                self._titles.append(title.lower())
+                self._title_lengths.append(len(title))
+            self._doc_ids[product_id] = doc
+            key = self._key(doc)
+            for token in set(tokenize(title)):
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = array('Q')
+                    for gram in char_ngrams(token, self._n):
+                        self._grams.setdefault(gram, set()).add(token)
+                    self._vocab_dirty = True
+                elif key < postings[-1]:
+                    self._unsorted.add(token)
+                postings.append(key)
+
+    def remove(self, product_id: Text) -> None:
+        with self._lock:
+            doc = self._doc_ids.pop(product_id, None)
+            if doc is None:
+                return
+            key = self._key(doc)
+            for token in set(tokenize(self._titles[doc])):
+                postings = self._postings[token]
+                if token in self._unsorted:
+                    del postings[postings.index(key)]
+                else:
+                    del postings[bisect.bisect_left(postings, key)]
+                if not postings:
+                    del self._postings[token]
+                    self._unsorted.discard(token)
+                    for gram in char_ngrams(token, self._n):
+                        tokens = self._grams[gram]
+                        tokens.discard(token)
+                        if not tokens:
+                            del self._grams[gram]
+                    self._vocab_dirty = True
+            self._product_ids[doc] = None
+            self._titles[doc] = ''
+            self._free.append(doc)
+
+    def apply(self, upserts: Dict[Text, ProductRecord], removed: Iterable[Text] = ()) -> None:
+        """Catalog listener: index added/modified products, drop removed ones."""
+        with self._lock:
+            for product_id in removed:
+                self.remove(product_id)
+            for product_id, product in upserts.items():
+                self.add(product_id, product.title)
+
+    def settle(self) -> None:
+        """Sort the vocabulary and every postings list now rather than on the next query."""
+        with self._lock:
+            self._sorted_vocab()
+            for token in list(self._unsorted):
+                self._sorted_postings(token)
+
+    ######################## Queries ########################
+
+    def _sorted_vocab(self) -> List[Text]:
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        return self._vocab
+
+    def _expand(self, term: Text) -> Dict[Text, float]:
+        """Vocabulary words matching `term`, with the best weight for each."""
+        matches: Dict[Text, float] = {}
+        if term in self._postings:
+            matches[term] = EXACT_WEIGHT
+
+        vocab = self._sorted_vocab()
+        i = bisect.bisect_left(vocab, term)
+        while i < len(vocab) and vocab[i].startswith(term):
+            matches.setdefault(vocab[i], PREFIX_WEIGHT)
+            i += 1
+
+        if len(term) >= self._n:
+            inner = char_ngrams(term, self._n, padded=False)
+            candidates = set.intersection(*(self._grams.get(g, set()) for g in inner))
+            for token in candidates:
+                if term in token:
+                    matches.setdefault(token, SUBSTRING_WEIGHT)
+
+        if not matches:
+            grams = char_ngrams(term, self._n)
+            overlap: Dict[Text, int] = {}
+            for gram in grams:
+                for token in self._grams.get(gram, ()):
+                    overlap[token] = overlap.get(token, 0) + 1
+            for token, shared in overlap.items():
+                similarity = 2.0 * shared / (len(grams) + len(char_ngrams(token, self._n)))
+                if similarity >= self._min_similarity:
+                    matches[token] = similarity
+        return matches
+
+    def _key(self, doc: int) -> int:
+        return self._title_lengths[doc] << 32 | doc
+
+    def _sorted_postings(self, token: Text) -> array:
+        if token in self._unsorted:
+            self._postings[token] = array('Q', sorted(self._postings[token]))
+            self._unsorted.discard(token)
+        return self._postings[token]
+
+    def _ranked(self, tokens: Iterable[Text]) -> Iterator[int]:
+        """Keys of the documents containing any of `tokens`, shortest title first, each once."""
+        lists = [self._sorted_postings(token) for token in tokens]
+        if len(lists) == 1:
+            yield from lists[0]
+            return
+        previous = None
+        for key in heapq.merge(*lists):
+            if key != previous:
+                previous = key
+                yield key
+
+    def search(self, query: Text, limit: int = 5) -> List[Tuple[Text, float]]:
+        """Return up to `limit` (product_id, score) pairs, best first."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            expansions = [e for e in (self._expand(term) for term in terms) if e]
+            if not expansions:
+                return []
+
+            if len(expansions) == 1:
+                # Walk the weight tiers and stop once `limit` results are found.
+                results: List[Tuple[int, float]] = []
+                seen: Set[int] = set()
+                for weight in sorted(set(expansions[0].values()), reverse=True):
+                    tokens = [token for token, w in expansions[0].items() if w == weight]
+                    for key in self._ranked(tokens):
+                        if key not in seen:
+                            seen.add(key)
+                            results.append((key & 0xFFFFFFFF, weight))
+                            if len(results) >= limit:
+                                break
+                    if len(results) >= limit:
+                        break
+                return [(self._product_ids[doc], score) for doc, score in results]
+
+            # Score titles matching every word, walking the rarest word's postings;
+            # fall back to titles matching any word if too few match them all.
+            terms_matches = [
+                sorted(((self._sorted_postings(token), weight) for token, weight in expansion.items()),
+                       key=lambda match: -match[1])
+                for expansion in expansions
+            ]
+            phrase = query.lower().strip()
+            top = [matches[0][1] for matches in terms_matches]
+            rarest = min(expansions, key=lambda e: sum(len(self._postings[token]) for token in e))
+            best = self._best(self._ranked(rarest), terms_matches, phrase, limit, sum(top) + PHRASE_BONUS, every=True)
+            if len(best) < limit:
+                # Whatever is left misses a word, so it scores at most all but the
+                # cheapest word's best weight; the phrase can't match without every
+                # word unless one is too short for substring matches.
+                bound = sum(top) - min(top)
+                if any(len(term) < self._n for term in terms):
+                    bound += PHRASE_BONUS
+                tokens = {token for expansion in expansions for token in expansion}
+                best = self._best(self._ranked(tokens), terms_matches, phrase, limit, bound, every=False, kept=best)
+            return [(self._product_ids[-negative_key & 0xFFFFFFFF], score) for score, negative_key in
+                    sorted(best, reverse=True)]
+
+    def _best(self, keys: Iterator[int], terms_matches: List[List[Tuple[array, float]]], phrase: Text,
+              limit: int, bound: float, every: bool,
+              kept: List[Tuple[float, int]] = ()) -> List[Tuple[float, int]]:
+        """The `limit` best (score, -key) of `kept` and `keys`, as an unordered heap.
+
+        `keys` come shortest title first and none of them can score above
+        `bound`, so once `limit` results score `bound` no later key can
+        displace them and the walk stops.
+        """
+        bisect_left = bisect.bisect_left
+        heap = list(kept)
+        heapq.heapify(heap)  # worst result on top
+        skip = {-negative_key for _, negative_key in heap}
+        for key in keys:
+            if len(heap) == limit and heap[0][0] >= bound:
+                break
+            if key in skip:
+                continue
+            score = 0.0
+            for matches in terms_matches:
+                # Best weight first, so the first word containing the document is its best match.
+                for postings, weight in matches:
+                    i = bisect_left(postings, key)
+                    if i < len(postings) and postings[i] == key:
+                        score += weight
+                        break
+                else:
+                    if every:
+                        break
+            else:
+                if phrase in self._titles[key & 0xFFFFFFFF]:
+                    score += PHRASE_BONUS
+                if len(heap) < limit:
+                    heapq.heappush(heap, (score, -key))
+                elif (score, -key) > heap[0]:
+                    heapq.heapreplace(heap, (score, -key))
+        return heap
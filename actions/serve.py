@@ -0,0 +1,122 @@
+"""Run the action server as several workers sharing one catalog.
+
+    python -m actions.serve [--workers 4] [--port 5055]
+
+With one worker (the default unless CATALOG_SNAPSHOT is set) this is just
+`rasa run actions`, listening to Firestore itself. With more, it starts two
+processes:
+
+* `python -m actions.updater`, the only process listening to Firestore for
+  products and taxonomy, which republishes the catalog snapshot on change;
+* `rasa run actions` with ACTION_SERVER_SANIC_WORKERS workers behind the one
+  port. Every worker maps the same snapshot file (CATALOG_MODE=snapshot), so
+  the catalog pages sit in the page cache once rather than once per worker.
+
+The updater is started first and the server only once the first snapshot
+is on disk (or after `--snapshot-wait` seconds), so the Sanic supervisor
+loads it and builds the title index, brand postings and recommender
+matrices before forking: the workers share those pages copy-on-write
+instead of each building their own. If the updater exits it is restarted,
+after a delay that doubles with each exit in a row up to a minute, while the
+workers keep serving the last snapshot. When the server exits the updater
+is stopped and the server's exit code returned.
+"""
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import List
+
+DEFAULT_SNAPSHOT = '/tmp/dekozy/catalog.snap'
+MAX_RESTART_DELAY = 60.0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    snapshot = os.environ.get('CATALOG_SNAPSHOT')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('ACTION_WORKERS') or (os.cpu_count() if snapshot else 1) or 1))
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--snapshot', default=snapshot or DEFAULT_SNAPSHOT)
+    parser.add_argument('--snapshot-wait', type=float, default=float(os.environ.get('CATALOG_SNAPSHOT_WAIT', '120')),
+                        help="seconds to wait for the first snapshot before starting the server without it")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        os.execvp('rasa', ['rasa', 'run', 'actions', '--port', str(args.port)])
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s serve %(levelname)s %(message)s')
+    env = dict(os.environ, CATALOG_MODE='snapshot', CATALOG_SNAPSHOT=args.snapshot,
+               ACTION_SERVER_SANIC_WORKERS=str(args.workers))
+    children: List[subprocess.Popen] = []
+    stopping = []
+
+    def start_updater() -> subprocess.Popen:
+        updater = subprocess.Popen([sys.executable, '-m', 'actions.updater', '--snapshot', args.snapshot], env=env)
+        children.append(updater)
+        return updater
+
+    def forward(signum, frame):
+        stopping.append(signum)
+        for child in children:
+            if child.poll() is None:
+                child.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    updater = start_updater()
+    started = time.monotonic()
+    restarts = 0
+    restart_at = None
+    deadline = time.monotonic() + args.snapshot_wait
+    while not os.path.exists(args.snapshot) and time.monotonic() < deadline and not stopping:
+        # Until the first snapshot, `--snapshot-wait` bounds the restarts.
+        if updater.poll() is not None:
+            logging.warning(f"Catalog updater exited with {updater.returncode} before publishing; restarting")
+            time.sleep(1)
+            updater = start_updater()
+        time.sleep(0.2)
+    if stopping:
+        return _stop(children, updater)
+    if not os.path.exists(args.snapshot):
+        logging.warning(f"No catalog snapshot after {args.snapshot_wait:.0f}s; workers will load it when it appears")
+
+    server = subprocess.Popen(['rasa', 'run', 'actions', '--port', str(args.port)], env=env)
+    children.append(server)
+    while server.poll() is None:
+        if updater.poll() is not None and not stopping:
+            if restart_at is None:
+                restarts += 1
+                delay = min(2.0 ** (restarts - 1), MAX_RESTART_DELAY)
+                logging.error(f"Catalog updater exited with {updater.returncode}; restarting in {delay:.0f}s, "
+                              f"workers keep serving the last snapshot")
+                restart_at = time.monotonic() + delay
+            elif time.monotonic() >= restart_at:
+                updater = start_updater()
+                restart_at = None
+                started = time.monotonic()
+        elif restarts and updater.poll() is None and time.monotonic() - started > MAX_RESTART_DELAY:
+            # It has stayed up for a while, so the next exit starts the delays over.
+            restarts = 0
+        time.sleep(0.5)
+    return _stop(children, server)
+
+
+def _stop(children: List[subprocess.Popen], main: subprocess.Popen) -> int:
+    for child in children:
+        if child.poll() is None:
+            child.terminate()
+    for child in children:
+        try:
+            child.wait(10)
+        except subprocess.TimeoutExpired:
+            child.kill()
+    return main.returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
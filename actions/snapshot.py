@@ -0,0 +1,415 @@
+import argparse
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from collections.abc import ItemsView, Mapping, ValuesView
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Text, Tuple
+
+from actions.price_index import indexed_price
+from actions.records import PRODUCT_FIELDS, ProductRecord
+
+######################## Catalog Snapshot File ########################
+
+# Layout (the writer's native byte order, header included, so the byte-order
+# mark reads back differently on a foreign machine; every section 8-byte aligned):
+#
+#   header    MAGIC, format, byte-order mark, version, created_at, products, sections
+#   sections  name[8], offset, length — one entry per section below
+#   ids       string table of product ids, sorted, so lookups bisect
+#   titles    string table, one entry per product
+#   brands    string table of distinct brand names; `brand` indexes into it
+#   cats      string table of distinct category ids; `category` indexes into it
+#   price, sale (float64), stock (int64), brand, category (uint32), flags (uint8)
+#   byprice   rows (uint32) of products with a numeric price, by price then id, with
+#   sortprc   their prices (float64), so price ranges bisect the file
+#   taxonomy  JSON {"categories": {...}, "brands": {...}}
+#   changes   optional JSON {"since": version, "upserts": [ids], "removed": [ids]}:
+#             what changed after the snapshot `since`, so a reader that has
+#             that one mapped can apply just these products
+#
+# A string table is a uint32 count, count + 1 uint32 offsets and a UTF-8 blob.
+
+MAGIC = b'DKZCATv\x00'
+FORMAT_VERSION = 3
+BYTE_ORDER_MARK = 0x01020304
+NO_CATEGORY = 0xFFFFFFFF
+
+_HEADER = struct.Struct('=8sIIQdII')
+_SECTION = struct.Struct('=8sQQ')
+
+FEATURED, PRICE_IS_INT, SALE_IS_INT = 1, 2, 4
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _string_table(values: List[Text]) -> bytes:
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = array('I', [0])
+    for item in encoded:
+        offsets.append(offsets[-1] + len(item))
+    return array('I', [len(encoded)]).tobytes() + offsets.tobytes() + b''.join(encoded)
+
+
+def _number(value: Any) -> Tuple[float, bool]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 0.0, True
+    return float(value), isinstance(value, int)
+
+
+def export_snapshot(path: Text, products: Iterable[ProductRecord],
+                    categories: Optional[Dict[Text, Dict[Text, Any]]] = None,
+                    brands: Optional[Dict[Text, Dict[Text, Any]]] = None,
+                    version: Optional[int] = None,
+                    changes: Optional[Tuple[int, List[Text], List[Text]]] = None) -> int:
+    """Write `products` (and the taxonomy) to `path` atomically; returns the version.
+
+    `changes` is (since, upserted ids, removed ids) relative to the version `since`.
+    """
+    records = sorted(products, key=lambda product: product.id)
+    version = time.time_ns() if version is None else version
+
+    brand_names: Dict[Text, int] = {}
+    category_ids: Dict[Text, int] = {}
+    price, sale, stock = array('d'), array('d'), array('q')
+    brand, category, flags = array('I'), array('I'), array('B')
+    for record in records:
+        regular, regular_is_int = _number(record.price)
+        offer, offer_is_int = _number(record.sale_price)
+        price.append(regular)
+        sale.append(offer)
+        stock.append(int(record.stock) if isinstance(record.stock, (int, float)) else 0)
+        brand.append(brand_names.setdefault(record.brand or '', len(brand_names)))
+        category.append(NO_CATEGORY if record.category_id is None
+                        else category_ids.setdefault(record.category_id, len(category_ids)))
+        flags.append((FEATURED if record.is_featured else 0)
+                     | (PRICE_IS_INT if regular_is_int else 0) | (SALE_IS_INT if offer_is_int else 0))
+
+    # Records are in id order and the sort is stable, so equal prices stay in id order.
+    prices = [indexed_price(record) for record in records]
+    by_price = sorted((row for row, value in enumerate(prices) if value is not None), key=prices.__getitem__)
+    taxonomy = {'categories': categories or {}, 'brands': brands or {}}
+    sections = [
+        (b'ids', _string_table([record.id for record in records])),
+        (b'titles', _string_table([record.title for record in records])),
+        (b'brands', _string_table(list(brand_names))),
+        (b'cats', _string_table(list(category_ids))),
+        (b'price', price.tobytes()),
+        (b'sale', sale.tobytes()),
+        (b'stock', stock.tobytes()),
+        (b'brand', brand.tobytes()),
+        (b'category', category.tobytes()),
+        (b'flags', flags.tobytes()),
+        (b'byprice', array('I', by_price).tobytes()),
+        (b'sortprc', array('d', (prices[row] for row in by_price)).tobytes()),
+        (b'taxonomy', json.dumps(taxonomy, default=str).encode('utf-8')),
+    ]
+    if changes is not None:
+        since, upserts, removed = changes
+        sections.append((b'changes', json.dumps({'since': since, 'upserts': list(upserts),
+                                                  'removed': list(removed)}).encode('utf-8')))
+
+    offset = _align(_HEADER.size + _SECTION.size * len(sections))
+    table = []
+    for name, data in sections:
+        table.append(_SECTION.pack(name, offset, len(data)))
+        offset = _align(offset + len(data))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.catalog-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(_HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK, version, time.time(),
+                                   len(records), len(sections)))
+            out.write(b''.join(table))
+            for name, data in sections:
+                out.write(b'\0' * (_align(out.tell()) - out.tell()))
+                out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        # Readers either see the old file or the complete new one.
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return version
+
+
+class _StringTable:
+    """Read-only sequence of strings over a string-table section."""
+
+    def __init__(self, view: memoryview):
+        count = struct.unpack_from('I', view)[0]
+        self._offsets = view[4:4 + 4 * (count + 1)].cast('I')
+        self._blob = view[4 + 4 * (count + 1):]
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> Text:
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+    def tolist(self) -> List[Text]:
+        """Every string at once; much faster than indexing one by one."""
+        blob, offsets = self._blob.tobytes(), self._offsets.tolist()
+        return [blob[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+    def release(self) -> None:
+        self._offsets.release()
+        self._blob.release()
+
+
+class MappedCatalog:
+    """Products read straight from a memory-mapped snapshot file.
+
+    Nothing is copied at load time: columns are typed views over the shared
+    mapping, and a `ProductRecord` is decoded only when one is asked for, so
+    every process mapping the same file shares its pages.
+    """
+
+    def __init__(self, path: Text):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views: List[Any] = []
+        try:
+            self._parse()
+        except KeyError as e:
+            self.close()
+            raise SnapshotError(f"{path} has no {e} section") from None
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self) -> None:
+        if len(self._mmap) < _HEADER.size:
+            raise SnapshotError(f"{self.path} is too short to be a catalog snapshot")
+        magic, fmt, mark, version, created_at, count, nsections = _HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise SnapshotError(f"{self.path} is not a catalog snapshot")
+        if mark != BYTE_ORDER_MARK:
+            raise SnapshotError("Snapshot was written on a machine with a different byte order")
+        if fmt != FORMAT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot format {fmt} (expected {FORMAT_VERSION})")
+        self.version = version
+        self.created_at = created_at
+        self._count = count
+
+        buffer = memoryview(self._mmap)
+        self._views.append(buffer)
+        sections: Dict[Text, memoryview] = {}
+        for i in range(nsections):
+            name, offset, length = _SECTION.unpack_from(self._mmap, _HEADER.size + i * _SECTION.size)
+            if offset + length > len(self._mmap):
+                raise SnapshotError(f"{self.path} is truncated")
+            sections[name.rstrip(b'\0').decode('ascii')] = buffer[offset:offset + length]
+        self._views.extend(sections.values())
+
+        def column(name: Text, code: Text) -> memoryview:
+            view = sections[name].cast(code)
+            self._views.append(view)
+            return view
+
+        self._ids = _StringTable(sections['ids'])
+        self._titles = _StringTable(sections['titles'])
+        self._brands = _StringTable(sections['brands'])
+        self._categories = _StringTable(sections['cats'])
+        self._price = column('price', 'd')
+        self._sale = column('sale', 'd')
+        self._stock = column('stock', 'q')
+        self._brand = column('brand', 'I')
+        self._category = column('category', 'I')
+        self._flags = column('flags', 'B')
+        self._by_price = column('byprice', 'I')
+        self._sorted_prices = column('sortprc', 'd')
+        self._taxonomy = sections['taxonomy']
+        self._changes = sections.get('changes')
+
+    def close(self) -> None:
+        for table in ('_ids', '_titles', '_brands', '_categories'):
+            if hasattr(self, table):
+                getattr(self, table).release()
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, product_id: Text) -> bool:
+        return self.index(product_id) is not None
+
+    def index(self, product_id: Text) -> Optional[int]:
+        i = bisect.bisect_left(self._ids, product_id)
+        return i if i < self._count and self._ids[i] == product_id else None
+
+    def record(self, i: int) -> ProductRecord:
+        flags = self._flags[i]
+        price, sale = self._price[i], self._sale[i]
+        category = self._category[i]
+        return ProductRecord(
+            self._ids[i],
+            self._titles[i],
+            int(price) if flags & PRICE_IS_INT else price,
+            int(sale) if flags & SALE_IS_INT else sale,
+            self._stock[i],
+            None if category == NO_CATEGORY else self._categories[category],
+            self._brands[self._brand[i]],
+            bool(flags & FEATURED),
+        )
+
+    def get(self, product_id: Text) -> Optional[ProductRecord]:
+        i = self.index(product_id)
+        return None if i is None else self.record(i)
+
+    def ids(self) -> List[Text]:
+        return self._ids.tolist()
+
+    def mapping(self) -> "RecordMapping":
+        """The products as a read-only id -> record mapping that decodes as it is read."""
+        return RecordMapping(self)
+
+    def records(self, ids: Optional[List[Text]] = None) -> Iterator[ProductRecord]:
+        """Decode every product, column by column (with `ids`, reusing those id strings)."""
+        brands, categories = self._brands.tolist(), self._categories.tolist()
+        columns = zip(self._ids.tolist() if ids is None else ids, self._titles.tolist(), self._price.tolist(), self._sale.tolist(),
+                      self._stock.tolist(), self._category.tolist(), self._brand.tolist(), self._flags.tolist())
+        for product_id, title, price, sale, stock, category, brand, flags in columns:
+            yield ProductRecord(
+                product_id,
+                title,
+                int(price) if flags & PRICE_IS_INT else price,
+                int(sale) if flags & SALE_IS_INT else sale,
+                stock,
+                None if category == NO_CATEGORY else categories[category],
+                brands[brand],
+                bool(flags & FEATURED),
+            )
+
+    def price_range(self, min_price: float, max_price: float, limit: int = 5,
+                    offset: int = 0) -> Tuple[List[Text], int]:
+        """Same contract as `PriceIndex.range`, answered from the mapped file."""
+        lo = bisect.bisect_left(self._sorted_prices, min_price)
+        hi = bisect.bisect_right(self._sorted_prices, max_price)
+        if hi <= lo:
+            return [], 0
+        start = lo + offset
+        return [self._ids[row] for row in self._by_price[start:min(hi, start + limit)]], hi - lo
+
+    def taxonomy(self) -> Tuple[Dict[Text, Dict[Text, Any]], Dict[Text, Dict[Text, Any]]]:
+        """The (categories, brands) documents stored with the snapshot."""
+        data = json.loads(str(self._taxonomy, 'utf-8'))
+        return data.get('categories', {}), data.get('brands', {})
+
+    def changes(self) -> Optional[Tuple[int, List[Text], List[Text]]]:
+        """(since, upserted ids, removed ids) if the writer recorded what changed after version `since`."""
+        if self._changes is None:
+            return None
+        data = json.loads(str(self._changes, 'utf-8'))
+        return data['since'], data['upserts'], data['removed']
+
+
+class RecordMapping(Mapping):
+    """`MappedCatalog` products by id, for catalog listeners.
+
+    Nothing is decoded up front: iterating `items()` or `values()` decodes one
+    record at a time, column by column, so indexes can be built from a mapped
+    file without holding a copy of every product.
+    """
+
+    def __init__(self, catalog: MappedCatalog):
+        self._catalog = catalog
+        self._ids: Optional[List[Text]] = None
+
+    def ids(self) -> List[Text]:
+        # Decoded once, so every listener's index holds the same id strings.
+        if self._ids is None:
+            self._ids = self._catalog.ids()
+        return self._ids
+
+    def records(self) -> Iterator[ProductRecord]:
+        return self._catalog.records(self.ids())
+
+    def __len__(self) -> int:
+        return len(self._catalog)
+
+    def __iter__(self) -> Iterator[Text]:
+        return iter(self.ids())
+
+    def __contains__(self, product_id: object) -> bool:
+        return isinstance(product_id, str) and product_id in self._catalog
+
+    def __getitem__(self, product_id: Text) -> ProductRecord:
+        record = self._catalog.get(product_id)
+        if record is None:
+            raise KeyError(product_id)
+        return record
+
+    def items(self) -> ItemsView:
+        return _RecordItems(self)
+
+    def values(self) -> ValuesView:
+        return _RecordValues(self)
+
+
+class _RecordItems(ItemsView):
+    def __iter__(self):
+        return ((record.id, record) for record in self._mapping.records())
+
+
+class _RecordValues(ValuesView):
+    def __iter__(self):
+        return self._mapping.records()
+
+
+######################## Command Line ########################
+
+def export_from_firestore(db: Any, path: Text) -> int:
+    """Read Products (projected), Categories and Brands from `db` into a snapshot."""
+    products = ProductRecord.from_snapshots(db.collection('Products').select(PRODUCT_FIELDS).stream())
+    categories = {doc.id: doc.to_dict() for doc in db.collection('Categories').stream()}
+    brands = {doc.id: doc.to_dict() for doc in db.collection('Brands').stream()}
+    return export_snapshot(path, products, categories, brands)
+
+
+def main(argv: Optional[List[Text]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export or inspect a catalog snapshot.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="write a snapshot from Firestore")
+    export.add_argument('path')
+    info = commands.add_parser('info', help="print a snapshot's header")
+    info.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        from actions.connection import initialize_firebase
+        db = initialize_firebase()
+        if db is None:
+            sys.exit("Firebase is not configured")
+        started = time.perf_counter()
+        version = export_from_firestore(db, args.path)
+        print(f"wrote {args.path} (version {version}) in {time.perf_counter() - started:.1f}s")
+    else:
+        snapshot = MappedCatalog(args.path)
+        categories, brands = snapshot.taxonomy()
+        print(f"version {snapshot.version}, created {time.ctime(snapshot.created_at)}, "
+              f"{len(snapshot)} products, {len(categories)} categories, {len(brands)} brands, "
+              f"{os.path.getsize(args.path)} bytes")
+        snapshot.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import bisect
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Text, Tuple
+
+from actions.records import ProductRecord
+
+######################## Taxonomy ########################
+
+
+class NameLookup:
+    """Case-insensitive name -> id map with substring fallback."""
+
+    def __init__(self, names: Iterable[Tuple[Text, Text]] = ()):
+        self._exact: Dict[Text, Text] = {}
+        for doc_id, name in names:
+            self._exact.setdefault(name.lower(), doc_id)
+        # Shortest names first, so a partial match picks the most specific one.
+        self._ordered = sorted(self._exact.items(), key=lambda item: (len(item[0]), item[0]))
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    def find(self, name: Text) -> Optional[Text]:
+        name = name.lower().strip()
+        if name in self._exact:
+            return self._exact[name]
+        for candidate, doc_id in self._ordered:
+            if name in candidate:
+                return doc_id
+        return None
+
+
+class Taxonomy:
+    """Cached categories, brands and brand -> product postings.
+
+    Categories and Brands are read in one batch and rebuilt either from
+    `on_snapshot` change events or, without a listener, once `ttl` seconds
+    have passed. After a failed reload the loaded copy is kept in use and the
+    next attempt waits `retry_interval` seconds. Brand postings are fed by the
+    product catalog's deltas.
+    """
+
+    def __init__(self, db: Any = None, ttl: float = 300.0, retry_interval: float = 10.0):
+        self._db = db
+        self._ttl = ttl
+        self._retry_interval = retry_interval
+        self._lock = threading.RLock()
+        self._loaded_at: Optional[float] = None
+        self._retry_at = 0.0
+        self._kept_current = False
+        self._watches: List[Any] = []
+        self._listeners: List[Callable[[], None]] = []
+        self._categories: Dict[Text, Dict[Text, Any]] = {}
+        self._brands: Dict[Text, Dict[Text, Any]] = {}
+        self.children: Dict[Text, List[Text]] = {}
+        self.category_names = NameLookup()
+        self.brand_names = NameLookup()
+        # brand -> product ids in id order; brands appended to out of order
+        # (e.g. while the catalog loads) are sorted on the next page.
+        self._brand_postings: Dict[Text, List[Text]] = {}
+        self._unsorted_brands: Set[Text] = set()
+        self._product_brands: Dict[Text, Text] = {}
+
+    ######################## Loading ########################
+
+    def start(self, db: Any = None) -> None:
+        """Load categories and brands and keep them current from change events."""
+        if db is not None:
+            self._db = db
+        if self._db is None or self._watches:
+            return
+        try:
+            self._watches = [
+                self._db.collection('Categories').on_snapshot(self._on_categories),
+                self._db.collection('Brands').on_snapshot(self._on_brands),
+            ]
+        except Exception as e:
+            logging.error(f"Error subscribing to taxonomy changes, falling back to TTL refresh: {e}")
+            self.stop()
+            self.refresh()
+
+    def stop(self) -> None:
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+
+    def load(self, categories: Dict[Text, Dict[Text, Any]], brands: Dict[Text, Dict[Text, Any]],
+             kept_current: bool = False) -> None:
+        """Use categories and brands read elsewhere, e.g. from a catalog snapshot.
+
+        `kept_current` means the caller will load every newer version itself
+        (snapshots followed from an updater), so the TTL refresh is skipped.
+        """
+        with self._lock:
+            self._kept_current = kept_current
+            self._categories = categories
+            self._brands = brands
+            self._rebuild()
+
+    def refresh(self, db: Any = None) -> None:
+        if db is not None:
+            self._db = db
+        categories = {doc.id: doc.to_dict() for doc in self._db.collection('Categories').get()}
+        brands = {doc.id: doc.to_dict() for doc in self._db.collection('Brands').get()}
+        with self._lock:
+            self._categories = categories
+            self._brands = brands
+            self._rebuild()
+
+    def _on_categories(self, docs, changes, read_time) -> None:
+        with self._lock:
+            self._categories = {doc.id: doc.to_dict() for doc in docs}
+            self._rebuild()
+
+    def _on_brands(self, docs, changes, read_time) -> None:
+        with self._lock:
+            self._brands = {doc.id: doc.to_dict() for doc in docs}
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        children: Dict[Text, List[Text]] = {}
+        for category_id, data in self._categories.items():
+            parent_id = data.get('parentId')
+            if parent_id:
+                children.setdefault(parent_id, []).append(category_id)
+        self.children = children
+        self.category_names = NameLookup((i, d.get('Name', '')) for i, d in self._categories.items())
+        self.brand_names = NameLookup((i, d.get('Name', '')) for i, d in self._brands.items())
+        self._loaded_at = time.monotonic()
+        for listener in self._listeners:
+            listener()
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """Register `listener()`, called after categories or brands change."""
+        self._listeners.append(listener)
+
+    def documents(self) -> Tuple[Dict[Text, Dict[Text, Any]], Dict[Text, Dict[Text, Any]]]:
+        """Copies of the (categories, brands) documents, e.g. to write a snapshot."""
+        with self._lock:
+            return dict(self._categories), dict(self._brands)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    @property
+    def stale(self) -> bool:
+        if (self._watches or self._kept_current) and self._loaded_at is not None:
+            return False
+        if self._loaded_at is None:
+            return True
+        now = time.monotonic()
+        return now - self._loaded_at > self._ttl and now >= self._retry_at
+
+    def refresh_failed(self) -> None:
+        """Keep serving the loaded copy and don't try again for `retry_interval` seconds."""
+        self._retry_at = time.monotonic() + self._retry_interval
+
+    def _ensure_fresh(self) -> None:
+        if self.stale:
+            try:
+                self.refresh()
+            except Exception as e:
+                if not self.loaded:
+                    raise
+                logging.warning(f"Serving the cached taxonomy after a failed reload: {e!r}")
+                self.refresh_failed()
+
+    ######################## Product Postings ########################
+
+    def apply_products(self, upserts: Dict[Text, ProductRecord], removed: Iterable[Text] = ()) -> None:
+        """Catalog listener: keep the brand -> product ids postings current."""
+        with self._lock:
+            for product_id in list(removed) + list(upserts):
+                brand = self._product_brands.pop(product_id, None)
+                if brand is not None:
+                    postings = self._brand_postings[brand]
+                    if brand in self._unsorted_brands:
+                        postings.remove(product_id)
+                    else:
+                        del postings[bisect.bisect_left(postings, product_id)]
+            for product_id, product in upserts.items():
+                # Skip products whose Brand.Name is missing or null, rather than
+                # failing the listeners after this one for the whole delta.
+                brand = product.brand.lower() if isinstance(product.brand, str) else ''
+                if brand:
+                    self._product_brands[product_id] = brand
+                    postings = self._brand_postings.setdefault(brand, [])
+                    if postings and product_id < postings[-1]:
+                        self._unsorted_brands.add(brand)
+                    postings.append(product_id)
+
+    def settle(self) -> None:
+        """Sort the brand postings now rather than on the next query."""
+        with self._lock:
+            for name in self._unsorted_brands:
+                self._brand_postings[name].sort()
+            self._unsorted_brands.clear()
+
+    def products_for_brand(self, brand_name: Text, limit: int = 5,
+                           after: Optional[Text] = None) -> Tuple[List[Text], int]:
+        """First `limit` ids (in id order, above `after` if given) of products whose
+        brand name contains `brand_name`, and how many there are in total."""
+        brand_name = brand_name.lower()
+        with self._lock:
+            pages = []
+            total = 0
+            for name in [name for name in self._brand_postings if brand_name in name]:
+                if name in self._unsorted_brands:
+                    self._brand_postings[name].sort()
+                    self._unsorted_brands.discard(name)
+                postings = self._brand_postings[name]
+                start = 0 if after is None else bisect.bisect_right(postings, after)
+                # A product has one brand, so the lists don't overlap.
+                pages.append(postings[start:start + limit])
+                total += len(postings)
+            return list(itertools.islice(heapq.merge(*pages), limit)), total
+
+    ######################## Queries ########################
+
+    def find_category(self, name: Text) -> Optional[Text]:
+        self._ensure_fresh()
+        return self.category_names.find(name)
+
+    def find_brand(self, name: Text) -> Optional[Text]:
+        self._ensure_fresh()
+        return self.brand_names.find(name)
+
+    def featured_categories(self) -> List[Tuple[Text, List[Text]]]:
+        """Featured top-level categories with the names of their subcategories."""
+        self._ensure_fresh()
+        with self._lock:
+            featured = []
+            for category_id, data in self._categories.items():
+                if data.get('IsFeatured') and not data.get('ParentId'):
+                    subcategories = [
+                        self._categories[child].get('Name', 'Unnamed Subcategory')
+                        for child in self.children.get(category_id, [])
+                    ]
+                    featured.append((data.get('Name', 'Unnamed Category'), subcategories))
+            return featured
@@ -0,0 +1,134 @@
+"""Catalog updater: the one process that listens to Firestore in multi-worker mode.
+
+    python -m actions.updater --snapshot /tmp/dekozy/catalog.snap
+
+It keeps the product catalog and taxonomy current from change events and
+publishes them as a snapshot file (atomically, via `os.replace`) at most
+once per `--interval` seconds. Action-server workers map that file with
+`ProductCatalog.follow_snapshot` instead of each running their own listener.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Text
+
+from actions.catalog import ProductCatalog
+from actions.connection import initialize_firebase
+from actions.snapshot import export_snapshot
+from actions.taxonomy import Taxonomy
+
+######################## Snapshot Publisher ########################
+
+CATALOG_PUBLISH_INTERVAL = float(os.environ.get('CATALOG_PUBLISH_INTERVAL', '2'))
+CATALOG_PUBLISH_MAX_BACKOFF = float(os.environ.get('CATALOG_PUBLISH_MAX_BACKOFF', '60'))
+FIREBASE_CONNECT_RETRY = float(os.environ.get('FIREBASE_CONNECT_RETRY', '5'))
+
+
+class SnapshotPublisher:
+    """Writes a new snapshot whenever the catalog or taxonomy has changed.
+
+    Every snapshot after the first lists the products changed since the
+    previous one, so workers apply only those. A failed publish is retried
+    after a delay that doubles with each failure in a row, up to
+    `max_backoff` seconds; workers keep serving the last snapshot meanwhile.
+    """
+
+    def __init__(self, path: str, catalog: ProductCatalog, taxonomy: Taxonomy,
+                 interval: float = CATALOG_PUBLISH_INTERVAL, max_backoff: float = CATALOG_PUBLISH_MAX_BACKOFF):
+        self.path = path
+        self.catalog = catalog
+        self.taxonomy = taxonomy
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.version: Optional[int] = None
+        self._dirty = threading.Event()
+        self._lock = threading.Lock()
+        self._upserted: Set[Text] = set()
+        self._removed: Set[Text] = set()
+        catalog.add_listener(self._record)
+        taxonomy.add_listener(self._dirty.set)
+
+    def _record(self, upserts: Dict[Text, Any], removed: List[Text]) -> None:
+        with self._lock:
+            self._upserted.difference_update(removed)
+            self._removed.update(removed)
+            self._removed.difference_update(upserts)
+            self._upserted.update(upserts)
+        self._dirty.set()
+
+    def publish(self) -> int:
+        started = time.perf_counter()
+        self._dirty.clear()
+        # Taken before the products are read, so a change arriving meanwhile is listed again next time.
+        with self._lock:
+            upserted, removed = self._upserted, self._removed
+            self._upserted, self._removed = set(), set()
+        # Changes made before this publisher existed weren't recorded, so the first snapshot has none.
+        changes = None if self.version is None else (self.version, sorted(upserted), sorted(removed))
+        categories, brands = self.taxonomy.documents()
+        try:
+            self.version = export_snapshot(self.path, self.catalog.products(), categories, brands,
+                                           changes=changes)
+        except Exception:
+            # The changes just taken are lost, so the next snapshot can't list them.
+            self.version = None
+            raise
+        logging.info(f"Published catalog snapshot {self.version} ({len(self.catalog)} products) "
+                     f"in {time.perf_counter() - started:.2f}s")
+        return self.version
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """Publish now, then after every batch of changes, until `stop` is set."""
+        stop = stop or threading.Event()
+        pending = True
+        while not stop.is_set():
+            if pending:
+                try:
+                    self.publish()
+                except Exception as e:
+                    self.failures += 1
+                    delay = min(max(self.interval, 1.0) * 2 ** (self.failures - 1), self.max_backoff)
+                    logging.error(f"Error publishing catalog snapshot (attempt {self.failures}), "
+                                  f"retrying in {delay:g}s: {e!r}")
+                    stop.wait(delay)
+                    continue
+                self.failures = 0
+                pending = False
+            if self._dirty.wait(self.interval) and not stop.is_set():
+                # Let a burst of changes settle into one snapshot.
+                stop.wait(self.interval)
+                pending = True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--snapshot', default=os.environ.get('CATALOG_SNAPSHOT'),
+                        help="snapshot path (default: $CATALOG_SNAPSHOT)")
+    parser.add_argument('--interval', type=float, default=CATALOG_PUBLISH_INTERVAL)
+    args = parser.parse_args()
+    if not args.snapshot:
+        parser.error("--snapshot or CATALOG_SNAPSHOT is required")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s updater %(levelname)s %(message)s')
+    os.makedirs(os.path.dirname(os.path.abspath(args.snapshot)), exist_ok=True)
+
+    db = initialize_firebase()
+    while db is None:
+        time.sleep(FIREBASE_CONNECT_RETRY)
+        db = initialize_firebase()
+
+    catalog = ProductCatalog()
+    taxonomy = Taxonomy()
+    # Restart from the last published snapshot so only the changes since are applied.
+    if os.path.exists(args.snapshot) and catalog.load_snapshot(args.snapshot):
+        taxonomy.load(*catalog.snapshot_taxonomy())
+    taxonomy.start(db)
+    if not catalog.start(db.collection('Products')):
+        logging.warning("Initial product snapshot is late; publishing what is loaded so far")
+    SnapshotPublisher(args.snapshot, catalog, taxonomy, args.interval).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Text
+
+import msgpack
+
+logger = logging.getLogger(__name__)
+
+######################## Packing ########################
+
+FORMAT_VERSION = 1
+
+
+def _default(value: Any) -> Any:
+    # numpy scalars (e.g. confidences) that made it into parse data.
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Can't pack {type(value).__name__}")
+
+
+def pack(events: List[Dict[Text, Any]], slots: Dict[Text, Any]) -> bytes:
+    return msgpack.packb({'v': FORMAT_VERSION, 'events': events, 'slots': slots}, use_bin_type=True, default=_default)
+
+
+def unpack(data: bytes) -> Dict[Text, Any]:
+    conversation = msgpack.unpackb(data, raw=False)
+    if conversation.get('v') != FORMAT_VERSION:
+        raise ValueError(f"Unknown conversation format {conversation.get('v')}")
+    return conversation
+
+
+def trim_events(events: List[Dict[Text, Any]], limit: int) -> List[Dict[Text, Any]]:
+    """The last `limit` events, starting at a turn boundary (an `action_listen`) where there is one."""
+    if len(events) <= limit:
+        return events
+    start = len(events) - limit
+    for i in range(start, len(events)):
+        if events[i].get('event') == 'action' and events[i].get('name') == 'action_listen':
+            return events[i:]
+    return events[start:]
+
+######################## Store ########################
+
+
+class Conversation(NamedTuple):
+    updated_at: float
+    events: int
+    data: bytes
+
+
+class ConversationStore:
+    """sender_id -> packed conversation in an SQLite file, with the recently used ones in an LRU.
+
+    A background thread runs every `sweep_interval` seconds to delete
+    conversations not saved for `idle_timeout` seconds and checkpoint the
+    write-ahead log, so neither happens inside a `put`.
+    """
+
+    # A passive checkpoint never blocks writers, but under steady writes it
+    # may never catch up and let the log start over. Past this many frames
+    # (~64 MB) the sweeper waits for the writers instead.
+    WAL_RESTART_FRAMES = 16384
+
+    def __init__(self, path: Text, cache_size: int = 1000, idle_timeout: float = 86400.0,
+                 sweep_interval: float = 1.0):
+        self._path = path
+        self._cache_size = cache_size
+        self._idle_timeout = idle_timeout
+        self._cache: "OrderedDict[Text, Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = self._connect()
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS conversations ('
+                         'sender_id TEXT PRIMARY KEY, updated_at REAL NOT NULL, events INTEGER NOT NULL, '
+                         'data BLOB NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)')
+        self._db.execute('PRAGMA wal_autocheckpoint=0')
+        self._db.execute(f"PRAGMA journal_size_limit={self.WAL_RESTART_FRAMES * 4096}")
+        self._closed = threading.Event()
+        self._sweeper = threading.Thread(target=self._sweep_every, args=(sweep_interval,),
+                                         name='conversation-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def get(self, sender_id: Text) -> Optional[Conversation]:
+        with self._lock:
+            conversation = self._cache.get(sender_id)
+            if conversation is not None:
+                self._cache.move_to_end(sender_id)
+            else:
+                row = self._db.execute('SELECT updated_at, events, data FROM conversations WHERE sender_id = ?',
+                                       (sender_id,)).fetchone()
+                if row is None:
+                    return None
+                conversation = Conversation(*row)
+                self._remember(sender_id, conversation)
+        if time.time() - conversation.updated_at > self._idle_timeout:
+            return None
+        return conversation
+
+    def put(self, sender_id: Text, events: int, data: bytes) -> None:
+        conversation = Conversation(time.time(), events, data)
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?)',
+                             (sender_id, conversation.updated_at, events, data))
+            self._remember(sender_id, conversation)
+
+    def keys(self) -> List[Text]:
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT sender_id FROM conversations')]
+
+    def close(self) -> None:
+        self._closed.set()
+        self._sweeper.join()
+        with self._lock:
+            self._db.close()
+
+    def _remember(self, sender_id: Text, conversation: Conversation) -> None:
+        self._cache[sender_id] = conversation
+        self._cache.move_to_end(sender_id)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def _sweep_every(self, interval: float) -> None:
+        db = self._connect()
+        try:
+            while not self._closed.wait(interval):
+                try:
+                    self.sweep(db)
+                except sqlite3.Error as e:
+                    logger.warning(f"Conversation store sweep failed: {e}")
+        finally:
+            db.close()
+
+    def sweep(self, db: Optional[sqlite3.Connection] = None) -> int:
+        """Delete idle conversations and checkpoint the log; returns how many were deleted."""
+        cutoff = time.time() - self._idle_timeout
+        with self._lock:
+            for sender_id in [key for key, value in self._cache.items() if value.updated_at < cutoff]:
+                del self._cache[sender_id]
+        if db is None:
+            with self._lock:
+                return self._sweep(self._db, cutoff)
+        return self._sweep(db, cutoff)
+
+    def _sweep(self, db: sqlite3.Connection, cutoff: float) -> int:
+        deleted = db.execute('DELETE FROM conversations WHERE updated_at < ?', (cutoff,)).rowcount
+        (_, frames, _), = db.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+        if frames > self.WAL_RESTART_FRAMES:
+            db.execute('PRAGMA wal_checkpoint(RESTART)').fetchall()
+        return deleted
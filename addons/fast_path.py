@@ -0,0 +1,295 @@
+"""Skip featurization and DIET for messages whose parse is already known.
+
+Most traffic is short, near-identical messages ("show categories", "track my
+order"). `FastPathLookup` runs right after the tokenizer and normalizes the
+message (lower-case, digits to 0, see `addons.parse_cache`). If the result is
+one of the exact training examples from data/nlu.yml, or a message recently
+parsed with high confidence, it sets the intent and entities and marks the
+message; the `FastPath*` featurizers and classifiers then leave it alone.
+`FastPathRecorder`, last in the pipeline, adds confident parses to the LRU.
+
+Entities are kept as token positions, so "order number 12345" and
+"order number 67890" share a key and each gets its own order_id. Numbers and
+prices never come from the cache itself.
+
+These components are opt-in (config_fastpath.yml); config.yml keeps the stock
+ones until `benchmarks.bench_nlu` has shown both give the same parses.
+"""
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Text
+
+from rasa.engine.graph import ExecutionContext, GraphComponent
+from rasa.engine.recipes.default_recipe import DefaultV1Recipe
+from rasa.engine.storage.resource import Resource
+from rasa.engine.storage.storage import ModelStorage
+from rasa.nlu.classifiers.diet_classifier import DIETClassifier
+from rasa.nlu.constants import RESPONSE_SELECTOR_PROPERTY_NAME, TOKENS_NAMES
+from rasa.nlu.featurizers.sparse_featurizer.count_vectors_featurizer import CountVectorsFeaturizer
+from rasa.nlu.featurizers.sparse_featurizer.lexical_syntactic_featurizer import LexicalSyntacticFeaturizer
+from rasa.nlu.featurizers.sparse_featurizer.regex_featurizer import RegexFeaturizer
+from rasa.nlu.selectors.response_selector import ResponseSelector
+from rasa.nlu.tokenizers.tokenizer import Tokenizer
+from rasa.shared.constants import DEFAULT_NLU_FALLBACK_INTENT_NAME
+from rasa.shared.nlu.constants import (
+    ENTITIES,
+    INTENT,
+    INTENT_NAME_KEY,
+    INTENT_RANKING_KEY,
+    INTENT_RESPONSE_KEY,
+    PREDICTED_CONFIDENCE_KEY,
+    TEXT,
+)
+from rasa.shared.nlu.training_data.message import Message
+from rasa.shared.nlu.training_data.training_data import TrainingData
+
+from addons.hashing_featurizer import HashingFeaturizer
+from addons.parse_cache import ParseCache, Span, apply_templates, entity_templates, message_key
+
+logger = logging.getLogger(__name__)
+
+# Set on messages answered by `FastPathLookup` (not part of the parse output).
+FAST_PATH_HIT = 'fast_path'
+# The normalized key of a message, for `FastPathRecorder`.
+FAST_PATH_KEY = 'fast_path_key'
+
+TABLE_FILE = 'fast_path.json'
+
+######################## Shared Cache ########################
+
+# One LRU per loaded model, shared by its lookup and recorder nodes.
+_caches: Dict[Text, ParseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def shared_cache(model_id: Optional[Text], max_entries: Optional[int] = None) -> ParseCache:
+    with _caches_lock:
+        cache = _caches.get(model_id or '')
+        if cache is None:
+            cache = _caches[model_id or ''] = ParseCache()
+        if max_entries is not None:
+            cache.max_entries = max_entries
+        return cache
+
+
+def _spans(message: Message) -> List[Span]:
+    return [(token.text, token.start, token.end) for token in message.get(TOKENS_NAMES[TEXT]) or []]
+
+
+def _hit(message: Message) -> bool:
+    return bool(message.get(FAST_PATH_HIT))
+
+
+def _misses(messages: List[Message]) -> List[Message]:
+    return [message for message in messages if not _hit(message)]
+
+######################## Lookup ########################
+
+
+@DefaultV1Recipe.register(
+    [DefaultV1Recipe.ComponentType.INTENT_CLASSIFIER, DefaultV1Recipe.ComponentType.ENTITY_EXTRACTOR],
+    is_trainable=True,
+)
+class FastPathLookup(GraphComponent):
+    """Answers known messages from the training examples and the shared LRU."""
+
+    @classmethod
+    def required_components(cls) -> List[type]:
+        return [Tokenizer]
+
+    @staticmethod
+    def get_default_config() -> Dict[Text, Any]:
+        return {'use_training_examples': True}
+
+    def __init__(self, config: Dict[Text, Any], model_storage: ModelStorage, resource: Resource,
+                 execution_context: ExecutionContext, table: Optional[Dict[Text, Dict[Text, Any]]] = None):
+        self._config = config
+        self._model_storage = model_storage
+        self._resource = resource
+        self._table = table or {}
+        self._cache = shared_cache(execution_context.model_id)
+
+    @classmethod
+    def create(cls, config: Dict[Text, Any], model_storage: ModelStorage, resource: Resource,
+               execution_context: ExecutionContext) -> "FastPathLookup":
+        return cls(config, model_storage, resource, execution_context)
+
+    @classmethod
+    def load(cls, config: Dict[Text, Any], model_storage: ModelStorage, resource: Resource,
+             execution_context: ExecutionContext, **kwargs: Any) -> "FastPathLookup":
+        try:
+            with model_storage.read_from(resource) as directory:
+                table = json.loads((directory / TABLE_FILE).read_text(encoding='utf-8'))
+        except (ValueError, OSError):
+            logger.debug(f"No fast path table for '{resource.name}', using the recent parse cache only")
+            table = {}
+        return cls(config, model_storage, resource, execution_context, table)
+
+    def train(self, training_data: TrainingData) -> Resource:
+        """Index the exact training examples by normalized text.
+
+        A key whose examples disagree on the intent or the entity positions is
+        left out, and so are retrieval intents (ResponseSelector still has to
+        pick the response).
+        """
+        table: Dict[Text, Optional[Dict[Text, Any]]] = {}
+        if self._config['use_training_examples']:
+            for example in training_data.intent_examples:
+                spans = _spans(example)
+                if not spans or example.get(INTENT_RESPONSE_KEY):
+                    continue
+                key = message_key(spans)
+                templates = entity_templates(spans, example.get(ENTITIES) or [])
+                entry = {'intent': example.get(INTENT), 'entities': templates}
+                if templates is None or table.get(key, entry) != entry:
+                    table[key] = None
+                else:
+                    table[key] = entry
+        table = {key: entry for key, entry in table.items() if entry is not None}
+        with self._model_storage.write_to(self._resource) as directory:
+            (directory / TABLE_FILE).write_text(json.dumps(table), encoding='utf-8')
+        self._table = table
+        return self._resource
+
+    def process_training_data(self, training_data: TrainingData) -> TrainingData:
+        return training_data
+
+    def process(self, messages: List[Message]) -> List[Message]:
+        for message in messages:
+            spans = _spans(message)
+            if not spans:
+                continue
+            key = message_key(spans)
+            message.set(FAST_PATH_KEY, key)
+            entry = self._table.get(key)
+            if entry is not None:
+                intent = {INTENT_NAME_KEY: entry['intent'], PREDICTED_CONFIDENCE_KEY: 1.0}
+                entry = {'intent': intent, 'intent_ranking': [intent], 'entities': entry['entities']}
+            else:
+                entry = self._cache.get(key)
+            if entry is None:
+                continue
+            entities = apply_templates(message.get(TEXT), spans, entry['entities'])
+            for entity in entities:
+                entity.setdefault('extractor', self.__class__.__name__)
+            message.set(INTENT, dict(entry['intent']), add_to_output=True)
+            message.set(INTENT_RANKING_KEY, [dict(row) for row in entry['intent_ranking']], add_to_output=True)
+            message.set(ENTITIES, message.get(ENTITIES, []) + entities, add_to_output=True)
+            if entry.get('response_selector'):
+                message.set(RESPONSE_SELECTOR_PROPERTY_NAME, entry['response_selector'], add_to_output=True)
+            message.set(FAST_PATH_HIT, True)
+        return messages
+
+######################## Recorder ########################
+
+
+@DefaultV1Recipe.register([DefaultV1Recipe.ComponentType.INTENT_CLASSIFIER], is_trainable=False)
+class FastPathRecorder(GraphComponent):
+    """Adds confident parses of messages the lookup missed to the shared LRU.
+
+    Goes after FallbackClassifier, so `nlu_fallback` results are never cached.
+    """
+
+    @classmethod
+    def required_components(cls) -> List[type]:
+        return [FastPathLookup]
+
+    @staticmethod
+    def get_default_config() -> Dict[Text, Any]:
+        return {'cache_size': 10000, 'min_confidence': 0.9}
+
+    def __init__(self, config: Dict[Text, Any], execution_context: ExecutionContext):
+        self._min_confidence = config['min_confidence']
+        self._cache = shared_cache(execution_context.model_id, config['cache_size'])
+
+    @classmethod
+    def create(cls, config: Dict[Text, Any], model_storage: ModelStorage, resource: Resource,
+               execution_context: ExecutionContext) -> "FastPathRecorder":
+        return cls(config, execution_context)
+
+    def process_training_data(self, training_data: TrainingData) -> TrainingData:
+        return training_data
+
+    def process(self, messages: List[Message]) -> List[Message]:
+        for message in messages:
+            key = message.get(FAST_PATH_KEY)
+            if key is None or _hit(message):
+                continue
+            entry = self._entry(message)
+            if entry is not None:
+                self._cache.put(key, entry)
+        return messages
+
+    def _entry(self, message: Message) -> Optional[Dict[Text, Any]]:
+        intent = message.get(INTENT) or {}
+        if (intent.get(INTENT_NAME_KEY) in (None, DEFAULT_NLU_FALLBACK_INTENT_NAME)
+                or (intent.get(PREDICTED_CONFIDENCE_KEY) or 0.0) < self._min_confidence):
+            return None
+        entities = message.get(ENTITIES) or []
+        if any(entity.get('confidence_entity', 1.0) < self._min_confidence for entity in entities):
+            return None
+        # Values are re-read from the next message, and EntitySynonymMapper runs again on them.
+        raw = [{key: value for key, value in entity.items() if key != 'value'} for entity in entities]
+        templates = entity_templates(_spans(message), raw)
+        if templates is None:
+            return None
+        return {
+            'intent': dict(intent),
+            'intent_ranking': [dict(row) for row in message.get(INTENT_RANKING_KEY) or [intent]],
+            'entities': templates,
+            'response_selector': message.get(RESPONSE_SELECTOR_PROPERTY_NAME),
+        }
+
+######################## Skipping Components ########################
+
+# The stock components with the same settings, minus the messages the lookup answered.
+
+
+@DefaultV1Recipe.register([DefaultV1Recipe.ComponentType.MESSAGE_FEATURIZER], is_trainable=True)
+class FastPathRegexFeaturizer(RegexFeaturizer):
+    def process(self, messages: List[Message]) -> List[Message]:
+        super().process(_misses(messages))
+        return messages
+
+
+@DefaultV1Recipe.register([DefaultV1Recipe.ComponentType.MESSAGE_FEATURIZER], is_trainable=True)
+class FastPathLexicalSyntacticFeaturizer(LexicalSyntacticFeaturizer):
+    def process(self, messages: List[Message]) -> List[Message]:
+        super().process(_misses(messages))
+        return messages
+
+
+@DefaultV1Recipe.register([DefaultV1Recipe.ComponentType.MESSAGE_FEATURIZER], is_trainable=True)
+class FastPathCountVectorsFeaturizer(CountVectorsFeaturizer):
+    def process(self, messages: List[Message]) -> List[Message]:
+        super().process(_misses(messages))
+        return messages
+
+
+@DefaultV1Recipe.register([DefaultV1Recipe.ComponentType.MESSAGE_FEATURIZER], is_trainable=False)
+class FastPathHashingFeaturizer(HashingFeaturizer):
+    def process(self, messages: List[Message]) -> List[Message]:
+        super().process(_misses(messages))
+        return messages
+
+
+@DefaultV1Recipe.register(
+    [DefaultV1Recipe.ComponentType.INTENT_CLASSIFIER, DefaultV1Recipe.ComponentType.ENTITY_EXTRACTOR],
+    is_trainable=True,
+)
+class FastPathDIETClassifier(DIETClassifier):
+    def process(self, messages: List[Message]) -> List[Message]:
+        pending = _misses(messages)
+        if pending:
+            super().process(pending)
+        return messages
+
+
+@DefaultV1Recipe.register([DefaultV1Recipe.ComponentType.INTENT_CLASSIFIER], is_trainable=True)
+class FastPathResponseSelector(ResponseSelector):
+    def process(self, messages: List[Message]) -> List[Message]:
+        pending = _misses(messages)
+        if pending:
+            super().process(pending)
+        return messages
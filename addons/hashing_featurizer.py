@@ -0,0 +1,96 @@
+"""Character n-gram features hashed into a fixed number of columns.
+
+A drop-in for CountVectorsFeaturizer(analyzer=char_wb) that stores no
+vocabulary. Every n-gram of the space-padded, lower-cased token is hashed
+(crc32) into one of `n_features` columns. The feature matrices, and DIET's
+input layer on top of them, then stay the same size however many n-grams
+the training data or the users bring. Colliding n-grams share a column.
+
+Like a char_wb CountVectorsFeaturizer it featurizes the message text, bot
+responses and end-to-end action texts. Intents and action names are left to
+the classifiers and policies to one-hot encode, as with that component.
+`benchmarks.bench_featurizer` compares the two feature sets.
+"""
+from typing import Any, Dict, List, Text, Tuple
+
+import numpy as np
+import scipy.sparse
+
+from rasa.engine.graph import ExecutionContext, GraphComponent
+from rasa.engine.recipes.default_recipe import DefaultV1Recipe
+from rasa.engine.storage.resource import Resource
+from rasa.engine.storage.storage import ModelStorage
+from rasa.nlu.constants import DENSE_FEATURIZABLE_ATTRIBUTES, TOKENS_NAMES
+from rasa.nlu.featurizers.sparse_featurizer.sparse_featurizer import SparseFeaturizer
+from rasa.nlu.tokenizers.tokenizer import Tokenizer
+from rasa.shared.exceptions import InvalidConfigException
+from rasa.shared.nlu.training_data.message import Message
+from rasa.shared.nlu.training_data.training_data import TrainingData
+
+from addons.ngram_hashing import hashed_ngrams
+
+
+@DefaultV1Recipe.register([DefaultV1Recipe.ComponentType.MESSAGE_FEATURIZER], is_trainable=False)
+class HashingFeaturizer(SparseFeaturizer, GraphComponent):
+    """Sparse char_wb n-gram counts of text, responses and action texts in `n_features` hashed columns."""
+
+    @classmethod
+    def required_components(cls) -> List[type]:
+        return [Tokenizer]
+
+    @staticmethod
+    def get_default_config() -> Dict[Text, Any]:
+        return {
+            **SparseFeaturizer.get_default_config(),
+            'n_features': 2048,
+            'min_ngram': 1,
+            'max_ngram': 4,
+        }
+
+    def __init__(self, config: Dict[Text, Any], execution_context: ExecutionContext):
+        super().__init__(execution_context.node_name, config)
+        self._n_features = config['n_features']
+        self._ngrams = (config['min_ngram'], config['max_ngram'])
+
+    @classmethod
+    def create(cls, config: Dict[Text, Any], model_storage: ModelStorage, resource: Resource,
+               execution_context: ExecutionContext) -> "HashingFeaturizer":
+        return cls(config, execution_context)
+
+    @classmethod
+    def validate_config(cls, config: Dict[Text, Any]) -> None:
+        if config['n_features'] < 1:
+            raise InvalidConfigException(f"n_features must be positive, got {config['n_features']}")
+        if not 1 <= config['min_ngram'] <= config['max_ngram']:
+            raise InvalidConfigException(
+                f"Need 1 <= min_ngram <= max_ngram, got {config['min_ngram']} and {config['max_ngram']}")
+
+    def process_training_data(self, training_data: TrainingData) -> TrainingData:
+        self.process(training_data.training_examples)
+        return training_data
+
+    def process(self, messages: List[Message]) -> List[Message]:
+        for message in messages:
+            for attribute in DENSE_FEATURIZABLE_ATTRIBUTES:
+                tokens = message.get(TOKENS_NAMES[attribute])
+                if tokens:
+                    sequence, sentence = self._features([token.text for token in tokens])
+                    self.add_features_to_message(sequence, sentence, attribute, message)
+        return messages
+
+    def _features(self, tokens: List[Text]) -> Tuple[scipy.sparse.coo_matrix, scipy.sparse.coo_matrix]:
+        rows, columns = [], []
+        for row, token in enumerate(tokens):
+            token_columns = hashed_ngrams(token, *self._ngrams, self._n_features)
+            rows.extend([row] * len(token_columns))
+            columns.extend(token_columns)
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        values = np.ones(len(columns), dtype=np.float32)
+        # Duplicate (row, column) pairs are summed into counts.
+        sequence = scipy.sparse.coo_matrix((values, (rows, columns)), shape=(len(tokens), self._n_features))
+        sequence.sum_duplicates()
+        sentence = scipy.sparse.coo_matrix(
+            (values, (np.zeros_like(columns), columns)), shape=(1, self._n_features))
+        sentence.sum_duplicates()
+        return sequence, sentence
@@ -0,0 +1,18 @@
+import zlib
+from functools import lru_cache
+from typing import Text, Tuple
+
+######################## Hashed Character N-grams ########################
+
+
+@lru_cache(maxsize=50000)
+def hashed_ngrams(text: Text, min_ngram: int, max_ngram: int, n_features: int) -> Tuple[int, ...]:
+    """Columns of the `min_ngram`..`max_ngram` character n-grams of a token.
+
+    The token is lower-cased and padded with a space on each side, as
+    scikit-learn's char_wb analyzer (behind CountVectorsFeaturizer) does, and
+    each n-gram is hashed (crc32) into one of `n_features` columns.
+    """
+    padded = f" {text.lower()} "
+    return tuple(zlib.crc32(padded[i:i + n].encode('utf-8')) % n_features
+                 for n in range(min_ngram, max_ngram + 1) for i in range(len(padded) - n + 1))
@@ -0,0 +1,89 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Text, Tuple
+
+######################## Normalized Parse Cache ########################
+
+# A token as (text, start, end) character offsets into the message.
+Span = Tuple[Text, int, int]
+
+_DIGITS_RE = re.compile(r"\d+")
+
+# Entity keys that are recomputed from the message the template is applied to.
+_POSITIONAL = ('start', 'end', 'value', 'processors')
+
+
+def normalize_token(text: Text) -> Text:
+    """Lower-case, with every run of digits replaced by 0.
+
+    Order ids, user ids and prices then share one key ("order number 0"),
+    and their entities are re-read from the new message by `apply_templates`.
+    """
+    return _DIGITS_RE.sub('0', text.lower())
+
+
+def message_key(tokens: Sequence[Span]) -> Text:
+    return ' '.join(normalize_token(text) for text, _, _ in tokens)
+
+
+def entity_templates(tokens: Sequence[Span], entities: Sequence[Dict[Text, Any]]) -> Optional[List[Dict[Text, Any]]]:
+    """Entities as token positions instead of characters, or None if one doesn't line up with the tokens."""
+    templates = []
+    for entity in entities:
+        covered = [i for i, (_, start, end) in enumerate(tokens) if start < entity['end'] and end > entity['start']]
+        if not covered:
+            return None
+        first, last = covered[0], covered[-1]
+        template = {key: value for key, value in entity.items() if key not in _POSITIONAL}
+        # Offsets inside the edge tokens, e.g. "$10" annotated as "10" starts one character in.
+        template.update(first=first, last=last,
+                        start_delta=entity['start'] - tokens[first][1], end_delta=entity['end'] - tokens[last][2])
+        templates.append(template)
+    return templates
+
+
+def apply_templates(text: Text, tokens: Sequence[Span], templates: Sequence[Dict[Text, Any]]) -> List[Dict[Text, Any]]:
+    """The entities of `templates` with their values taken from `text`."""
+    entities = []
+    for template in templates:
+        first, last = tokens[template['first']], tokens[template['last']]
+        start, end = first[1] + template['start_delta'], last[2] + template['end_delta']
+        if not first[1] <= start < end <= last[2]:
+            start, end = first[1], last[2]
+        entity = {key: value for key, value in template.items()
+                  if key not in ('first', 'last', 'start_delta', 'end_delta')}
+        entity.update(start=start, end=end, value=text[start:end])
+        entities.append(entity)
+    return entities
+
+
+class ParseCache:
+    """Bounded LRU of normalized message key -> parse result."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Text, Dict[Text, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Text) -> Optional[Dict[Text, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Text, entry: Dict[Text, Any]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,78 @@
+"""Tracker store that keeps a bounded, msgpack-packed history per conversation in SQLite.
+
+    tracker_store:
+      type: addons.tracker_store.CompactTrackerStore
+      path: trackers.db
+
+Each save keeps the last `max_event_history` events, cut at a turn boundary,
+plus the current slot values, so slots set before the window survive. The
+most recently used `cache_size` conversations are also held (still packed)
+in memory. Conversations idle for `idle_timeout` seconds are deleted.
+`retrieve_full_tracker` can only return what was kept.
+
+SQLite calls block, so they run on the store's own thread rather than the
+event loop.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional, Text
+
+from rasa.core.brokers.broker import EventBroker
+from rasa.core.tracker_store import TrackerStore
+from rasa.shared.core.domain import Domain
+from rasa.shared.core.trackers import DialogueStateTracker
+
+from addons.conversation_store import ConversationStore, pack, trim_events, unpack
+
+logger = logging.getLogger(__name__)
+
+
+class CompactTrackerStore(TrackerStore):
+    def __init__(self, domain: Optional[Domain] = None, host: Optional[Text] = None,
+                 event_broker: Optional[EventBroker] = None, path: Text = 'trackers.db',
+                 max_event_history: int = 100, cache_size: int = 1000, idle_timeout: float = 86400.0,
+                 sweep_interval: float = 60.0, **kwargs: Any):
+        super().__init__(domain, event_broker, **kwargs)
+        self._max_events = max_event_history
+        self._conversations = ConversationStore(path, cache_size, idle_timeout, sweep_interval)
+        # One thread: the store serializes its SQLite calls anyway.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tracker-store')
+        logger.debug(f"Keeping the last {max_event_history} events per conversation in {path}")
+
+    async def _run(self, fn: Callable, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def save(self, tracker: DialogueStateTracker) -> None:
+        await self.stream_events(tracker)
+        events = trim_events([event.as_dict() for event in tracker.events], self._max_events)
+        await self._run(self._conversations.put, tracker.sender_id, len(events),
+                        pack(events, tracker.current_slot_values()))
+
+    async def retrieve(self, sender_id: Text) -> Optional[DialogueStateTracker]:
+        stored = await self._run(self._conversations.get, sender_id)
+        if stored is None:
+            return None
+        try:
+            conversation = unpack(stored.data)
+        except ValueError as e:
+            logger.warning(f"Dropping unreadable conversation '{sender_id}': {e}")
+            return None
+        tracker = DialogueStateTracker.from_dict(sender_id, conversation['events'], self.domain.slots)
+        # Slots whose SlotSet events fell out of the window.
+        for name, value in conversation['slots'].items():
+            slot = tracker.slots.get(name)
+            if slot is not None and slot.value != value:
+                slot.value = value
+        return tracker
+
+    async def exists(self, conversation_id: Text) -> bool:
+        return await self._run(self._conversations.get, conversation_id) is not None
+
+    async def number_of_existing_events(self, sender_id: Text) -> int:
+        # What `retrieve` would return, without unpacking it (used to stream only new events).
+        stored = await self._run(self._conversations.get, sender_id)
+        return stored.events if stored is not None else 0
+
+    async def keys(self) -> Iterable[Text]:
+        return await self._run(self._conversations.keys)
@@ -0,0 +1,67 @@
+"""Action latency under concurrent conversations: blocking vs. non-blocking Firestore reads.
+
+Each conversation sends `--turns` order-tracking messages. "blocking" calls the
+fake client's `.get()` directly inside the coroutine, which is what the old
+synchronous `run` methods did to the action server's event loop. "offloaded"
+goes through `data_access.fetch`, which the async actions now use.
+
+    python -m benchmarks.bench_concurrency --latency 0.02
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from actions import data_access
+from actions.fake_firestore import FakeFirestore
+
+
+async def blocking_turn(db, order_id):
+    return db.collection('Orders').document(order_id).get()
+
+
+async def offloaded_turn(db, order_id):
+    return await data_access.fetch(db.collection('Orders').document(order_id))
+
+
+async def conversation(turn, db, index, turns, latencies):
+    for i in range(turns):
+        start = time.perf_counter()
+        # The message arrives now but waits for the event loop, as in the action server.
+        await asyncio.sleep(0)
+        await turn(db, f"order-{(index + i) % 100}")
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def run(turn, db, conversations, turns):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(conversation(turn, db, c, turns, latencies) for c in range(conversations)))
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def percentile(samples, q):
+    return statistics.quantiles(samples, n=100)[q - 1] if len(samples) > 1 else samples[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 50, 500])
+    parser.add_argument('--turns', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.02, help="fake Firestore round trip in seconds")
+    args = parser.parse_args()
+
+    orders = {f"order-{i}": {'status': 'OrderStatus.shipped', 'items': [], 'totalAmount': 100} for i in range(100)}
+    db = FakeFirestore({'Orders': orders}, latency=args.latency)
+
+    print(f"{'mode':>10} {'conversations':>14} {'p50 ms':>9} {'p99 ms':>9} {'turns/s':>9}")
+    for conversations in args.concurrency:
+        for mode, turn in (('blocking', blocking_turn), ('offloaded', offloaded_turn)):
+            latencies, elapsed = asyncio.run(run(turn, db, conversations, args.turns))
+            print(f"{mode:>10} {conversations:>14} {percentile(latencies, 50):>9.1f} "
+                  f"{percentile(latencies, 99):>9.1f} {len(latencies) / elapsed:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Action latency while the fake Firestore slows down and fails, with and without the guards.
+
+    python -m benchmarks.bench_faults --products 2000
+    python -m benchmarks.bench_faults --products 2000 --unguarded
+
+Runs the actions that read Firestore per turn from `--conversations`
+concurrent conversations through four phases against one `FakeFirestore`:
+healthy; degraded (`--slow-rate` of round trips take `--delay` extra seconds
+and `--error-rate` fail); an outage (every round trip stalls for
+`--outage-delay` seconds); and recovered. Caches are given 1s TTLs so lookups
+keep reaching Firestore. Each phase reports latency percentiles, how many
+replies were the canned "out of service" message, and the data_access
+counters (calls, failures, retries, breaker rejections, missed deadlines).
+
+With the guards p99 stays near ACTION_DEADLINE in every phase, and once the
+breaker opens turns are answered from stale cache entries or fail in
+milliseconds. `--unguarded` turns off the deadline, retries and breaker
+(ACTION_DEADLINE=0, FIRESTORE_RETRIES=0, FIRESTORE_BREAKER_FAILURES=0), so
+only the FIRESTORE_TIMEOUT per call remains.
+
+Finally the taxonomy is switched to TTL refreshes, left to expire and read
+while every round trip fails: the cached copy must still be served, without
+another round trip from the event loop.
+
+The run exits with status 1 if any phase's p99 exceeds ACTION_DEADLINE plus
+`--slack-ms`, if the outage isn't failed fast (breaker rejections and a p50
+under `--fail-fast-ms`), or if the stale taxonomy isn't served. An
+`--unguarded` run is expected to fail these.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Text
+
+ACTIONS = ['action_track_order', 'action_get_user_profile', 'action_list_user_orders', 'action_show_brands',
+           'action_search_product_by_price_range']
+
+
+def configure(unguarded: bool) -> None:
+    # Read when actions.data_access and actions.actions are imported.
+    os.environ.setdefault('FIREBASE_CONNECT', 'lazy')
+    os.environ.setdefault('ACTION_METRICS_PORT', '0')
+    os.environ.setdefault('FIRESTORE_BREAKER_COOLDOWN', '1')
+    for name in ('ORDER_CACHE_TTL', 'USER_CACHE_TTL', 'ORDER_LIST_CACHE_TTL', 'BRANDS_RESPONSE_TTL', 'TAXONOMY_TTL'):
+        os.environ.setdefault(name, '1')
+    if unguarded:
+        os.environ.update(ACTION_DEADLINE='0', FIRESTORE_RETRIES='0', FIRESTORE_BREAKER_FAILURES='0')
+
+
+async def conversation(run, actions, scenarios, store, rng, index, turns, latencies, canned) -> None:
+    for i in range(turns):
+        action = rng.choice(actions)
+        slots = scenarios.get(action.name(), lambda rng, store: {})(rng, store)
+        started = time.perf_counter()
+        dispatcher = await run(action, slots, f"faults-{index}")
+        latencies.append((time.perf_counter() - started) * 1000)
+        if any((message.get('text') or '').startswith('🤖') for message in dispatcher.messages):
+            canned.append(action.name())
+
+
+async def phase(name: Text, args, bench, data_access, actions, store, rng) -> Dict[Text, Any]:
+    before = dict(data_access.stats)
+    latencies: List[float] = []
+    canned: List[Text] = []
+    turns = max(1, args.turns // args.conversations)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        conversation(bench.run_turn, actions, bench.SCENARIOS, store, random.Random(rng.random()), c, turns,
+                     latencies, canned)
+        for c in range(args.conversations)))
+    counters = {key: value - before.get(key, 0) for key, value in data_access.stats.items()}
+    return {
+        'phase': name, 'seconds': time.perf_counter() - started, 'turns': len(latencies),
+        'p50': bench.percentile(latencies, 50), 'p99': bench.percentile(latencies, 99), 'max': max(latencies),
+        'canned': len(canned), 'breaker': data_access.breaker.state, **counters,
+    }
+
+
+async def check_stale_taxonomy(actions_module, db) -> List[Text]:
+    """Read the expired taxonomy while Firestore fails; returns what went wrong."""
+    taxonomy = actions_module.taxonomy
+    # TTL refreshes, as when the listener can't subscribe.
+    taxonomy.stop()
+    await asyncio.sleep(float(os.environ['TAXONOMY_TTL']) + 0.1)
+    if not taxonomy.stale:
+        return ["stale taxonomy: never expired"]
+    categories, _ = taxonomy.documents()
+    name = next(iter(categories.values()), {}).get('Name', '')
+    db.faults.set(error_rate=1.0)
+    try:
+        served = await actions_module.get_taxonomy()
+        round_trips = db.reads.round_trips
+        featured = served.featured_categories()
+        found = served.find_category(name)
+    except Exception as e:
+        return [f"stale taxonomy: not served ({e!r})"]
+    finally:
+        db.faults.set()
+    failures = []
+    if not featured or found is None:
+        failures.append("stale taxonomy: served empty")
+    if db.reads.round_trips != round_trips:
+        failures.append("stale taxonomy: queries reloaded it on the event loop")
+    return failures
+
+
+def check(rows: List[Dict[Text, Any]], deadline: float, args) -> List[Text]:
+    failures = []
+    for row in rows:
+        if row['p99'] > deadline * 1000 + args.slack_ms:
+            failures.append(f"{row['phase']}: p99 {row['p99']:.0f} ms over the {deadline}s deadline")
+    outage = next(row for row in rows if row['phase'] == 'outage')
+    if not outage.get('rejected'):
+        failures.append("outage: the circuit breaker never opened")
+    if outage['p50'] > args.fail_fast_ms:
+        failures.append(f"outage: p50 {outage['p50']:.0f} ms, not failing fast")
+    return failures
+
+
+async def main_async(args) -> int:
+    from actions import actions as actions_module, data_access
+    from actions.fake_firestore import FakeFirestore
+    from benchmarks import run as bench, synthetic
+
+    store = synthetic.store(args.products, args.seed)
+    db = FakeFirestore(store, latency=args.latency, seed=args.seed)
+    actions_module.connection.use(lambda: db)
+    actions_module.connection.start()
+    while not actions_module.connection.ready:
+        await asyncio.sleep(0.01)
+
+    actions = [action for action in bench.action_classes() if action.name() in ACTIONS]
+    rng = random.Random(args.seed)
+    phases = [
+        ('healthy', dict()),
+        ('degraded', dict(delay=args.delay, slow_rate=args.slow_rate, error_rate=args.error_rate)),
+        ('outage', dict(delay=args.outage_delay, slow_rate=1.0)),
+        ('recovered', dict()),
+    ]
+    print(f"{'guards off' if args.unguarded else 'guards on'}: deadline {data_access.ACTION_DEADLINE}s, "
+          f"{data_access.FIRESTORE_RETRIES} retries, breaker after {data_access.FIRESTORE_BREAKER_FAILURES} "
+          f"failures, {data_access.FIRESTORE_TIMEOUT}s per call")
+    print(f"{'phase':<10} {'turns':>6} {'secs':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'canned':>7} "
+          f"{'calls':>6} {'fails':>6} {'retry':>6} {'reject':>7} {'deadl':>6} {'breaker':>10}")
+    rows = []
+    for name, faults in phases:
+        db.faults.set(**faults)
+        row = await phase(name, args, bench, data_access, actions, store, rng)
+        rows.append(row)
+        print(f"{row['phase']:<10} {row['turns']:>6} {row['seconds']:>6.1f} {row['p50']:>8.1f} {row['p99']:>8.1f} "
+              f"{row['max']:>8.1f} {row['canned']:>7} {row.get('calls', 0):>6} {row.get('failures', 0):>6} "
+              f"{row.get('retries', 0):>6} {row.get('rejected', 0):>7} {row.get('deadline', 0):>6} "
+              f"{row['breaker']:>10}")
+        if name == 'outage':
+            # Let the stalled round trips drain, as they would once Firestore answers again.
+            db.faults.set()
+            await asyncio.sleep(args.outage_delay)
+    print(f"stale lookups served: orders {actions_module.orders.cache.stale_hits}, "
+          f"users {actions_module.users.cache.stale_hits}, order lists {actions_module.order_index.cache.stale_hits}")
+
+    # The deadline the turns were bounded by (FIRESTORE_TIMEOUT per call without one).
+    deadline = data_access.ACTION_DEADLINE or data_access.FIRESTORE_TIMEOUT
+    failures = check(rows, deadline, args) + await check_stale_taxonomy(actions_module, db)
+    for line in failures:
+        print(f"FAIL {line}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.002, help="fake Firestore round trip in seconds")
+    parser.add_argument('--conversations', type=int, default=16)
+    parser.add_argument('--turns', type=int, default=320, help="turns per phase, across all conversations")
+    parser.add_argument('--delay', type=float, default=4.0, help="extra seconds of a slow round trip")
+    parser.add_argument('--slow-rate', type=float, default=0.1)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--outage-delay', type=float, default=8.0)
+    parser.add_argument('--unguarded', action='store_true', help="no deadline, retries or circuit breaker")
+    parser.add_argument('--slack-ms', type=float, default=250.0, help="allowed p99 above the deadline")
+    parser.add_argument('--fail-fast-ms', type=float, default=50.0, help="allowed p50 during the outage")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    configure(args.unguarded)
+    return asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
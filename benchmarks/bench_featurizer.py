@@ -0,0 +1,138 @@
+"""char_wb n-gram features: CountVectorsFeaturizer's vocabulary vs. HashingFeaturizer's hashed columns.
+
+    python -m benchmarks.bench_featurizer --n-features 512 1024 2048
+
+Runs without Rasa: the count profile is scikit-learn's char_wb
+CountVectorizer, which CountVectorsFeaturizer wraps, and the hashed profiles
+use the same `hashed_ngrams` as HashingFeaturizer. data/nlu.yml is split per
+intent (`--test-fraction` held out), `--repeats` times with different seeds.
+For each profile it reports the feature width, the size of what a trained
+model would store for the featurizer (the pickled vocabulary; nothing for
+hashing), featurization time, how many of the training n-grams share a
+column, and held-out intent accuracy of one logistic regression on the
+sentence features. The classifier only stands in for DIET, so it compares
+the features, not the deployed models; `benchmarks.bench_nlu` trains those.
+"""
+import argparse
+import pickle
+import random
+import re
+import statistics
+import time
+from typing import Dict, List, Text, Tuple
+
+import numpy as np
+import scipy.sparse
+import yaml
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.linear_model import LogisticRegression
+
+from addons.ngram_hashing import hashed_ngrams
+
+_ENTITY_RE = re.compile(r"\[([^\]]+)\](?:\([^)]*\)|\{[^}]*\})")
+_TOKEN_RE = re.compile(r"\w+")
+
+Example = Tuple[Text, Text]
+
+
+def load_examples(path: Text) -> List[Example]:
+    with open(path) as f:
+        data = yaml.safe_load(f)
+    examples = []
+    for block in data.get('nlu', []):
+        if 'intent' not in block:
+            continue
+        for line in block.get('examples', '').splitlines():
+            line = line.strip()
+            if line.startswith('- '):
+                examples.append((_ENTITY_RE.sub(r'\1', line[2:]), block['intent']))
+    return examples
+
+
+def split(examples: List[Example], test_fraction: float, seed: int) -> Tuple[List[Example], List[Example]]:
+    by_intent: Dict[Text, List[Example]] = {}
+    for example in examples:
+        by_intent.setdefault(example[1], []).append(example)
+    rng = random.Random(seed)
+    train, test = [], []
+    for intent_examples in by_intent.values():
+        rng.shuffle(intent_examples)
+        held_out = int(len(intent_examples) * test_fraction) if len(intent_examples) > 1 else 0
+        test.extend(intent_examples[:held_out])
+        train.extend(intent_examples[held_out:])
+    return train, test
+
+
+def tokens(text: Text) -> List[Text]:
+    return _TOKEN_RE.findall(text)
+
+
+def count_features(train: List[Text], test: List[Text]):
+    vectorizer = CountVectorizer(analyzer='char_wb', ngram_range=(1, 4))
+    x_train = vectorizer.fit_transform(' '.join(tokens(text)) for text in train)
+    x_test = vectorizer.transform(' '.join(tokens(text)) for text in test)
+    stored = len(pickle.dumps(vectorizer.vocabulary_))
+    return x_train, x_test, len(vectorizer.vocabulary_), stored, 0
+
+
+def hashed_features(train: List[Text], test: List[Text], n_features: int):
+    def matrix(texts: List[Text]) -> scipy.sparse.csr_matrix:
+        rows, columns = [], []
+        for row, text in enumerate(texts):
+            for token in tokens(text):
+                token_columns = hashed_ngrams(token, 1, 4, n_features)
+                rows.extend([row] * len(token_columns))
+                columns.extend(token_columns)
+        values = np.ones(len(columns), dtype=np.float32)
+        return scipy.sparse.csr_matrix((values, (rows, columns)), shape=(len(texts), n_features))
+
+    # How many distinct training n-grams land in an already used column.
+    grams = {f" {token.lower()} "[i:i + n] for text in train for token in tokens(text)
+             for n in range(1, 5) for i in range(len(token) + 3 - n)}
+    collisions = len(grams) - len({column for text in train for token in tokens(text)
+                                   for column in hashed_ngrams(token, 1, 4, n_features)})
+    return matrix(train), matrix(test), n_features, 0, collisions
+
+
+def accuracy(x_train, y_train: List[Text], x_test, y_test: List[Text]) -> float:
+    classifier = LogisticRegression(max_iter=2000).fit(x_train, y_train)
+    return float(np.mean(classifier.predict(x_test) == np.asarray(y_test)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nlu', default='data/nlu.yml')
+    parser.add_argument('--n-features', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    examples = load_examples(args.nlu)
+    profiles = [('count vectors', lambda train, test: count_features(train, test))] + [
+        (f"hashed {n}", lambda train, test, n=n: hashed_features(train, test, n)) for n in args.n_features]
+    results = {name: {'accuracy': [], 'seconds': []} for name, _ in profiles}
+    for repeat in range(args.repeats):
+        train, test = split(examples, args.test_fraction, args.seed + repeat)
+        train_texts, y_train = [text for text, _ in train], [intent for _, intent in train]
+        test_texts, y_test = [text for text, _ in test], [intent for _, intent in test]
+        for name, featurize in profiles:
+            hashed_ngrams.cache_clear()
+            started = time.perf_counter()
+            x_train, x_test, width, stored, collisions = featurize(train_texts, test_texts)
+            results[name]['seconds'].append(time.perf_counter() - started)
+            results[name].update(width=width, stored=stored, collisions=collisions)
+            results[name]['accuracy'].append(accuracy(x_train, y_train, x_test, y_test))
+
+    print(f"{len(examples)} examples, {len({intent for _, intent in examples})} intents, "
+          f"{args.repeats} splits holding out {args.test_fraction:.0%}")
+    print(f"{'features':<16} {'columns':>8} {'stored KB':>10} {'featurize ms':>13} {'collisions':>11} "
+          f"{'accuracy':>9} {'min':>6}")
+    for name, result in results.items():
+        print(f"{name:<16} {result['width']:>8} {result['stored'] / 1024:>10.1f} "
+              f"{statistics.median(result['seconds']) * 1000:>13.1f} {result['collisions']:>11} "
+              f"{statistics.mean(result['accuracy']):>9.3f} {min(result['accuracy']):>6.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Bytes held per product: full document dicts vs. ProductRecord.
+
+    python -m benchmarks.bench_memory --products 100000
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+from actions.records import PRODUCT_FIELDS, ProductRecord
+from actions.fake_firestore import FakeCollection
+from benchmarks import synthetic
+
+
+def held_bytes(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return held, after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=100000)
+    args = parser.parse_args()
+
+    docs = synthetic.products(args.products)
+    # Decode every document from its wire form inside the measurement, so each
+    # representation pays for its own strings like it would after a download.
+    wire = {i: json.dumps(doc) for i, doc in docs.items()}
+    projected_wire = {
+        doc.id: json.dumps(doc.to_dict())
+        for doc in FakeCollection('Products', docs).select(PRODUCT_FIELDS).get()
+    }
+
+    # What the actions used to hold: `product.to_dict()` for every document.
+    _, full = held_bytes(lambda: [json.loads(doc) for doc in wire.values()])
+    # Projected download, still kept as dicts.
+    _, projected = held_bytes(lambda: [json.loads(doc) for doc in projected_wire.values()])
+    # Compact records, as held by the catalog.
+    _, records = held_bytes(lambda: [ProductRecord.from_dict(i, json.loads(doc)) for i, doc in projected_wire.items()])
+
+    n = args.products
+    print(f"{'representation':<28} {'MB':>8} {'bytes/product':>14}")
+    for label, size in (('full document dicts', full), ('select(...) dicts', projected),
+                        ('ProductRecord (__slots__)', records)):
+        print(f"{label:<28} {size / 1e6:>8.1f} {size / n:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Compare NLU pipeline profiles: model size, load time, memory, parse latency, intent accuracy
+and whether they parse messages the same way.
+
+    python -m benchmarks.bench_nlu --configs config.yml config_fastpath.yml config_lowmem.yml
+
+data/nlu.yml is split per intent (seeded, `--test-fraction` held out). Each
+config is trained on the same train part with `rasa train nlu`. Each model is
+then loaded in a fresh process, so load time and RSS aren't shared, and that
+process parses every held-out message twice:
+
+* cold: the first pass, whose messages the fast path hasn't seen.
+* cached: the second pass, answered by the fast path's LRU where the first
+  parse was confident enough.
+
+Intent accuracy is taken from the cold pass. It is measured on held-out
+examples, so the exact-example table can't inflate it.
+
+A parse is the intent plus the (entity, value) pairs. `cached_agreement` is
+the share of messages parsed the same in both passes, and `agreement` the
+share parsed the same as the first config's cold pass. A profile meant to
+replace the first should be at 1.0 on both.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Text
+
+
+def percentile(samples: List[float], q: int) -> float:
+    return statistics.quantiles(samples, n=100, method='inclusive')[q - 1] if len(samples) > 1 else samples[0]
+
+
+def rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+######################## Measure (child process) ########################
+
+
+def measure(model: Text, test_path: Text) -> Dict[Text, Any]:
+    started = time.perf_counter()
+    from rasa.core.agent import Agent
+    from rasa.shared.nlu.constants import INTENT, TEXT
+    from rasa.shared.nlu.training_data.loading import load_data
+    imported = time.perf_counter()
+
+    agent = Agent.load(model)
+    loaded = time.perf_counter()
+    rss_loaded = rss_mb()
+
+    examples = [(message.get(TEXT), message.get(INTENT)) for message in load_data(test_path).intent_examples]
+
+    async def parse_all():
+        passes = []
+        for _ in range(2):
+            latencies, correct, parses = [], 0, []
+            for text, intent in examples:
+                before = time.perf_counter()
+                parsed = await agent.parse_message(text)
+                latencies.append((time.perf_counter() - before) * 1000)
+                correct += (parsed.get('intent') or {}).get('name') == intent
+                parses.append(parse_key(parsed))
+            passes.append((latencies, correct, parses))
+        return passes
+
+    # The first parse builds the inference graph; keep it out of the percentiles.
+    first = time.perf_counter()
+    asyncio.run(agent.parse_message('hello'))
+    first_ms = (time.perf_counter() - first) * 1000
+    (cold, correct, cold_parses), (cached, _, cached_parses) = asyncio.run(parse_all())
+
+    return {
+        'import_seconds': round(imported - started, 3),
+        'load_seconds': round(loaded - imported, 3),
+        'rss_loaded_mb': round(rss_loaded, 1),
+        'rss_mb': round(rss_mb(), 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'first_parse_ms': round(first_ms, 2),
+        'cold_p50_ms': round(percentile(cold, 50), 3),
+        'cold_p95_ms': round(percentile(cold, 95), 3),
+        'cached_p50_ms': round(percentile(cached, 50), 3),
+        'cached_p95_ms': round(percentile(cached, 95), 3),
+        'test_examples': len(examples),
+        'intent_accuracy': round(correct / len(examples), 4) if examples else None,
+        'cached_agreement': agreement(cached_parses, cold_parses),
+        'parses': cold_parses,
+    }
+
+
+def parse_key(parsed: Dict[Text, Any]) -> List[Any]:
+    entities = sorted([entity.get('entity'), str(entity.get('value'))] for entity in parsed.get('entities') or [])
+    return [(parsed.get('intent') or {}).get('name'), entities]
+
+
+def agreement(parses: List[Any], reference: List[Any]) -> Optional[float]:
+    return round(sum(a == b for a, b in zip(parses, reference)) / len(reference), 4) if reference else None
+
+######################## Train and Compare ########################
+
+
+def split(nlu: Text, workdir: Text, test_fraction: float, seed: int):
+    from rasa.shared.nlu.training_data.loading import load_data
+    from rasa.shared.utils.io import write_text_file
+
+    train, test = load_data(nlu).train_test_split(train_frac=1 - test_fraction, random_seed=seed)
+    paths = os.path.join(workdir, 'train.yml'), os.path.join(workdir, 'test.yml')
+    write_text_file(train.nlu_as_yaml(), paths[0])
+    write_text_file(test.nlu_as_yaml(), paths[1])
+    return paths
+
+
+def model_size(path: Text) -> Dict[Text, float]:
+    with tarfile.open(path) as archive:
+        unpacked = sum(member.size for member in archive.getmembers())
+    return {'model_mb': round(os.path.getsize(path) / 2 ** 20, 2), 'unpacked_mb': round(unpacked / 2 ** 20, 2)}
+
+
+def profile(config: Text, train_path: Text, test_path: Text, workdir: Text) -> Dict[Text, Any]:
+    name = os.path.splitext(os.path.basename(config))[0]
+    started = time.perf_counter()
+    subprocess.run(['rasa', 'train', 'nlu', '--config', config, '--nlu', train_path, '--out', workdir,
+                    '--fixed-model-name', name], check=True, stdout=subprocess.DEVNULL)
+    trained = time.perf_counter() - started
+    model = os.path.join(workdir, f"{name}.tar.gz")
+    child = subprocess.run([sys.executable, '-m', 'benchmarks.bench_nlu', '--measure', model, '--test', test_path],
+                           check=True, capture_output=True, text=True)
+    results = json.loads(child.stdout.strip().splitlines()[-1])
+    return {'train_seconds': round(trained, 1), **model_size(model), **results}
+
+
+def report(results: Dict[Text, Dict[Text, Any]]) -> None:
+    names = list(results)
+    print(f"{'':<18}" + ''.join(f"{name:>20}" for name in names))
+    for field in results[names[0]]:
+        print(f"{field:<18}" + ''.join(f"{str(results[name][field]):>20}" for name in names))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', nargs='+', default=['config.yml', 'config_fastpath.yml', 'config_lowmem.yml'],
+                        help="the first is the reference the others' parses are compared with")
+    parser.add_argument('--nlu', default='data/nlu.yml')
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help="where the split and the models go (default: a temporary directory)")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    parser.add_argument('--test', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.test)))
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_nlu-')
+    os.makedirs(workdir, exist_ok=True)
+    train_path, test_path = split(args.nlu, workdir, args.test_fraction, args.seed)
+    results = {config: profile(config, train_path, test_path, workdir) for config in args.configs}
+    parses = {config: result.pop('parses') for config, result in results.items()}
+    for config, result in results.items():
+        result['agreement'] = agreement(parses[config], parses[args.configs[0]])
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': {'nlu': args.nlu, 'test_fraction': args.test_fraction, 'seed': args.seed},
+                       'profiles': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Recommendation latency: top-k similar in-stock products at catalog scale.
+
+    python -m benchmarks.bench_recommend --products 100000
+
+Times the full build, single queries (a viewed product, searched text, a
+category and brand), batches, and applying product changes to the delta block.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from actions.recommender import Recommender
+from actions.records import ProductRecord
+from benchmarks import synthetic
+
+
+def percentile(samples, q):
+    return statistics.quantiles(samples, n=100)[q - 1] if len(samples) > 1 else samples[0]
+
+
+def timed_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=32)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    records = {i: ProductRecord.from_dict(i, d) for i, d in synthetic.products(args.products).items()}
+    ids = list(records)
+    recommender = Recommender(lambda: records.values())
+    started = time.perf_counter()
+    recommender.rebuild()
+    build_seconds = time.perf_counter() - started
+    base, _ = recommender._view
+    matrix_mb = (base.matrix.data.nbytes + base.matrix.indices.nbytes + base.matrix.indptr.nbytes) / 1e6
+
+    queries = {
+        'viewed product': lambda: recommender.query(records[rng.choice(ids)]),
+        'searched text': lambda: recommender.query(text=rng.choice(synthetic.MATERIALS) + ' ' + rng.choice(synthetic.NOUNS)),
+        'category + brand': lambda: recommender.query(category_id=f"cat-{rng.randrange(20)}",
+                                                      brand=rng.choice(synthetic.BRANDS)),
+    }
+
+    print(f"{args.products} products: built in {build_seconds:.2f}s, "
+          f"{base.matrix.nnz} non-zeros, {matrix_mb:.1f} MB")
+    print(f"{'query':<28} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, make in queries.items():
+        samples = timed_ms(lambda: recommender.recommend(make(), args.k), args.queries)
+        print(f"{label:<28} {percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f}")
+    batch = [queries['viewed product']() for _ in range(args.batch)]
+    samples = timed_ms(lambda: recommender.recommend_batch(batch, args.k), max(1, args.queries // args.batch))
+    print(f"{f'batch of {args.batch} (per query)':<28} {percentile(samples, 50) / args.batch:>8.2f} "
+          f"{percentile(samples, 99) / args.batch:>8.2f}")
+
+    # Product edits land in the delta block until it is compacted.
+    def change():
+        product_id = rng.choice(ids)
+        record = records[product_id]
+        records[product_id] = ProductRecord(product_id, record.title, record.price, record.sale_price,
+                                            rng.randrange(0, 50), record.category_id, record.brand)
+        recommender.apply({product_id: records[product_id]})
+
+    samples = timed_ms(change, 200)
+    print(f"{'apply one product change':<28} {percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f}")
+    samples = timed_ms(lambda: recommender.recommend(queries['viewed product'](), args.k), args.queries)
+    print(f"{'viewed product, 200 deltas':<28} {percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
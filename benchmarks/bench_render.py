@@ -0,0 +1,56 @@
+"""Product card rendering: per-message f-string concatenation vs. the shared renderer.
+
+    python -m benchmarks.bench_render --cards 10000
+"""
+import argparse
+import time
+
+from actions import rendering
+from actions.rendering import ProductCard, render_cards
+from benchmarks import synthetic
+
+
+def concatenate(products):
+    # How the search actions used to build their replies.
+    message = ""
+    for product in products:
+        if product['sale_price'] > 0 and product['sale_price'] < product['price']:
+            message += (f"🌟 {product['title']}\n"
+                        f"   Regular Price: ₹{product['price']}\n"
+                        f"   🏷️ Special Offer: ₹{product['sale_price']}\n"
+                        f"   📦 {product['stock']} available\n\n")
+        else:
+            message += (f"✨ {product['title']}\n"
+                        f"   Price: ₹{product['price']}\n"
+                        f"   📦 {product['stock']} available\n\n")
+    return message
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cards', type=int, default=10000)
+    args = parser.parse_args()
+
+    products = synthetic.products(args.cards)
+    dicts = [
+        {'title': p['Title'], 'price': p['Price'], 'sale_price': p['SalePrice'], 'stock': p['Stock']}
+        for p in products.values()
+    ]
+    cards = [ProductCard.from_dict(i, p) for i, p in products.items()]
+
+    rendering._format_card.cache_clear()
+    print(f"f-string concatenation : {timed(lambda: concatenate(dicts)):8.2f} ms")
+    print(f"renderer, cold cache   : {timed(lambda: render_cards(cards)):8.2f} ms")
+    print(f"renderer, warm cache   : {timed(lambda: render_cards(cards)):8.2f} ms")
+    if rendering.CARD_CACHE_SIZE < args.cards:
+        print(f"  (cache holds {rendering.CARD_CACHE_SIZE} cards; raise PRODUCT_CARD_CACHE_SIZE to keep all {args.cards})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Title search latency: linear substring scan vs. TitleIndex.
+
+    python -m benchmarks.bench_search --sizes 1000 100000 1000000
+"""
+import argparse
+import statistics
+import time
+
+from actions.search_index import TitleIndex
+from benchmarks import synthetic
+
+QUERIES = ['sofa', 'velvet chair', 'lam', 'walnu', 'cushon', 'nordic oak table', 'rattan', 'mirorr']
+
+
+def linear_scan(products, query):
+    # What ActionSearchProduct used to do on every message.
+    term = query.lower()
+    matches = [p for p in products.values() if term in p.get('Title', '').lower()]
+    return matches[:5]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'products':>10} {'query':>18} {'scan ms':>10} {'index ms':>10} {'speedup':>8}")
+    for size in args.sizes:
+        products = synthetic.products(size)
+        index = TitleIndex()
+        start = time.perf_counter()
+        for product_id, product in products.items():
+            index.add(product_id, product['Title'])
+        build = time.perf_counter() - start
+        print(f"{size:>10} {'(index build)':>18} {'':>10} {build * 1000:>10.1f}")
+
+        for query in QUERIES:
+            scan = timed(lambda: linear_scan(products, query), args.repeat)
+            indexed = timed(lambda: index.search(query, 5), args.repeat)
+            print(f"{size:>10} {query:>18} {scan:>10.3f} {indexed:>10.3f} {scan / indexed:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
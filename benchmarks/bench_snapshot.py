@@ -0,0 +1,93 @@
+"""Catalog cold start: full listener snapshot vs. memory-mapped snapshot file.
+
+    python -m benchmarks.bench_snapshot --products 100000 --latency 2.0
+
+`--latency` stands in for the time Firestore takes to stream the initial
+listener snapshot, which the mapped file skips entirely.
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from actions.catalog import ProductCatalog
+from actions.fake_firestore import FakeCollection
+from actions.records import ProductRecord
+from actions.snapshot import MappedCatalog, export_snapshot
+from benchmarks import synthetic
+
+
+def timed(fn):
+    # Timed without tracemalloc (it slows allocation-heavy code several times),
+    # then run again under it for the heap it leaves behind.
+    gc.collect()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    again = fn()
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    (getattr(again, 'stop', None) or again.close)()
+    return result, elapsed, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to the listener load for the Firestore download")
+    args = parser.parse_args()
+
+    docs = synthetic.products(args.products)
+    collection = FakeCollection('Products', docs)
+    path = os.path.join(tempfile.mkdtemp(), 'catalog.snap')
+    started = time.perf_counter()
+    export_snapshot(path, (ProductRecord.from_dict(i, d) for i, d in docs.items()))
+    export_seconds = time.perf_counter() - started
+
+    def from_listener():
+        catalog = ProductCatalog()
+        time.sleep(args.latency)
+        catalog.start(collection)
+        return catalog
+
+    def from_snapshot():
+        catalog = ProductCatalog()
+        catalog.load_snapshot(path)
+        return catalog
+
+    def mapped_only():
+        return MappedCatalog(path)
+
+    listener, listener_seconds, listener_bytes = timed(from_listener)
+    listener.stop()
+    mapped, mapped_seconds, mapped_bytes = timed(from_snapshot)
+    base, base_seconds, base_bytes = timed(mapped_only)
+
+    # Deltas on top of the snapshot: the first listener callback is diffed.
+    collection.document(next(iter(docs))).update({'Price': 1})
+    collection.document(list(docs)[1]).delete()
+    started = time.perf_counter()
+    mapped.start(collection)
+    sync_seconds = time.perf_counter() - started
+    assert mapped.get(next(iter(docs))).price == 1 and mapped.get(list(docs)[1]) is None
+    assert len(mapped) == args.products - 1
+
+    print(f"{args.products} products, snapshot {os.path.getsize(path) / 1e6:.1f} MB "
+          f"(exported in {export_seconds:.2f}s)")
+    print(f"{'load':<36} {'seconds':>8} {'heap MB':>8}")
+    for label, seconds, held in (
+            ('listener snapshot + indexes', listener_seconds, listener_bytes),
+            ('mapped snapshot + indexes', mapped_seconds, mapped_bytes),
+            ('mapped snapshot only (get by id)', base_seconds, base_bytes)):
+        print(f"{label:<36} {seconds:>8.3f} {held / 1e6:>8.1f}")
+    print(f"first listener callback diffed against the snapshot in {sync_seconds:.3f}s")
+    base.close()
+
+
+if __name__ == '__main__':
+    main()
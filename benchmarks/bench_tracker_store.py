@@ -0,0 +1,86 @@
+"""Save/retrieve latency and memory of the compact conversation store under long-running load.
+
+    python -m benchmarks.bench_tracker_store --conversations 20000 --turns 100000
+
+Replays `--turns` user turns, each from a random one of `--conversations`
+senders. Each turn retrieves the conversation, adds
+a user message, an action and an action_listen (like a real turn's events)
+and saves it. This is the `addons.conversation_store` part of
+`CompactTrackerStore`, without Rasa's tracker objects. RSS is printed as it
+goes with the latencies of the turns since the previous line; with a bounded
+history and LRU it should level off.
+"""
+import argparse
+import os
+import random
+import resource
+import statistics
+import tempfile
+import time
+
+from addons.conversation_store import ConversationStore, pack, trim_events, unpack
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def turn_events(rng, turn):
+    text = rng.choice(['show categories', 'track my order 12345', 'sofas under $500', 'featured products'])
+    return [
+        {'event': 'user', 'timestamp': time.time(), 'text': text,
+         'parse_data': {'intent': {'name': 'order_status', 'confidence': 0.98},
+                        'intent_ranking': [{'name': f"intent_{i}", 'confidence': 0.1} for i in range(10)],
+                        'entities': [], 'text': text}},
+        {'event': 'action', 'timestamp': time.time(), 'name': 'action_track_order', 'policy': 'TEDPolicy',
+         'confidence': 0.97},
+        {'event': 'slot', 'timestamp': time.time(), 'name': 'order_id', 'value': str(turn)},
+        {'event': 'action', 'timestamp': time.time(), 'name': 'action_listen', 'policy': 'TEDPolicy',
+         'confidence': 0.99},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=20000)
+    parser.add_argument('--turns', type=int, default=100000)
+    parser.add_argument('--max-event-history', type=int, default=100)
+    parser.add_argument('--cache-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'trackers.db')
+    store = ConversationStore(path, cache_size=args.cache_size)
+    rng = random.Random(args.seed)
+    retrieve, save = [], []
+    print(f"{'turns':>9} {'RSS MB':>8} {'db MB':>7} {'get p50 us':>11} {'get p99 us':>11} "
+          f"{'put p50 us':>11} {'put p99 us':>11}")
+    for turn in range(1, args.turns + 1):
+        sender = f"user-{rng.randrange(args.conversations)}"
+        started = time.perf_counter()
+        stored = store.get(sender)
+        conversation = unpack(stored.data) if stored else {'events': [], 'slots': {}}
+        retrieve.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        events = trim_events(conversation['events'] + turn_events(rng, turn), args.max_event_history)
+        store.put(sender, len(events), pack(events, {**conversation['slots'], 'order_id': str(turn)}))
+        save.append(time.perf_counter() - started)
+        if turn % (args.turns // 10 or 1) == 0:
+            get, put = statistics.quantiles(retrieve, n=100), statistics.quantiles(save, n=100)
+            print(f"{turn:>9} {rss_mb():>8.1f} {os.path.getsize(path) / 2 ** 20:>7.1f} "
+                  f"{get[49] * 1e6:>11.0f} {get[98] * 1e6:>11.0f} {put[49] * 1e6:>11.0f} {put[98] * 1e6:>11.0f}")
+            retrieve.clear()
+            save.clear()
+
+    print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB, "
+          f"{len(store.keys())} conversations stored")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
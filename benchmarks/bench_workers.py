@@ -0,0 +1,125 @@
+"""Catalog query throughput with 1, 2, 4 and 8 worker processes sharing one snapshot.
+
+    python -m benchmarks.bench_workers --products 100000 --workers 1 2 4 8
+
+Mirrors `actions.serve`: the catalog, brand postings and recommender are
+built from a snapshot file before the workers fork (as the action server
+imports `actions.actions`), settled and frozen out of the collector's reach,
+and each worker then follows that file. Every turn is a title search, a
+price-range page, a brand page, a recommendation and rendering the cards.
+`--build-in-workers` forks before loading anything, so that every worker
+builds its own indexes, for comparison. Throughput can
+only scale up to the number of CPUs; the memory columns show how much of each
+worker is shared (Pss < Rss).
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from actions.catalog import ProductCatalog
+from actions.recommender import Recommender
+from actions.records import ProductRecord
+from actions.rendering import render_cards
+from actions.snapshot import export_snapshot
+from actions.taxonomy import Taxonomy
+from benchmarks import synthetic
+
+TERMS = ['sofa', 'oak table', 'velvet', 'lamp', 'rattan chair', 'cushion', 'mirror', 'teak']
+
+
+def memory_kb():
+    # Pss splits shared pages between the processes mapping them; Rss counts them
+    # in full; private pages are this process's alone.
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = {key: int(value.split()[0]) for key, value in (line.split(':', 1) for line in f if ':' in line)
+                      if value.strip().endswith('kB')}
+        return fields['Rss'], fields['Pss'], fields['Private_Clean'] + fields['Private_Dirty']
+    except (OSError, KeyError, ValueError):
+        return None, None, None
+
+
+def worker(catalog, taxonomy, recommender, path, seconds, start, results):
+    catalog.follow_snapshot(path)
+    brands = sorted({product.brand for product in catalog.products()})
+    rng = random.Random(os.getpid())
+    start.wait()
+    turns = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        low = rng.randrange(0, 90000)
+        cards = catalog.search_title(rng.choice(TERMS), 5)
+        page, _ = catalog.in_price_range(low, low + 5000, 5, rng.randrange(0, 20))
+        brand_ids, _ = taxonomy.products_for_brand(rng.choice(brands), 5)
+        query = recommender.query(cards[0] if cards else None, rng.choice(TERMS))
+        render_cards(cards)
+        render_cards(page)
+        render_cards(list(map(catalog.get, brand_ids + recommender.recommend(query, 5))))
+        turns += 1
+    results.put((turns,) + memory_kb())
+
+
+def run(catalog, taxonomy, recommender, path, workers, seconds):
+    context = multiprocessing.get_context('fork')
+    start = context.Event()
+    results = context.Queue()
+    processes = [context.Process(target=worker,
+                                 args=(catalog, taxonomy, recommender, path, seconds, start, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    time.sleep(0.5)
+    start.set()
+    stats = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--build-in-workers', action='store_true',
+                        help="fork before loading the snapshot, so each worker builds its own indexes")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'catalog.snap')
+    docs = synthetic.products(args.products)
+    export_snapshot(path, (ProductRecord.from_dict(i, d) for i, d in docs.items()))
+    del docs
+    catalog = ProductCatalog()
+    taxonomy = Taxonomy()
+    catalog.add_listener(taxonomy.apply_products)
+    recommender = Recommender(catalog.products)
+    catalog.add_listener(recommender.apply)
+    catalog.share()
+    if not args.build_in_workers:
+        catalog.load_snapshot(path)
+        catalog.settle()
+        taxonomy.settle()
+    gc.freeze()
+
+    print(f"{args.products} products, {os.cpu_count()} CPUs, {args.seconds:.0f}s per run, indexes built "
+          f"{'in each worker' if args.build_in_workers else 'before fork'}")
+    print(f"{'workers':>7} {'turns/s':>9} {'speedup':>8} {'Rss MB/worker':>14} {'Pss MB/worker':>14} "
+          f"{'private MB/worker':>18}")
+    single = None
+    for workers in args.workers:
+        stats = run(catalog, taxonomy, recommender, path, workers, args.seconds)
+        rate = sum(turns for turns, _, _, _ in stats) / args.seconds
+        single = single or rate
+        rss, pss, private = ([value for value in column if value is not None] for column in list(zip(*stats))[1:])
+        mean = lambda values: f"{sum(values) / len(values) / 1024:.1f}" if values else 'n/a'
+        print(f"{workers:>7} {rate:>9.0f} {rate / single:>7.2f}x {mean(rss):>14} {mean(pss):>14} "
+              f"{mean(private):>18}")
+    catalog.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Action server on port 5055 backed by a generated FakeFirestore store instead of Firebase.
+
+    python -m benchmarks.fake_action_server --products 10000 --latency 0.005 --trace /tmp/actions.jsonl
+
+Every action run is appended to `--trace` (see ACTION_TRACE_FILE), which
+`benchmarks.replay` reads to split each turn's latency into its parts.
+"""
+import argparse
+import logging
+import os
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.005, help="fake Firestore round trip in seconds")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--trace', help="append one JSON line per action run to this file")
+    args = parser.parse_args()
+
+    # Read when the action modules are imported, so set before importing them.
+    os.environ['FIREBASE_CONNECT'] = 'lazy'
+    os.environ['ACTION_SERVER_SANIC_WORKERS'] = '1'
+    if args.trace:
+        os.environ['ACTION_TRACE_FILE'] = args.trace
+
+    from rasa_sdk.endpoint import run
+
+    from actions import actions
+    from actions.fake_firestore import FakeFirestore
+    from benchmarks import synthetic
+
+    logging.basicConfig(level=logging.INFO)
+    db = FakeFirestore(synthetic.store(args.products, args.seed), latency=args.latency)
+    actions.connection.use(lambda: db)
+    actions.connection.start()
+    run('actions', port=args.port)
+
+
+if __name__ == '__main__':
+    main()
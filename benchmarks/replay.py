@@ -0,0 +1,283 @@
+"""Replay stories as concurrent conversations through the whole stack.
+
+    python -m benchmarks.fake_action_server --products 10000 --trace /tmp/actions.jsonl &
+    rasa run --enable-api --port 5005 &
+    python -m benchmarks.replay --conversations 500 --concurrency 50 --action-trace /tmp/actions.jsonl
+
+Conversations come from the stories and rules in `--stories` (by default
+data/stories.yml, data/rules.yml and tests/test_stories.yml). A step's `user`
+text is sent as written; otherwise the text is a seeded pick from that
+intent's examples in data/nlu.yml. Each user turn is posted to the REST
+channel (/webhooks/rest/webhook) on `--url`, and the tool reports per-turn
+latency and throughput.
+
+Each turn's time is split three ways:
+
+* nlu: the same text posted to /model/parse just before the turn (needs
+  --enable-api). This parses every message twice, so pass --no-nlu-probe
+  when sizing for throughput.
+* action: the action runs the action server wrote to `--action-trace` for
+  that sender during the turn (ACTION_TRACE_FILE).
+* policy: what is left, i.e. policy prediction, the tracker store and HTTP.
+
+`--output` and `--baseline` work as in `benchmarks.run`. Replay the same
+seed against a model trained with different pipeline settings (max_ngram,
+epochs, ...) to see what they cost.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+import aiohttp
+import yaml
+
+DEFAULT_STORIES = ['data/stories.yml', 'data/rules.yml', 'tests/test_stories.yml']
+
+# `[text](entity)` and `[text]{"entity": ...}` annotations in training examples.
+_ENTITY_RE = re.compile(r"\[([^\]]+)\](?:\([^)]*\)|\{[^}]*\})")
+
+######################## Conversations ########################
+
+Conversation = Tuple[Text, List[Tuple[Text, Optional[Text]]]]
+
+
+def plain_text(example: Text) -> Text:
+    return _ENTITY_RE.sub(r"\1", example).strip()
+
+
+def load_examples(path: Text) -> Dict[Text, List[Text]]:
+    """Intent -> example texts from an NLU training file."""
+    with open(path, encoding='utf-8') as f:
+        data = yaml.safe_load(f) or {}
+    examples = {}
+    for item in data.get('nlu') or []:
+        if 'intent' in item:
+            lines = (line.strip() for line in (item.get('examples') or '').splitlines())
+            examples[item['intent']] = [plain_text(line[1:]) for line in lines if line.startswith('-')]
+    return examples
+
+
+def load_conversations(paths: List[Text]) -> List[Conversation]:
+    """(name, [(intent, user text or None), ...]) for every story and rule with a user turn."""
+    conversations = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            data = yaml.safe_load(f) or {}
+        for key in ('stories', 'rules'):
+            for story in data.get(key) or []:
+                turns = [(step['intent'], plain_text(step['user']) if step.get('user') else None)
+                         for step in story.get('steps') or [] if 'intent' in step]
+                if turns:
+                    conversations.append((story.get('story') or story.get('rule'), turns))
+    return conversations
+
+######################## Replay ########################
+
+
+class Turn:
+    __slots__ = ('sender', 'story', 'intent', 'started', 'ended', 'total_ms', 'nlu_ms', 'action_ms', 'ok')
+
+    def __init__(self, sender: Text, story: Text, intent: Text):
+        self.sender = sender
+        self.story = story
+        self.intent = intent
+        self.started = self.ended = 0.0
+        self.total_ms = 0.0
+        self.nlu_ms: Optional[float] = None
+        self.action_ms = 0.0
+        self.ok = False
+
+    @property
+    def policy_ms(self) -> float:
+        return max(0.0, self.total_ms - (self.nlu_ms or 0.0) - self.action_ms)
+
+
+async def converse(session: aiohttp.ClientSession, args, sender: Text, conversation: Conversation,
+                   examples: Dict[Text, List[Text]], rng: random.Random, turns: List[Turn]) -> None:
+    story, steps = conversation
+    for intent, text in steps:
+        if text is None:
+            # Intents without examples are sent as Rasa's "/intent" shortcut.
+            text = rng.choice(examples[intent]) if examples.get(intent) else f"/{intent}"
+        turn = Turn(sender, story, intent)
+        try:
+            if args.nlu_probe:
+                started = time.perf_counter()
+                async with session.post(f"{args.url}/model/parse", json={'text': text}) as response:
+                    await response.read()
+                turn.nlu_ms = (time.perf_counter() - started) * 1000
+            turn.started = time.time()
+            started = time.perf_counter()
+            async with session.post(f"{args.url}/webhooks/rest/webhook",
+                                    json={'sender': sender, 'message': text}) as response:
+                await response.read()
+                turn.ok = response.status == 200
+            turn.total_ms = (time.perf_counter() - started) * 1000
+            turn.ended = time.time()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            turn.ended = time.time()
+        turns.append(turn)
+        if not turn.ok:
+            return
+        if args.think_time:
+            await asyncio.sleep(rng.expovariate(1 / args.think_time))
+
+
+async def replay(args, conversations: List[Conversation], examples: Dict[Text, List[Text]]) -> Tuple[List[Turn], float]:
+    run_id = uuid.uuid4().hex[:8]
+    limit = asyncio.Semaphore(args.concurrency)
+    turns: List[Turn] = []
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        try:
+            async with session.get(f"{args.url}/") as response:
+                await response.read()
+        except aiohttp.ClientError as e:
+            raise SystemExit(f"Rasa server is not reachable on {args.url}: {e}")
+
+        async def one(index: int) -> None:
+            rng = random.Random(f"{args.seed}:{index}")
+            async with limit:
+                await converse(session, args, f"replay-{run_id}-{index}", rng.choice(conversations),
+                               examples, rng, turns)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.conversations)))
+        return turns, time.perf_counter() - started
+
+
+def attribute_actions(turns: List[Turn], trace_path: Text) -> int:
+    """Add each traced action run to the turn of its sender that was in flight when it finished."""
+    by_sender: Dict[Text, List[Turn]] = defaultdict(list)
+    for turn in turns:
+        by_sender[turn.sender].append(turn)
+    matched = 0
+    with open(trace_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            for turn in by_sender.get(record.get('sender_id'), ()):
+                if turn.started <= record['ts'] <= turn.ended:
+                    turn.action_ms += record['seconds'] * 1000
+                    matched += 1
+                    break
+    return matched
+
+######################## Report ########################
+
+
+def percentile(samples: List[float], q: int) -> float:
+    if not samples:
+        return 0.0
+    return statistics.quantiles(samples, n=100, method='inclusive')[q - 1] if len(samples) > 1 else samples[0]
+
+
+def summarize(args, turns: List[Turn], seconds: float) -> Dict[Text, Any]:
+    ok = [turn for turn in turns if turn.ok]
+    parts = {'total': [t.total_ms for t in ok], 'action': [t.action_ms for t in ok]}
+    if args.nlu_probe:
+        parts['nlu'] = [t.nlu_ms for t in ok]
+        parts['policy'] = [t.policy_ms for t in ok]
+    latency = {name: {f"p{q}_ms": round(percentile(samples, q), 2) for q in (50, 95, 99)}
+               for name, samples in parts.items()}
+    by_intent: Dict[Text, List[float]] = defaultdict(list)
+    for turn in ok:
+        by_intent[turn.intent].append(turn.total_ms)
+    return {
+        'config': {'url': args.url, 'conversations': args.conversations, 'concurrency': args.concurrency,
+                   'think_time': args.think_time, 'seed': args.seed, 'nlu_probe': args.nlu_probe},
+        'seconds': round(seconds, 3),
+        'turns': len(turns),
+        'errors': len(turns) - len(ok),
+        'turns_per_second': round(len(ok) / seconds, 2) if seconds else 0.0,
+        'latency': latency,
+        'intents': {intent: {'turns': len(samples), 'p95_ms': round(percentile(samples, 95), 2)}
+                    for intent, samples in sorted(by_intent.items())},
+    }
+
+
+def report(results: Dict[Text, Any]) -> None:
+    print(f"{results['turns']} turns ({results['errors']} failed) in {results['seconds']:.1f}s: "
+          f"{results['turns_per_second']:.1f} turns/s at concurrency {results['config']['concurrency']}")
+    print(f"{'per turn':<10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in results['latency'].items():
+        print(f"{name:<10} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+    print(f"{'intent':<28} {'turns':>6} {'p95 ms':>9}")
+    for intent, row in results['intents'].items():
+        print(f"{intent:<28} {row['turns']:>6} {row['p95_ms']:>9.1f}")
+
+
+def regressions(current: Dict[Text, Any], baseline: Dict[Text, Any], threshold: float, min_ms: float) -> List[Text]:
+    found = []
+    if current['config'] != baseline.get('config'):
+        print(f"warning: baseline was run with {baseline.get('config')}, this run with {current['config']}",
+              file=sys.stderr)
+    for name, row in current['latency'].items():
+        before = baseline.get('latency', {}).get(name)
+        if before is None:
+            continue
+        limit = before['p95_ms'] * (1 + threshold)
+        if row['p95_ms'] > limit and row['p95_ms'] - before['p95_ms'] > min_ms:
+            found.append(f"{name} p95_ms {before['p95_ms']} -> {row['p95_ms']} (limit {limit:.1f})")
+    floor = baseline.get('turns_per_second', 0) * (1 - threshold)
+    if current['turns_per_second'] < floor:
+        found.append(f"turns_per_second {baseline['turns_per_second']} -> {current['turns_per_second']} "
+                     f"(limit {floor:.1f})")
+    if current['errors'] > baseline.get('errors', 0):
+        found.append(f"errors {baseline.get('errors', 0)} -> {current['errors']}")
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5005')
+    parser.add_argument('--stories', nargs='+', default=DEFAULT_STORIES)
+    parser.add_argument('--nlu', default='data/nlu.yml')
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--think-time', type=float, default=0.0, help="mean pause between a user's turns (s)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="per-request timeout (s)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-nlu-probe', dest='nlu_probe', action='store_false')
+    parser.add_argument('--action-trace', help="ACTION_TRACE_FILE of the action server")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--min-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    conversations = load_conversations([path for path in args.stories if os.path.exists(path)])
+    if not conversations:
+        parser.error("no stories with user turns found")
+    turns, seconds = asyncio.run(replay(args, conversations, load_examples(args.nlu)))
+    if args.action_trace and os.path.exists(args.action_trace):
+        attribute_actions(turns, args.action_trace)
+
+    results = summarize(args, turns, seconds)
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.threshold, args.min_ms)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""Benchmark every action in actions/actions.py in-process against a fake Firestore.
+
+    python -m benchmarks.run --products 10000 --latency 0.002 --output results.json
+    python -m benchmarks.run --baseline results.json --threshold 0.25
+
+The store is generated from `--seed` (products, categories with subcategories,
+brands, users and orders) and served by `FakeFirestore`, which sleeps
+`--latency` seconds per round trip and counts billed document reads. Each
+action runs `--turns` times with slots drawn from the same seed. For each
+action the report has latency percentiles, documents and round trips per turn,
+and the peak Python heap during a turn (a separate tracemalloc pass).
+
+With `--baseline`, the run exits with status 1 if any action regressed by
+more than `--threshold` against a previous `--output` file: p95 latency
+(and at least `--min-ms` slower), documents read, or peak memory.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Text
+
+# The harness supplies the client and doesn't serve /metrics or /ready.
+os.environ.setdefault('FIREBASE_CONNECT', 'lazy')
+os.environ.setdefault('ACTION_METRICS_PORT', '0')
+
+from rasa_sdk import Action, Tracker  # noqa: E402
+from rasa_sdk.executor import CollectingDispatcher  # noqa: E402
+
+from actions import actions as actions_module  # noqa: E402
+from actions.fake_firestore import FakeFirestore  # noqa: E402
+from actions.pagination import CURSOR_SLOT, PAGE_SIZE, encode_cursor  # noqa: E402
+from benchmarks import synthetic  # noqa: E402
+
+SEARCH_TERMS = ['sofa', 'oak table', 'velvet', 'lamp', 'rattan chair', 'cushion', 'mirror', 'teak bench']
+
+######################## Scenarios ########################
+
+# Slots for one turn of each action, from the seeded rng and the generated store.
+# Actions without an entry run with no slots set.
+Scenario = Callable[[random.Random, Dict[Text, Dict[Text, Any]]], Dict[Text, Any]]
+
+
+def _price_range(rng, store):
+    low = rng.randrange(0, 90000, 500)
+    return {'min_price': low, 'max_price': low + rng.choice([2000, 10000, 50000])}
+
+
+def _order_id(rng, store):
+    # Roughly one lookup in ten is for an order that doesn't exist.
+    return {'order_id': rng.choice(list(store['Orders'])) if rng.random() < 0.9 else f"missing-{rng.randrange(1000)}"}
+
+
+def _recommendation(rng, store):
+    if rng.random() < 0.25:
+        return {}
+    return {'product': rng.choice(SEARCH_TERMS),
+            'category': rng.choice(list(store['Categories'].values()))['Name']}
+
+
+SCENARIOS: Dict[Text, Scenario] = {
+    'action_search_product': lambda rng, store: {'product': rng.choice(SEARCH_TERMS)},
+    'action_search_product_by_price_range': _price_range,
+    'action_show_products_by_category': lambda rng, store: {
+        'category': rng.choice(list(store['Categories'].values()))['Name']},
+    'action_show_products_by_brand': lambda rng, store: {'brand': rng.choice(synthetic.BRANDS)},
+    'action_show_more': lambda rng, store: {CURSOR_SLOT: encode_cursor(
+        'action_search_product', q=rng.choice(SEARCH_TERMS), o=PAGE_SIZE * rng.randrange(1, 3))},
+    'action_track_order': _order_id,
+    'action_get_user_profile': lambda rng, store: {'user_id': rng.choice(list(store['Users']))},
+    'action_list_user_orders': lambda rng, store: {'user_id': rng.choice(list(store['Users']))},
+    'action_product_recommendations': _recommendation,
+}
+
+
+def tracker(slots: Dict[Text, Any], sender_id: Text) -> Tracker:
+    return Tracker(sender_id=sender_id, slots=slots, latest_message={}, events=[], paused=False,
+                   followup_action=None, active_loop={}, latest_action_name=None)
+
+
+def action_classes() -> List[Action]:
+    """Every action defined in actions/actions.py, in source order."""
+    return [value() for value in vars(actions_module).values()
+            if isinstance(value, type) and issubclass(value, Action) and value.__module__ == actions_module.__name__]
+
+######################## Measurement ########################
+
+
+def percentile(samples: List[float], q: int) -> float:
+    return statistics.quantiles(samples, n=100, method='inclusive')[q - 1] if len(samples) > 1 else samples[0]
+
+
+async def run_turn(action: Action, slots: Dict[Text, Any], sender_id: Text) -> CollectingDispatcher:
+    dispatcher = CollectingDispatcher()
+    await action.run(dispatcher, tracker(slots, sender_id), {})
+    return dispatcher
+
+
+async def measure(action: Action, db: FakeFirestore, store, turns: int, memory_turns: int,
+                  seed: int) -> Dict[Text, Any]:
+    scenario = SCENARIOS.get(action.name(), lambda rng, store: {})
+    rng = random.Random(f"{seed}:{action.name()}")
+    slots = [scenario(rng, store) for _ in range(turns)]
+    before = db.reads.snapshot()
+    latencies = []
+    rendered = 0
+    # A collection of the whole heap landing in one turn would dominate its latency.
+    gc.collect()
+    gc.disable()
+    try:
+        for i, turn_slots in enumerate(slots):
+            started = time.perf_counter()
+            dispatcher = await run_turn(action, turn_slots, f"bench-{i % 50}")
+            latencies.append((time.perf_counter() - started) * 1000)
+            rendered += sum(len((message.get('text') or '').encode('utf-8')) for message in dispatcher.messages)
+    finally:
+        gc.enable()
+    after = db.reads.snapshot()
+
+    # Peak heap per turn, measured apart from the latencies (tracemalloc slows allocation).
+    tracemalloc.start()
+    peak = 0
+    for i, turn_slots in enumerate(slots[:memory_turns]):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await run_turn(action, turn_slots, f"bench-{i % 50}")
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    return {
+        'turns': turns,
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(max(latencies), 3),
+        'documents_per_turn': round((after['documents'] - before['documents']) / turns, 3),
+        'round_trips_per_turn': round((after['round_trips'] - before['round_trips']) / turns, 3),
+        'rendered_bytes_per_turn': round(rendered / turns, 1),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+async def run(args) -> Dict[Text, Any]:
+    store = synthetic.store(args.products, args.seed)
+    db = FakeFirestore(store, latency=args.latency)
+
+    started = time.perf_counter()
+    actions_module.connection.use(lambda: db)
+    actions_module.connection.start()
+    while not actions_module.connection.ready:
+        if time.perf_counter() - started > args.startup_timeout:
+            raise SystemExit(f"Startup did not finish in {args.startup_timeout}s")
+        await asyncio.sleep(0.01)
+    startup = {'seconds': round(time.perf_counter() - started, 3), 'documents': db.reads.documents,
+               'round_trips': db.reads.round_trips}
+
+    results = {}
+    for action in action_classes():
+        if args.actions and action.name() not in args.actions:
+            continue
+        results[action.name()] = await measure(action, db, store, args.turns, args.memory_turns, args.seed)
+    return {
+        'config': {'products': args.products, 'latency': args.latency, 'turns': args.turns, 'seed': args.seed},
+        'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                        'cpus': os.cpu_count()},
+        'startup': startup,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'actions': results,
+    }
+
+######################## Regression Check ########################
+
+
+def regressions(current: Dict[Text, Any], baseline: Dict[Text, Any], threshold: float,
+                min_ms: float) -> List[Text]:
+    found = []
+    if current['config'] != baseline.get('config'):
+        print(f"warning: baseline was run with {baseline.get('config')}, this run with {current['config']}",
+              file=sys.stderr)
+    for name, now in current['actions'].items():
+        before = baseline.get('actions', {}).get(name)
+        if before is None:
+            continue
+        checks = (
+            ('p95_ms', min_ms),
+            ('documents_per_turn', 0.5),
+            ('peak_kb', 64.0),
+        )
+        for field, floor in checks:
+            limit = before[field] * (1 + threshold)
+            if now[field] > limit and now[field] - before[field] > floor:
+                found.append(f"{name}: {field} {before[field]} -> {now[field]} (limit {limit:.3f})")
+    return found
+
+
+def report(results: Dict[Text, Any]) -> None:
+    startup = results['startup']
+    print(f"{results['config']['products']} products, {results['config']['latency'] * 1000:.1f} ms per round trip; "
+          f"startup {startup['seconds']:.2f}s reading {startup['documents']} documents; "
+          f"peak RSS {results['peak_rss_mb']:.0f} MB")
+    print(f"{'action':<38} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'docs':>7} {'trips':>6} {'peak KB':>8}")
+    for name, row in results['actions'].items():
+        print(f"{name:<38} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+              f"{row['documents_per_turn']:>7.2f} {row['round_trips_per_turn']:>6.2f} {row['peak_kb']:>8.1f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=10000, help="catalog size (1k to 1M)")
+    parser.add_argument('--latency', type=float, default=0.002, help="fake Firestore round trip in seconds")
+    parser.add_argument('--turns', type=int, default=50)
+    parser.add_argument('--memory-turns', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--actions', nargs='*', help="only these action names")
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument('--min-ms', type=float, default=1.0, help="ignore latency regressions below this")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.threshold, args.min_ms)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import random
+from typing import Any, Dict, List, Optional, Text
+
+######################## Synthetic Catalog ########################
+
+# Seeded generator for product documents shaped like the `Products`
+# collection, so benchmark runs are reproducible.
+
+ADJECTIVES = ['Classic', 'Modern', 'Rustic', 'Cozy', 'Elegant', 'Compact', 'Vintage', 'Premium',
+              'Minimal', 'Royal', 'Soft', 'Nordic', 'Handmade', 'Luxury', 'Smart', 'Foldable']
+MATERIALS = ['Wooden', 'Velvet', 'Leather', 'Cotton', 'Marble', 'Rattan', 'Ceramic', 'Brass',
+             'Linen', 'Glass', 'Teak', 'Bamboo', 'Steel', 'Jute', 'Oak', 'Walnut']
+NOUNS = ['Sofa', 'Chair', 'Table', 'Lamp', 'Bed', 'Cushion', 'Curtain', 'Rug', 'Shelf', 'Mirror',
+         'Vase', 'Clock', 'Wardrobe', 'Stool', 'Bench', 'Cabinet', 'Blanket', 'Planter']
+BRANDS = ['Dekozy', 'UrbanNest', 'HomeCraft', 'WoodHaus', 'Casa Verde', 'Loomstone', 'Nook & Co',
+          'Hearthline', 'Oakridge', 'Solace']
+
+
+def product(rng: random.Random, index: int, categories: int = 20) -> Dict[Text, Any]:
+    price = rng.randrange(199, 99999)
+    on_sale = rng.random() < 0.3
+    return {
+        'Title': f"{rng.choice(ADJECTIVES)} {rng.choice(MATERIALS)} {rng.choice(NOUNS)} {index % 997}",
+        'Price': price,
+        'SalePrice': int(price * rng.uniform(0.6, 0.95)) if on_sale else 0,
+        'Stock': rng.randrange(0, 200),
+        'CategoryId': f"cat-{rng.randrange(categories)}",
+        'Brand': {'Name': rng.choice(BRANDS)},
+        'IsFeatured': rng.random() < 0.05,
+        'Description': 'Lorem ipsum dolor sit amet. ' * rng.randrange(2, 12),
+    }
+
+
+def products(count: int, seed: int = 42) -> Dict[Text, Dict[Text, Any]]:
+    rng = random.Random(seed)
+    return {f"prod-{i:07d}": product(rng, i) for i in range(count)}
+
+
+######################## Synthetic Store ########################
+
+ORDER_STATUSES = ['OrderStatus.processing', 'OrderStatus.shipped', 'OrderStatus.pending',
+                  'OrderStatus.delivered', 'OrderStatus.cancelled']
+FIRST_NAMES = ['Aisha', 'Rahul', 'Fatima', 'Arjun', 'Meera', 'Sameer', 'Nadia', 'Vikram', 'Zara', 'Kiran']
+LAST_NAMES = ['Khan', 'Nair', 'Sharma', 'Menon', 'Iyer', 'Das', 'Rao', 'Pillai', 'Ali', 'Joseph']
+CATEGORY_NAMES = ['Furniture', 'Lighting', 'Decor', 'Textiles', 'Kitchen', 'Outdoor']
+SUBCATEGORY_NAMES = ['Living Room', 'Bedroom', 'Dining', 'Office', 'Kids', 'Bath', 'Garden',
+                     'Wall Art', 'Storage', 'Rugs', 'Curtains', 'Lamps', 'Vases', 'Cookware']
+
+
+def categories(count: int = 20) -> Dict[Text, Dict[Text, Any]]:
+    """Top-level categories (the first few featured) with the rest as their subcategories.
+
+    Ids match the `CategoryId`s `product()` assigns.
+    """
+    top = min(len(CATEGORY_NAMES), count)
+    docs = {}
+    for i in range(count):
+        if i < top:
+            docs[f"cat-{i}"] = {'Name': CATEGORY_NAMES[i], 'IsFeatured': i < 4}
+        else:
+            name = SUBCATEGORY_NAMES[(i - top) % len(SUBCATEGORY_NAMES)]
+            docs[f"cat-{i}"] = {'Name': f"{name} {i}" if i - top >= len(SUBCATEGORY_NAMES) else name,
+                                'IsFeatured': False, 'parentId': f"cat-{(i - top) % top}"}
+    return docs
+
+
+def brands(products: Dict[Text, Dict[Text, Any]]) -> Dict[Text, Dict[Text, Any]]:
+    counts: Dict[Text, int] = {}
+    for doc in products.values():
+        name = doc['Brand']['Name']
+        counts[name] = counts.get(name, 0) + 1
+    return {f"brand-{i}": {'Name': name, 'IsFeatured': i % 2 == 0, 'ProductsCount': counts.get(name, 0)}
+            for i, name in enumerate(BRANDS)}
+
+
+def users(count: int, seed: int = 42) -> Dict[Text, Dict[Text, Any]]:
+    rng = random.Random(seed)
+    docs = {}
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        docs[f"user-{i:06d}"] = {
+            'FirstName': first,
+            'LastName': last,
+            'Username': f"{first.lower()}{i}",
+            'Email': f"{first.lower()}.{last.lower()}{i}@example.com",
+            'Phone': f"+91 9{rng.randrange(10 ** 8, 10 ** 9)}",
+            'CreatedAt': f"2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+        }
+    return docs
+
+
+def orders(count: int, products: Dict[Text, Dict[Text, Any]], user_ids: List[Text],
+           seed: int = 42) -> Dict[Text, Dict[Text, Any]]:
+    rng = random.Random(seed)
+    # Dates come from their own stream, leaving the other fields' sequence unchanged.
+    dates = random.Random(f"{seed}:orderDate")
+    product_ids = list(products)
+    docs = {}
+    for i in range(count):
+        items = []
+        for product_id in rng.sample(product_ids, min(len(product_ids), rng.randrange(1, 5))):
+            items.append({'productId': product_id, 'quantity': rng.randrange(1, 4),
+                          'price': products[product_id]['Price']})
+        docs[f"order-{i:06d}"] = {
+            'userId': rng.choice(user_ids),
+            'status': rng.choice(ORDER_STATUSES),
+            'deliveryDate': f"2025-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+            'items': items,
+            'totalAmount': sum(item['price'] * item['quantity'] for item in items),
+            'orderDate': f"2025-{dates.randrange(1, 13):02d}-{dates.randrange(1, 29):02d}T"
+                         f"{dates.randrange(24):02d}:{dates.randrange(60):02d}:00",
+        }
+    return docs
+
+
+def store(product_count: int, seed: int = 42, order_count: Optional[int] = None,
+          user_count: Optional[int] = None) -> Dict[Text, Dict[Text, Dict[Text, Any]]]:
+    """Every collection the actions read, sized from the catalog unless given."""
+    catalog = products(product_count, seed)
+    user_docs = users(user_count if user_count is not None else max(100, product_count // 10), seed)
+    return {
+        'Products': catalog,
+        'Categories': categories(),
+        'Brands': brands(catalog),
+        'Users': user_docs,
+        'Orders': orders(order_count if order_count is not None else max(100, product_count // 5),
+                         catalog, list(user_docs), seed),
+    }